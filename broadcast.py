@@ -0,0 +1,286 @@
+"""
+Background broadcast jobs.
+
+A broadcast runs as an asyncio task, so the admin's callback returns at
+once. Recipients are read from the users table in user_id order, in
+batches. Each batch is sent concurrently (bounded by BROADCAST_CONCURRENCY;
+the outbound send scheduler enforces the API rate) and its per-recipient
+results are stored together with the job cursor, so a restarted bot
+resumes where it stopped. At most one batch can be re-sent after a crash.
+Database calls run in an executor, off the event loop.
+
+Only final outcomes are stored: sent, blocked or gone. Recipients whose
+send failed with a transient error (network, flood wait) stay pending and
+are retried after the main pass with a growing delay; a resumed job retries
+them as well. If the job itself fails (e.g. a database error) it stays
+'running' and is resumed on the next start.
+The admin's progress message is edited periodically and carries a cancel
+button.
+
+Failed sends are classified (see classify_send_error). Recipients who
+blocked the bot or no longer exist are marked inactive in the users table,
+so later broadcasts and user counts skip them until they /start again.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot, types
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound,
+                                TelegramRetryAfter)
+
+from config import (BROADCAST_CONCURRENCY, BROADCAST_BATCH_SIZE, BROADCAST_PROGRESS_INTERVAL,
+                    BROADCAST_RETRY_ROUNDS, BROADCAST_RETRY_DELAY)
+from localization import get_text
+from send_queue import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+# Send results
+SENT = "sent"
+FORBIDDEN = "forbidden"    # Blocked the bot, deactivated account, kicked from the chat
+NOT_FOUND = "not_found"    # Chat or user does not exist (any more)
+FLOOD = "flood"            # Still rate limited after the send scheduler's retries
+TRANSIENT = "transient"    # Network, server or other errors worth retrying later
+
+# Results that mean the user cannot be reached again
+UNREACHABLE = (FORBIDDEN, NOT_FOUND)
+
+# Bad Request descriptions that mean the recipient is gone
+_NOT_FOUND_ERRORS = ("chat not found", "user not found", "peer_id_invalid", "user_deactivated",
+                     "user is deactivated")
+
+
+def classify_send_error(error: Exception) -> str:
+    """Sort a failed send into FORBIDDEN, NOT_FOUND, FLOOD or TRANSIENT"""
+    if isinstance(error, TelegramForbiddenError):
+        return FORBIDDEN
+    if isinstance(error, TelegramNotFound):
+        return NOT_FOUND
+    if isinstance(error, TelegramBadRequest):
+        message = error.message.lower()
+        if any(text in message for text in _NOT_FOUND_ERRORS):
+            return NOT_FOUND
+        return TRANSIENT
+    if isinstance(error, TelegramRetryAfter):
+        return FLOOD
+    return TRANSIENT
+
+
+async def send_broadcast_payload(bot: Bot, user_id: int, payload: Dict[str, Any]) -> None:
+    """Send one broadcast message; raises on failure"""
+    content_type = payload["type"]
+    if content_type == "text":
+        await bot.send_message(user_id, payload["content"])
+    elif content_type == "photo":
+        await bot.send_photo(user_id, photo=payload["content"], caption=payload.get("caption", ""))
+    elif content_type == "video":
+        await bot.send_video(user_id, video=payload["content"], caption=payload.get("caption", ""))
+    elif content_type == "poll":
+        await bot.send_poll(user_id, question=payload["poll_question"], options=payload["poll_options"])
+    else:
+        raise ValueError(f"Unknown broadcast type: {content_type}")
+
+
+def cancel_keyboard(broadcast_id: int, lang: str) -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(inline_keyboard=[[
+        types.InlineKeyboardButton(text=get_text(lang, "btn_broadcast_cancel"),
+                                   callback_data=f"broadcast_cancel:{broadcast_id}")
+    ]])
+
+
+class BroadcastJob:
+    def __init__(self, row: Dict[str, Any]):
+        self.id = row["id"]
+        self.admin_id = row["admin_id"]
+        self.lang = row["lang"]
+        self.payload = json.loads(row["payload"])
+        self.total = row["total"]
+        self.sent = row["sent"]
+        self.failed = row["failed"]
+        self.cursor = row["cursor"]
+        self.progress_chat_id = row["progress_chat_id"]
+        self.progress_message_id = row["progress_message_id"]
+        self.cancelled = False
+        self.last_progress = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class BroadcastManager:
+    """Starts, resumes and cancels broadcast jobs"""
+    def __init__(self, concurrency: int = BROADCAST_CONCURRENCY, batch_size: int = BROADCAST_BATCH_SIZE,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL, retry_rounds: int = BROADCAST_RETRY_ROUNDS,
+                 retry_delay: float = BROADCAST_RETRY_DELAY, executor=None):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.retry_rounds = retry_rounds
+        self.retry_delay = retry_delay
+        # Database calls of running jobs go to this executor (None: the loop's default)
+        self.executor = executor
+        self.jobs: Dict[int, BroadcastJob] = {}
+        # Set by shard workers so only the worker owning the admin resumes a job
+        self.owns: Optional[Callable[[int], bool]] = None
+
+    async def start(self, bot: Bot, admin_id: int, lang: str, payload: Dict[str, Any],
+                    total: int, progress_message: types.Message) -> Optional[int]:
+        """Create a job and run it in the background. Returns the job id"""
+        from database import create_broadcast
+
+        broadcast_id = await self._db(create_broadcast, admin_id, lang, json.dumps(payload, ensure_ascii=False),
+                                      total, progress_message.chat.id, progress_message.message_id)
+        if broadcast_id is None:
+            return None
+        job = BroadcastJob({
+            "id": broadcast_id, "admin_id": admin_id, "lang": lang, "payload": json.dumps(payload),
+            "total": total, "sent": 0, "failed": 0, "cursor": 0,
+            "progress_chat_id": progress_message.chat.id, "progress_message_id": progress_message.message_id,
+        })
+        self._run(bot, job)
+        return broadcast_id
+
+    def resume(self, bot: Bot) -> int:
+        """Restart jobs interrupted by a restart. Returns the number resumed"""
+        from database import get_running_broadcasts
+
+        resumed = 0
+        for row in get_running_broadcasts():
+            if row["id"] in self.jobs or (self.owns is not None and not self.owns(row["admin_id"])):
+                continue
+            logger.info(f"Resuming broadcast {row['id']} after user {row['cursor']}")
+            self._run(bot, BroadcastJob(row))
+            resumed += 1
+        return resumed
+
+    def cancel(self, broadcast_id: int) -> bool:
+        """Ask a running job to stop after the current batch"""
+        job = self.jobs.get(broadcast_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def _run(self, bot: Bot, job: BroadcastJob) -> None:
+        self.jobs[job.id] = job
+        # Tasks copy the current context, so every send of the job is bulk traffic
+        with bulk_sends():
+            job.task = asyncio.get_running_loop().create_task(self._execute(bot, job))
+        job.task.add_done_callback(lambda _: self.jobs.pop(job.id, None))
+
+    async def _send_batch(self, bot: Bot, job: BroadcastJob, user_ids: List[int]) -> List[Tuple[int, str, Optional[str]]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id: int) -> Tuple[int, str, Optional[str]]:
+            async with semaphore:
+                try:
+                    await send_broadcast_payload(bot, user_id, job.payload)
+                    return user_id, SENT, None
+                except Exception as e:
+                    result = classify_send_error(e)
+                    if result in UNREACHABLE:
+                        logger.info(f"Broadcast {job.id}: user {user_id} is unreachable ({e})")
+                    else:
+                        logger.error(f"Failed to send broadcast {job.id} to {user_id}: {e}")
+                    return user_id, result, str(e)[:200]
+
+        return await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+    async def _db(self, function: Callable, *args: Any) -> Any:
+        """Run a blocking database call in the executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _send_and_save(self, bot: Bot, job: BroadcastJob, user_ids: List[int], final: bool = False) -> None:
+        """
+        Send to the users of a batch that have no result yet and store the outcomes
+        Transient failures are not stored (unless final), so they stay pending
+        for the retry rounds and for a resumed job
+        """
+        from database import get_broadcast_recipients_done, save_broadcast_progress, mark_users_inactive
+
+        # Skip recipients of a batch that was sent before a crash
+        done = await self._db(get_broadcast_recipients_done, job.id, user_ids)
+        pending = [user_id for user_id in user_ids if user_id not in done]
+        results = await self._send_batch(bot, job, pending)
+
+        finished = [result for result in results if final or result[1] == SENT or result[1] in UNREACHABLE]
+        sent = job.sent + sum(1 for _, status, _ in finished if status == SENT)
+        failed = job.failed + sum(1 for _, status, _ in finished if status != SENT)
+        await self._db(save_broadcast_progress, job.id, finished, job.cursor, sent, failed)
+        job.sent, job.failed = sent, failed
+        await self._db(mark_users_inactive, [user_id for user_id, status, _ in results if status in UNREACHABLE])
+
+    async def _progress(self, bot: Bot, job: BroadcastJob) -> None:
+        if time.monotonic() - job.last_progress >= self.progress_interval:
+            job.last_progress = time.monotonic()
+            await self._edit_progress(bot, job, "broadcast_progress", cancel_button=True)
+
+    async def _execute(self, bot: Bot, job: BroadcastJob) -> None:
+        from database import get_users_after, get_broadcast_pending, set_broadcast_status
+
+        try:
+            while not job.cancelled:
+                user_ids = await self._db(get_users_after, job.cursor, self.batch_size)
+                if not user_ids:
+                    break
+                # The cursor only covers users with a stored result or a pending retry
+                job.cursor = user_ids[-1]
+                await self._send_and_save(bot, job, user_ids)
+                await self._progress(bot, job)
+
+            # Retry users whose sends failed with a transient error, with backoff;
+            # the last round stores whatever the outcome is
+            for retry_round in range(self.retry_rounds):
+                after = 0
+                user_ids = await self._db(get_broadcast_pending, job.id, after, job.cursor, self.batch_size)
+                if job.cancelled or not user_ids:
+                    break
+                delay = self.retry_delay * 2 ** retry_round
+                logger.info(f"Broadcast {job.id}: retrying pending recipients in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                while user_ids and not job.cancelled:
+                    await self._send_and_save(bot, job, user_ids, final=retry_round == self.retry_rounds - 1)
+                    await self._progress(bot, job)
+                    after = user_ids[-1]
+                    user_ids = await self._db(get_broadcast_pending, job.id, after, job.cursor, self.batch_size)
+        except asyncio.CancelledError:
+            # Shutdown: the job stays 'running' and is resumed on the next start
+            raise
+        except Exception as e:
+            # The job stays 'running' with its cursor, so the next start resumes it
+            logger.error(f"Broadcast {job.id} interrupted: {e}")
+            await self._edit_progress(bot, job, "broadcast_interrupted")
+            return
+
+        status = "cancelled" if job.cancelled else "done"
+        try:
+            await self._db(set_broadcast_status, job.id, status)
+        except Exception as e:
+            logger.error(f"Error finishing broadcast {job.id}: {e}")
+        logger.info(f"Broadcast {job.id} {status}: {job.sent} sent, {job.failed} failed")
+        await self._edit_progress(bot, job, "broadcast_stopped" if job.cancelled else "broadcast_completed")
+
+    async def _edit_progress(self, bot: Bot, job: BroadcastJob, text_key: str, cancel_button: bool = False) -> None:
+        text = get_text(job.lang, text_key).format(
+            success_count=job.sent,
+            failed_count=job.failed,
+            total=job.total,
+        )
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=job.progress_chat_id,
+                message_id=job.progress_message_id,
+                reply_markup=cancel_keyboard(job.id, job.lang) if cancel_button else None,
+            )
+        except Exception as e:
+            # e.g. "message is not modified"
+            logger.debug(f"Could not update broadcast {job.id} progress: {e}")
+
+    async def stop(self) -> None:
+        """Stop running jobs for shutdown; they resume on the next start"""
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,49 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple, Union
+
+from aiogram import types
+from aiogram.fsm.context import FSMContext
+
+from localization import TEXTS
+
+logger = logging.getLogger(__name__)
+
+ButtonHandler = Callable[[types.Message, FSMContext, str], Awaitable[Any]]
+
+
+class ButtonRouter:
+    """
+    Dispatch reply keyboard buttons by their text
+    A text -> (button key, language) map is built once from localization.TEXTS,
+    so a pressed button is routed with one dict lookup and its language is known
+    without a database query. Handlers are registered per button key with
+    @button_router.button("btn_...") and are called as handler(message, state, lang).
+    """
+    def __init__(self, texts: Dict[str, Dict[str, str]] = TEXTS, prefix: str = "btn_"):
+        self.buttons: Dict[str, Tuple[str, str]] = {}
+        for lang, strings in texts.items():
+            for key, text in strings.items():
+                if not key.startswith(prefix):
+                    continue
+                known = self.buttons.setdefault(text, (key, lang))
+                if known[0] != key:
+                    logger.warning(f"Button text of {key} ({lang}) is already used by {known[0]}")
+        self.handlers: Dict[str, ButtonHandler] = {}
+
+    def button(self, key: str) -> Callable[[ButtonHandler], ButtonHandler]:
+        """Decorator registering the handler of a button"""
+        def decorator(handler: ButtonHandler) -> ButtonHandler:
+            self.handlers[key] = handler
+            return handler
+        return decorator
+
+    def match(self, message: types.Message) -> Union[bool, Dict[str, Tuple[str, str]]]:
+        """aiogram filter: passes the (key, lang) of a registered button to the handler"""
+        button = self.buttons.get(message.text)
+        if button is None or button[0] not in self.handlers:
+            return False
+        return {"button": button}
+
+    async def dispatch(self, message: types.Message, state: FSMContext, button: Tuple[str, str]) -> Any:
+        key, lang = button
+        return await self.handlers[key](message, state, lang)
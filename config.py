@@ -31,12 +31,99 @@ RATE_LIMIT = {
         "per_seconds": 60,
     }
 }
+# Users whose rate limit state is kept in memory (least recently seen are dropped first)
+RATE_LIMIT_MAX_USERS = int(os.environ.get("RATE_LIMIT_MAX_USERS", "100000"))
+# Where rate limit state lives: "memory" (this process) or "sqlite" (shared by
+# all processes through RATE_LIMIT_DB; e.g. /dev/shm/rate_limits.db)
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "rate_limits.db")
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics); 0 disables it.
+# Shard workers use METRICS_PORT + worker index
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Event loop lag sampling period, and the lag (seconds) after which the blocking
+# code's stack is captured and logged; 0 disables the capture
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD", "0.25"))
 
 # Performance settings
 MAX_CONCURRENT_PROCESSES = int(os.environ.get("MAX_CONCURRENT_PROCESSES", "10"))
 MAX_QUESTIONS_PER_TEST = int(os.environ.get("MAX_QUESTIONS_PER_TEST", "100"))
 AI_EXTRACTION_TIMEOUT = int(os.environ.get("AI_EXTRACTION_TIMEOUT", "30"))  # seconds
 
+# Quiz delivery: compact mode sends one poll per question (counter inside the poll, stop hint once per quiz)
+COMPACT_QUIZ_DELIVERY = os.environ.get("COMPACT_QUIZ_DELIVERY", "1").lower() in ("1", "true", "yes")
+# Seconds an unanswered quiz poll keeps routing answers to its session
+POLL_INDEX_TTL = int(os.environ.get("POLL_INDEX_TTL", str(24 * 60 * 60)))
+# Update delivery: "polling" (default) or "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+# Public HTTPS base URL Telegram posts updates to, e.g. https://bot.example.com
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+# Sent by Telegram in X-Telegram-Bot-Api-Secret-Token; requests without it are rejected.
+# Required in webhook mode
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8081"))
+# Acknowledge an update before it is processed (Telegram does not wait for the handler)
+WEBHOOK_FAST_ACK = os.environ.get("WEBHOOK_FAST_ACK", "1").lower() in ("1", "true", "yes")
+# Drop updates queued by Telegram when the bot starts; off so switching modes loses nothing
+DROP_PENDING_UPDATES = os.environ.get("DROP_PENDING_UPDATES", "0").lower() in ("1", "true", "yes")
+
+# Outbound send limits (Telegram: ~30 messages/s overall, ~1/s per private chat, 20/min per group)
+SEND_GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.environ.get("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.environ.get("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.environ.get("SEND_GROUP_RATE", str(20 / 60)))
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", "3"))  # retries after a 429 Flood Wait
+
+# Broadcasts: sends in flight, recipients per persisted batch, seconds between progress edits
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "25"))
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "200"))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get("BROADCAST_PROGRESS_INTERVAL", "5"))
+# Recipients whose send failed with a transient error (network, flood wait) are
+# retried after the main pass, up to BROADCAST_RETRY_ROUNDS times; the delay
+# before each round starts at BROADCAST_RETRY_DELAY seconds and doubles
+BROADCAST_RETRY_ROUNDS = int(os.environ.get("BROADCAST_RETRY_ROUNDS", "3"))
+BROADCAST_RETRY_DELAY = float(os.environ.get("BROADCAST_RETRY_DELAY", "30"))
+
+# Experimental: `python sharding.py` distributes updates to worker processes by
+# user id. Higher throughput has not been shown (the only measurement, on one
+# CPU, was slower than a single process), so it refuses to start unless enabled
+EXPERIMENTAL_SHARDING = os.environ.get("EXPERIMENTAL_SHARDING", "0").lower() in ("1", "true", "yes")
+# Worker processes for `python sharding.py`
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+
+# Timed quizzes: seconds per question (Telegram open_period, 5-600); 0 disables the timer
+QUIZ_QUESTION_TIME_MIN, QUIZ_QUESTION_TIME_MAX = 5, 600
+
+def question_time(seconds: int) -> int:
+    """Clamp a question time to what Telegram accepts as open_period; 0 or less disables the timer"""
+    if seconds <= 0:
+        return 0
+    clamped = min(max(seconds, QUIZ_QUESTION_TIME_MIN), QUIZ_QUESTION_TIME_MAX)
+    if clamped != seconds:
+        logging.getLogger(__name__).warning(
+            f"QUIZ_QUESTION_TIME={seconds} is outside {QUIZ_QUESTION_TIME_MIN}-{QUIZ_QUESTION_TIME_MAX} seconds, using {clamped}")
+    return clamped
+
+QUIZ_QUESTION_TIME = question_time(int(os.environ.get("QUIZ_QUESTION_TIME", "0")))
+# Unanswered questions in a row after which a timed quiz is closed
+QUIZ_MAX_MISSED = int(os.environ.get("QUIZ_MAX_MISSED", "3"))
+
+# Admin statistics report cache: directory, refresh at least every N seconds
+# when rows changed, or as soon as N new rows exist (checked every N seconds)
+REPORTS_DIR = os.environ.get("REPORTS_DIR", "reports")
+REPORT_REFRESH_INTERVAL = int(os.environ.get("REPORT_REFRESH_INTERVAL", "3600"))
+REPORT_REFRESH_ROWS = int(os.environ.get("REPORT_REFRESH_ROWS", "500"))
+REPORT_CHECK_INTERVAL = int(os.environ.get("REPORT_CHECK_INTERVAL", "60"))
+
+# Upload settings
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))  # bytes (Bot API download limit)
+UPLOAD_SPOOL_SIZE = int(os.environ.get("UPLOAD_SPOOL_SIZE", str(512 * 1024)))  # bytes kept in RAM before spilling to disk
+UPLOAD_TTL = int(os.environ.get("UPLOAD_TTL", "1800"))  # seconds a pending upload is kept while waiting for a test name
+
 # Logging configuration
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
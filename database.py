@@ -1,8 +1,11 @@
 import sqlite3
+import functools
+import inspect
 import logging
 import threading
 import queue
 from config import DATABASE_FILE
+import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -27,7 +30,8 @@ class ConnectionPool:
             # If the pool is empty, create a new connection if under the limit
             with self.lock:
                 if self.connection_count < self.max_connections:
-                    conn = sqlite3.connect(self.db_file, check_same_thread=False)
+                    # Wait for locks held by other worker processes instead of failing
+                    conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
                     conn.row_factory = sqlite3.Row  # Enable row factory for better row access
                     self.connection_count += 1
                     return conn
@@ -62,6 +66,21 @@ class ConnectionPool:
 # Create a global connection pool
 connection_pool = ConnectionPool(DATABASE_FILE)
 
+def timed(function):
+    """Record the function's run time in the db_query_seconds metric, labelled by its name"""
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with metrics.db_seconds.time(function.__name__):
+                return await function(*args, **kwargs)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.db_seconds.time(function.__name__):
+                return function(*args, **kwargs)
+    return wrapper
+
+@timed
 def init_db():
     """Initialize the database if it doesn't exist."""
     conn = None
@@ -96,9 +115,94 @@ def init_db():
         )
         ''')
         
+        # Users who blocked the bot or deleted their account are flagged
+        # inactive by broadcasts and skipped by later fan-outs
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'inactive' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN inactive INTEGER DEFAULT 0')
+        if 'inactive_at' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN inactive_at TIMESTAMP')
+        if 'language' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN language TEXT DEFAULT "uz"')
+        
+        # Change counter of the users table, bumped by triggers whenever a row is
+        # added, removed or changes a column shown in the admin report, so the
+        # report cache can tell that users.csv is stale
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER DEFAULT 0
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO change_counters (name, value) VALUES ('users', 0)")
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_changed_insert AFTER INSERT ON users
+        BEGIN UPDATE change_counters SET value = value + 1 WHERE name = 'users'; END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_changed_delete AFTER DELETE ON users
+        BEGIN UPDATE change_counters SET value = value + 1 WHERE name = 'users'; END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_changed_update AFTER UPDATE ON users
+        WHEN OLD.username IS NOT NEW.username OR OLD.first_name IS NOT NEW.first_name
+            OR OLD.last_name IS NOT NEW.last_name OR OLD.language IS NOT NEW.language
+            OR OLD.join_date IS NOT NEW.join_date OR OLD.inactive IS NOT NEW.inactive
+        BEGIN UPDATE change_counters SET value = value + 1 WHERE name = 'users'; END
+        ''')
+        
+        # Covers "reachable users in user_id order" (broadcast batches, counts)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_inactive ON users(inactive, user_id)')
+        
         # Create an index for faster user_id lookups in test_results
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_results_user_id ON test_results(user_id)')
         
+        # The poll index lives in memory with the FSM state it points into
+        # (see poll_index.py); drop the table earlier versions saved it to
+        cursor.execute('DROP TABLE IF EXISTS quiz_polls')
+        
+        # Broadcast jobs: users are sent to in user_id order, `cursor` is the
+        # last user_id of the last completed batch, so a job resumes after restart
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            lang TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'running',
+            total INTEGER,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            cursor INTEGER DEFAULT 0,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # Per-recipient result of a broadcast
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            status TEXT,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        )
+        ''')
+        
+        # Telegram file_id of uploaded local media files, valid while the file is unchanged
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_files (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER,
+            size INTEGER,
+            file_id TEXT
+        )
+        ''')
+        
         conn.commit()
         logger.info("Database initialized successfully")
     except sqlite3.Error as e:
@@ -110,6 +214,7 @@ def init_db():
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 def add_user(user_id, username=None, first_name=None, last_name=None):
     """Add a new user to the database or update existing user."""
     conn = None
@@ -122,10 +227,10 @@ def add_user(user_id, username=None, first_name=None, last_name=None):
         existing_user = cursor.fetchone()
         
         if existing_user:
-            # Update existing user
+            # Update existing user; a returning user is reachable again
             cursor.execute('''
             UPDATE users 
-            SET username = ?, first_name = ?, last_name = ?
+            SET username = ?, first_name = ?, last_name = ?, inactive = 0, inactive_at = NULL
             WHERE user_id = ?
             ''', (username, first_name, last_name, user_id))
         else:
@@ -147,6 +252,7 @@ def add_user(user_id, username=None, first_name=None, last_name=None):
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 def get_user(user_id):
     """Get user information from the database."""
     conn = None
@@ -174,6 +280,7 @@ def get_user(user_id):
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 def get_user_language(user_id):
     """Get user's preferred language."""
     conn = None
@@ -193,14 +300,18 @@ def get_user_language(user_id):
         if conn:
             connection_pool.return_connection(conn)
 
-def get_all_users():
-    """Get all users from the database."""
+@timed
+def get_all_users(reachable_only=False):
+    """Get all users from the database. reachable_only skips users marked inactive."""
     conn = None
     try:
         conn = connection_pool.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT user_id FROM users')
+        if reachable_only:
+            cursor.execute('SELECT user_id FROM users WHERE inactive = 0')
+        else:
+            cursor.execute('SELECT user_id FROM users')
         users = [row['user_id'] for row in cursor.fetchall()]
         
         return users
@@ -214,6 +325,27 @@ def get_all_users():
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
+def count_users(reachable_only=False):
+    """Number of users. reachable_only skips users marked inactive (counted on the inactive index)."""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        
+        if reachable_only:
+            cursor.execute('SELECT COUNT(*) FROM users WHERE inactive = 0')
+        else:
+            cursor.execute('SELECT COUNT(*) FROM users')
+        return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Error counting users: {e}")
+        return 0
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
 def remove_user(user_id):
     """Remove a user from the database."""
     conn = None
@@ -239,6 +371,7 @@ def remove_user(user_id):
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 async def update_user_language(user_id, language):
     """Update user's preferred language in the database."""
     conn = None
@@ -278,6 +411,7 @@ async def update_user_language(user_id, language):
 
 
 
+@timed
 def get_referrer(user_id):
     """Get the referrer of a user, if any."""
     conn = None
@@ -298,6 +432,7 @@ def get_referrer(user_id):
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 async def save_test_result(user_id, test_name, date, correct, total, percent, points):
     """Save a test result to the database."""
     conn = None
@@ -345,6 +480,7 @@ async def save_test_result(user_id, test_name, date, correct, total, percent, po
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 async def get_user_test_results(user_id):
     """Get all test results for a user."""
     conn = None
@@ -389,6 +525,7 @@ async def get_user_test_results(user_id):
         if conn:
             connection_pool.return_connection(conn)
 
+@timed
 async def get_all_test_results():
     """Get all test results from the database."""
     conn = None
@@ -418,6 +555,291 @@ async def get_all_test_results():
         logger.error(f"Error getting all test results: {e}")
         return []
 
+@timed
+def get_report_users():
+    """All users for the admin report: (user_id, username, first_name, last_name, language, join_date, inactive)"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT user_id, username, first_name, last_name, language, join_date, inactive
+        FROM users
+        ORDER BY user_id
+        ''')
+        return [tuple(row) for row in cursor.fetchall()]
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_report_test_results_after(last_id):
+    """Test results added after `last_id`, oldest first: (id, user_id, test_name, date, correct, total, percent, points)"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id, user_id, test_name, date, correct, total, percent, points
+        FROM test_results
+        WHERE id > ?
+        ORDER BY id
+        ''', (last_id,))
+        return [tuple(row) for row in cursor.fetchall()]
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_users_version():
+    """Change counter of the users table (see init_db)"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        return conn.execute("SELECT value FROM change_counters WHERE name = 'users'").fetchone()[0]
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def count_report_changes(last_id):
+    """(users change counter, number of test results added after `last_id`)"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        users = cursor.execute("SELECT value FROM change_counters WHERE name = 'users'").fetchone()[0]
+        results = cursor.execute('SELECT COUNT(*) FROM test_results WHERE id > ?', (last_id,)).fetchone()[0]
+        return users, results
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_users_after(after_user_id, limit):
+    """
+    Next `limit` reachable user ids greater than `after_user_id`, in ascending order
+    Raises on database errors: an empty list means the broadcast is done
+    """
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT user_id FROM users WHERE inactive = 0 AND user_id > ? ORDER BY user_id LIMIT ?',
+                       (after_user_id, limit))
+        return [row['user_id'] for row in cursor.fetchall()]
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def mark_users_inactive(user_ids):
+    """Flag users the bot can no longer reach (blocked the bot, deleted account)"""
+    if not user_ids:
+        return True
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+        UPDATE users SET inactive = 1, inactive_at = CURRENT_TIMESTAMP
+        WHERE user_id = ? AND inactive = 0
+        ''', [(user_id,) for user_id in user_ids])
+        
+        conn.commit()
+        logger.info(f"Marked {len(user_ids)} unreachable users inactive")
+        return True
+    except Exception as e:
+        logger.error(f"Error marking users inactive: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def create_broadcast(admin_id, lang, payload, total, progress_chat_id, progress_message_id):
+    """Create a broadcast job. payload is a JSON string. Returns the job id"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT INTO broadcasts (admin_id, lang, payload, total, progress_chat_id, progress_message_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (admin_id, lang, payload, total, progress_chat_id, progress_message_id))
+        
+        conn.commit()
+        return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"Error creating broadcast: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def save_broadcast_progress(broadcast_id, results, cursor_user_id, sent, failed, status='running'):
+    """
+    Store the results of a batch and advance the job cursor in one transaction
+    results: iterable of (user_id, status, error) of recipients that are done
+    Raises on database errors, so the job stops instead of skipping the batch
+    """
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+        INSERT OR REPLACE INTO broadcast_recipients (broadcast_id, user_id, status, error)
+        VALUES (?, ?, ?, ?)
+        ''', [(broadcast_id, user_id, result, error) for user_id, result, error in results])
+        cursor.execute('''
+        UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, status = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (cursor_user_id, sent, failed, status, broadcast_id))
+        
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving broadcast progress: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def set_broadcast_status(broadcast_id, status):
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('UPDATE broadcasts SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                       (status, broadcast_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error updating broadcast status: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_running_broadcasts():
+    """Broadcast jobs that were interrupted and should be resumed"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [dict(row) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting running broadcasts: {e}")
+        return []
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_broadcast_recipients_done(broadcast_id, user_ids):
+    """Subset of user_ids that already have a result in this broadcast (raises on database errors)"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(user_ids))
+        cursor.execute(f'''
+        SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND user_id IN ({placeholders})
+        ''', (broadcast_id, *user_ids))
+        return {row['user_id'] for row in cursor.fetchall()}
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_broadcast_pending(broadcast_id, after_user_id, up_to_user_id, limit):
+    """
+    Reachable users in (after_user_id, up_to_user_id] without a result in this
+    broadcast (their sends failed with a transient error), in ascending order
+    """
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT user_id FROM users
+        WHERE inactive = 0 AND user_id > ? AND user_id <= ?
+        AND user_id NOT IN (SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ?)
+        ORDER BY user_id LIMIT ?
+        ''', (after_user_id, up_to_user_id, broadcast_id, limit))
+        return [row['user_id'] for row in cursor.fetchall()]
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def get_media_file_ids():
+    """All cached media uploads as {path: (mtime_ns, size, file_id)}"""
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT path, mtime_ns, size, file_id FROM media_files')
+        return {row['path']: (row['mtime_ns'], row['size'], row['file_id']) for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error loading media file ids: {e}")
+        return {}
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def save_media_file_id(path, mtime_ns, size, file_id):
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO media_files (path, mtime_ns, size, file_id) VALUES (?, ?, ?, ?)',
+                       (path, mtime_ns, size, file_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving media file id: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
+@timed
+def enable_wal():
+    """
+    Switch the database to WAL journaling so several worker processes can
+    read while one writes. The setting is stored in the database file
+    """
+    conn = None
+    try:
+        conn = connection_pool.get_connection()
+        mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        logger.info(f"SQLite journal mode: {mode}")
+    except Exception as e:
+        logger.error(f"Error enabling WAL: {e}")
+    finally:
+        if conn:
+            connection_pool.return_connection(conn)
+
 # Function to close all database connections when shutting down
 def close_connections():
     """Close all database connections in the pool"""
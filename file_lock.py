@@ -0,0 +1,47 @@
+"""
+Inter-process file lock.
+
+Shard workers share user_tests.json and the reports directory, so writers
+take an exclusive lock on a side file first. fcntl.flock is used where it
+exists; on Windows the first byte of the lock file is locked with msvcrt.
+"""
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock(lock_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    lock_file.seek(0)
+    while True:
+        try:
+            # LK_LOCK retries for about 10 seconds before giving up
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock(lock_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def exclusive_lock(path: str):
+    """Hold an exclusive lock on `path` (created if missing) for the block"""
+    with open(path, 'a+b') as lock_file:
+        _lock(lock_file)
+        try:
+            yield
+        finally:
+            _unlock(lock_file)
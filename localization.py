@@ -16,7 +16,7 @@ TEXTS = {
         'btn_invite': "👥 Do'stlarni taklif qilish",
         'btn_admin_stats': "👤 Admin statistika",
         'btn_main_menu': "🏠 Bosh menyuga qaytish",
-        'upload_file': """📄 Iltimos, test faylini yuboring (.docx yoki .txt formatda).
+        'upload_file': """📄 Iltimos, test faylini yuboring (.docx, .txt, .xlsx yoki .csv formatda).
 
 Format quyidagicha bo'lishi kerak:
 
@@ -52,7 +52,11 @@ Namuna 2 (.txt fayllar uchun):
 +To'g'ri javob
 -Noto'g'ri javob 1
 -Noto'g'ri javob 2
--Noto'g'ri javob 3""",
+-Noto'g'ri javob 3
+
+Namuna 3 (.xlsx va .csv fayllar uchun):
+har bir qator - bitta savol
+A ustun: savol, B ustun: to'g'ri javob, C-F ustunlar: noto'g'ri javoblar""",
         'upload_word': """📄 .docx yoki .txt faylni yuboring.
 
 Namuna 1 (.docx fayllar uchun):
@@ -140,7 +144,8 @@ Namuna 2 (.txt fayllar uchun):
 
 <b>🤔 Muammolar bo'lsa, tugmasi orqali murojaat qiling.</b>""",
         'only_docx': "⚠️ Iltimos, faqat .docx formatdagi fayllarni yuboring!",
-        'only_docx_txt': "⚠️ Iltimos, faqat .docx yoki .txt formatdagi fayllarni yuboring!",
+        'only_docx_txt': "⚠️ Iltimos, faqat .docx, .txt, .xlsx yoki .csv formatdagi fayllarni yuboring!",
+        'file_too_large': "⚠️ Fayl juda katta. Iltimos, {max_size} MB dan kichik fayl yuboring.",
         'no_questions_found': "❌ Faylda savollar topilmadi. Iltimos, to'g'ri formatdagi faylni yuklang.",
         'enter_test_name': "📝 Testga nom bering (masalan: 'Fizika', 'Matematika test 1', ...)",
         'enter_test_name_error': "⚠️ Iltimos, testga nom bering!",
@@ -164,9 +169,14 @@ Namuna 2 (.txt fayllar uchun):
         'stats_general': "<b>📈 Umumiy ma'lumotlar:</b>\n👥 Jami foydalanuvchilar: <code>{users_count}</code>\n📝 Jami yuklangan testlar: <code>{tests_count}</code>\n",
         'stats_users_title': "<b>👤 Foydalanuvchilar ro'yxati:</b>",
         'user_count': "Bot foydalanuvchilari soni: {count}",
+        'stats_generating': "⏳ Hisobot tayyorlanmoqda...",
+        'stats_report_version': "🕒 Hisobot v{version}: {built_at}",
+        'error_creating_excel': "❌ Excel hisobotini yaratishda xatolik yuz berdi.",
         'test_file_forwarded': "👤 Yuqoridagi fayl {name} (@{username}) tomonidan yuborildi",
         'stop_info': "❗️ Testni to'xtatish uchun /stop buyrug'ini yuboring.",
         'test_stopped': "🛑 Test to'xtatildi!\n\n",
+        'quiz_time_limit': "⏱ Har bir savol uchun {seconds} soniya vaqt beriladi.",
+        'quiz_closed_inactive': "⏱ Bir necha savolga javob berilmagani uchun test yakunlandi.",
         'feedback_start': "Iltimos xabaringizni bitta xabarda yozing!",
         'feedback_prompt': "💬 Iltimos, o'z fikr-mulohazalaringiz yoki takliflaringizni yuboring:",
         'feedback_sent': "✅ Fikr-mulohazangiz uchun rahmat! Xabaringiz adminga yuborildi.",
@@ -195,6 +205,10 @@ Namuna 2 (.txt fayllar uchun):
         'broadcast_confirm_no': "❌ Yo'q, bekor qilish",
         'broadcast_completed': "✅ Xabar muvaffaqiyatli {success_count} ta foydalanuvchiga yuborildi.\n❌ {failed_count} ta foydalanuvchiga yuborib bo'lmadi.",
         'broadcast_canceled': "❌ Xabar tarqatish bekor qilindi.",
+        'broadcast_progress': "📣 Xabar tarqatilmoqda...\n✅ Yuborildi: {success_count} / {total}\n❌ Yuborilmadi: {failed_count}",
+        'broadcast_stopped': "⛔ Xabar tarqatish to'xtatildi.\n✅ {success_count} ta foydalanuvchiga yuborildi.\n❌ {failed_count} ta foydalanuvchiga yuborib bo'lmadi.",
+        'broadcast_interrupted': "⚠️ Xabar tarqatishda xatolik yuz berdi, bot qayta ishga tushganda davom etadi.\n✅ Yuborildi: {success_count} / {total}\n❌ Yuborilmadi: {failed_count}",
+        'btn_broadcast_cancel': "⛔ To'xtatish",
         'ai_analyzing': "🤖 Suniy intellekt faylni tahlil qilinmoqda... Iltimos, kuting.",
         'test_file_errors': "⚠️ Yuborilgan faylda ba'zi xatoliklar aniqlandi, shuning uchun test yechish jarayonida qiyinchiliklarga duch kelishingiz mumkin."
     },
@@ -211,7 +225,7 @@ Namuna 2 (.txt fayllar uchun):
         'btn_invite': "👥 Пригласить друзей",
         'btn_admin_stats': "👤 Статистика админа",
         'btn_main_menu': "🏠 Вернуться в главное меню",
-        'upload_file': """📄 Пожалуйста, загрузите тестовый файл (в формате .docx или .txt).
+        'upload_file': """📄 Пожалуйста, загрузите тестовый файл (в формате .docx, .txt, .xlsx или .csv).
 
 Формат должен быть следующим:
 
@@ -247,7 +261,11 @@ Question 2.
 +Правильный ответ
 -Неправильный ответ 1
 -Неправильный ответ 2
--Неправильный ответ 3""",
+-Неправильный ответ 3
+
+Таблица (для файлов .xlsx и .csv):
+каждая строка - один вопрос
+столбец A: вопрос, столбец B: правильный ответ, столбцы C-F: неправильные ответы""",
         'upload_word': """📄 Загрузите файл .docx или .txt.
 
 Старый формат (для файлов .docx):
@@ -335,7 +353,8 @@ Question 2.
 
 <b>🤔 Если у вас возникли проблемы, обратитесь через кнопку.</b>""",
         'only_docx': "⚠️ Пожалуйста, отправляйте только файлы в формате .docx!",
-        'only_docx_txt': "⚠️ Пожалуйста, отправляйте только файлы в формате .docx или .txt!",
+        'only_docx_txt': "⚠️ Пожалуйста, отправляйте только файлы в формате .docx, .txt, .xlsx или .csv!",
+        'file_too_large': "⚠️ Файл слишком большой. Пожалуйста, отправьте файл меньше {max_size} МБ.",
         'no_questions_found': "❌ В файле не найдены вопросы. Пожалуйста, загрузите файл в правильном формате.",
         'enter_test_name': "📝 Назовите тест (например: 'Физика', 'Математика тест 1', ...)",
         'enter_test_name_error': "⚠️ Пожалуйста, укажите название теста!",
@@ -359,9 +378,14 @@ Question 2.
         'stats_general': "<b>📈 Общая информация:</b>\n👥 Всего пользователей: <code>{users_count}</code>\n📝 Всего загруженных тестов: <code>{tests_count}</code>\n",
         'stats_users_title': "<b>👤 Список пользователей:</b>",
         'user_count': "Количество пользователей бота: {count}",
+        'stats_generating': "⏳ Отчёт формируется...",
+        'stats_report_version': "🕒 Отчёт v{version}: {built_at}",
+        'error_creating_excel': "❌ Ошибка при создании Excel-отчёта.",
         'test_file_forwarded': "👤 Вышеуказанный файл был отправлен пользователем {name} (@{username})",
         'stop_info': "❗️ Чтобы остановить тест, отправьте команду /stop.",
         'test_stopped': "🛑 Тест остановлен!\n\n",
+        'quiz_time_limit': "⏱ На каждый вопрос даётся {seconds} сек.",
+        'quiz_closed_inactive': "⏱ Тест завершён, так как несколько вопросов остались без ответа.",
         'feedback_start': "Пожалуйста, напишите ваше сообщение в одном сообщении!",
         'feedback_prompt': "💬 Пожалуйста, отправьте свои отзывы или предложения:",
         'feedback_sent': "✅ Спасибо за ваш отзыв! Ваше сообщение было отправлено администратору.",
@@ -390,6 +414,10 @@ Question 2.
         'broadcast_confirm_no': "❌ Нет, отменить",
         'broadcast_completed': "✅ Сообщение успешно отправлено {success_count} пользователям.\n❌ Не удалось отправить {failed_count} пользователям.",
         'broadcast_canceled': "❌ Рассылка отменена.",
+        'broadcast_progress': "📣 Идёт рассылка...\n✅ Отправлено: {success_count} / {total}\n❌ Не доставлено: {failed_count}",
+        'broadcast_stopped': "⛔ Рассылка остановлена.\n✅ Отправлено {success_count} пользователям.\n❌ Не удалось отправить {failed_count} пользователям.",
+        'broadcast_interrupted': "⚠️ Рассылка прервана из-за ошибки и продолжится после перезапуска бота.\n✅ Отправлено: {success_count} / {total}\n❌ Не доставлено: {failed_count}",
+        'btn_broadcast_cancel': "⛔ Остановить",
         'ai_analyzing': "🤖 Искусственный интеллект анализирует файл... Пожалуйста, подождите.",
         'test_file_errors': "⚠️ В отправленном файле обнаружены некоторые ошибки, поэтому вы можете столкнуться с трудностями при решении теста."
     }
@@ -0,0 +1,122 @@
+"""
+Event loop lag monitor.
+
+A task sleeps LOOP_LAG_INTERVAL seconds at a time and records how late it
+wakes up (event_loop_lag_seconds): any time the loop spends in blocking
+code (SQLite, json dumps, parsing, openpyxl, ...) shows up as lag.
+
+A watchdog thread notices when the task is overdue by more than
+LOOP_LAG_THRESHOLD and captures the event loop thread's stack while the
+blocking call is still running. When the loop gets back, the stall is
+recorded in event_loop_blocked_seconds, labelled by the innermost frame of
+the bot's own code, and logged with the stack. The histogram's total time
+per location (shown first by /perf) is the list of hot spots to fix.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+import metrics
+from config import LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Frames under this directory are the bot's code; library frames are skipped for the label
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Frames of the stack kept in the log message
+_STACK_LIMIT = 12
+
+
+def callback_frames(frames: List[traceback.FrameSummary]) -> List[traceback.FrameSummary]:
+    """Frames of the callback the loop is running (the event loop's own frames dropped)"""
+    for index in range(len(frames) - 1, -1, -1):
+        if frames[index].name == "_run" and frames[index].filename.endswith(os.path.join("asyncio", "events.py")):
+            return frames[index + 1:]
+    return frames
+
+
+def blocking_location(frames: List[traceback.FrameSummary]) -> str:
+    """'file.py:function' of the innermost project frame of a stack (outermost first)"""
+    for frame in reversed(frames):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PROJECT_DIR + os.sep) and filename != os.path.abspath(__file__) \
+                and os.sep + "site-packages" + os.sep not in filename:
+            return f"{os.path.relpath(filename, _PROJECT_DIR)}:{frame.name}"
+    return f"{os.path.basename(frames[-1].filename)}:{frames[-1].name}" if frames else "unknown"
+
+
+class LoopMonitor:
+    """
+    Samples event loop scheduling delay and finds the code that blocks it
+    threshold <= 0 only records the lag histogram (no watchdog thread)
+    """
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+        self.loop_thread_id: Optional[int] = None
+        # When the sampler is due to wake up; read by the watchdog thread
+        self.deadline = 0.0
+        # (location, formatted stack) captured by the watchdog for the current stall
+        self.capture: Optional[Tuple[str, str]] = None
+
+    async def _sample(self) -> None:
+        while True:
+            self.deadline = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self.deadline)
+            metrics.loop_lag_seconds.observe(lag)
+            capture, self.capture = self.capture, None
+            if self.threshold > 0 and lag >= self.threshold:
+                location, stack = capture or ("unknown", "")
+                metrics.loop_blocked_seconds.labels(location).observe(lag)
+                logger.warning(f"Event loop blocked for {lag:.3f}s in {location}\n{stack}".rstrip())
+
+    def _watch(self) -> None:
+        """Watchdog thread: capture the loop thread's stack during a stall"""
+        period = max(self.threshold / 4, 0.005)
+        captured_deadline = None
+        while not self.stopping.wait(period):
+            deadline = self.deadline
+            if deadline == captured_deadline or time.monotonic() - deadline < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            frames = callback_frames(traceback.extract_stack(frame))
+            del frame
+            # One capture per stall, taken while the blocking call is on the stack
+            captured_deadline = deadline
+            self.capture = (blocking_location(frames), "".join(traceback.format_list(frames[-_STACK_LIMIT:])))
+
+    def start(self) -> None:
+        if self.task is not None and not self.task.done():
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.deadline = time.monotonic() + self.interval
+        self.task = asyncio.get_running_loop().create_task(self._sample())
+        if self.threshold > 0:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+            self.thread.start()
+
+    async def stop(self) -> None:
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
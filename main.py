@@ -1,9 +1,10 @@
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
 from aiogram.filters import Command
-from docx import Document
 import asyncio
+import html
 import os
 import json
 import logging
@@ -14,12 +15,27 @@ import concurrent.futures
 from datetime import datetime
 from functools import partial
 
-from quiz_utils import convert_format, calculate_points, get_result_message, parse_text_file, ai_extract_questions
+from quiz_utils import parse_upload, calculate_points, get_result_message
 from storage import TestStorage
+from uploads import UploadStore, UploadTooLarge
+from quiz_session import QuizSession, PayloadCache
+from poll_index import PollIndex
+from media_cache import MediaCache
+from reports import ReportCache
+from loop_monitor import LoopMonitor
+from quiz_timer import DeadlineScheduler
+from webhook import WebhookServer
+from send_queue import OutboundScheduler, INTERACTIVE, BULK
+from broadcast import BroadcastManager, cancel_keyboard
+import metrics
 from localization import get_text
+from button_router import ButtonRouter
+from message_catalog import catalog
 from database import init_db, close_connections
-from middleware import RateLimiter, ErrorHandler
-from config import TOKEN, ADMIN_CHANNEL, FEEDBACK_CHANNEL, BOT_USERNAME, ADMINS, get_log_level, LOG_FORMAT, LOG_LEVEL, MAX_CONCURRENT_PROCESSES
+from middleware import RateLimiter, ErrorHandler, MetricsMiddleware, ApiMetricsMiddleware
+from config import TOKEN, ADMIN_CHANNEL, FEEDBACK_CHANNEL, BOT_USERNAME, ADMINS, get_log_level, LOG_FORMAT, LOG_LEVEL, MAX_CONCURRENT_PROCESSES, MAX_UPLOAD_SIZE, COMPACT_QUIZ_DELIVERY, QUIZ_QUESTION_TIME, QUIZ_MAX_MISSED, SEND_GLOBAL_RATE
+from config import BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_FAST_ACK, DROP_PENDING_UPDATES
+from config import METRICS_HOST, METRICS_PORT
 
 # Configure logging
 logging.basicConfig(level=get_log_level(LOG_LEVEL), format=LOG_FORMAT)
@@ -29,16 +45,68 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
 
-# Add middleware
-dp.update.middleware.register(RateLimiter())
+# All Bot API sends go through the outbound scheduler (rate limits, flood waits, priorities)
+send_scheduler = OutboundScheduler()
+bot.session.middleware(send_scheduler)
+# Registered after the scheduler, so it times the API request without the queue wait
+bot.session.middleware(ApiMetricsMiddleware())
+
+# Add middleware; metrics first so update timing includes rate limiting and error handling
+rate_limiter = RateLimiter()
+MetricsMiddleware().setup(dp)
+dp.update.middleware.register(rate_limiter)
 dp.update.middleware.register(ErrorHandler())
 
+# Numbers kept by other components, shown on the metrics endpoint and /perf
+metrics.register(send_scheduler.wait_time[INTERACTIVE])
+metrics.register(send_scheduler.wait_time[BULK])
+metrics.register_gauges("send_queue", send_scheduler.snapshot, "Outbound send queue")
+metrics.register_gauges("rate_limiter", lambda: {"limited": rate_limiter.limited}, "Rate limiter")
+
+# Reply keyboard buttons are routed by text with a single lookup; registered
+# before the state handlers so menu buttons work in any state
+button_router = ButtonRouter()
+dp.message(button_router.match)(button_router.dispatch)
+
 # Initialize test storage
 test_storage = TestStorage()
 
+# Pending uploads waiting for a test name (only the upload id is kept in FSM state)
+upload_store = UploadStore()
+
+# Sent quiz polls, used to route poll answers to their quiz session
+poll_index = PollIndex()
+
+# file_ids of uploaded local media (guide video, cached stats report)
+media_cache = MediaCache()
+
+# Admin stats report, rebuilt in the background
+report_cache = ReportCache()
+
+# Prometheus metrics endpoint (started when METRICS_PORT is set)
+metrics_server = None
+
+# Event loop lag sampler; logs and counts code that blocks the loop
+loop_monitor = LoopMonitor()
+
+# Next poll of each running quiz, prepared while the current one is being answered
+payload_cache = PayloadCache()
+
+# Webhook ingress, used when BOT_MODE is "webhook"
+webhook_server = WebhookServer(dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, fast_ack=WEBHOOK_FAST_ACK)
+
+# Seconds added to a timed question's open_period before it counts as unanswered
+QUESTION_TIMER_GRACE = 2
+
+# Upload formats accepted by handle_docs
+SUPPORTED_FILE_TYPES = ("docx", "txt", "xlsx", "csv")
+
 # Thread pool for CPU-bound tasks
 thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PROCESSES)
 
+# Background broadcast jobs (resumed after a restart); their database calls use the thread pool
+broadcast_manager = BroadcastManager(executor=thread_pool)
+
 
 
 class QuizStates(StatesGroup):
@@ -101,16 +169,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
     welcome_text = get_text(lang, "select_language")
     
     # Language selection keyboard
-    keyboard = types.InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                types.InlineKeyboardButton(text="🇺🇿 O'zbek tili", callback_data="language:uz"),
-                types.InlineKeyboardButton(text="🇷🇺 Русский язык", callback_data="language:ru")
-            ]
-        ]
-    )
-    
-    await message.answer(welcome_text, reply_markup=keyboard, parse_mode="HTML")
+    await message.answer(welcome_text, reply_markup=catalog.language_keyboard, parse_mode="HTML")
     await state.set_state(QuizStates.waiting_for_language)
 
 @dp.callback_query(lambda c: c.data.startswith("language:"))
@@ -147,55 +206,22 @@ async def show_main_menu(message: types.Message, lang=None):
     if lang is None:
         lang = await get_user_language(message.from_user.id)
     
-    keyboard_buttons = [
-        [
-            types.KeyboardButton(text=get_text(lang, "btn_create_quiz")), 
-            types.KeyboardButton(text=get_text(lang, "btn_my_tests"))
-        ],
-        [
-            types.KeyboardButton(text=get_text(lang, "btn_results")), 
-            types.KeyboardButton(text=get_text(lang, "btn_guide"))
-        ],
-        [
-            types.KeyboardButton(text=get_text(lang, "btn_feedback")),
-            types.KeyboardButton(text=get_text(lang, "btn_invite"))
-        ],
-        [
-            types.KeyboardButton(text="📱 Web Quiz App")
-        ]
-    ]
-    
-    if is_admin(message.from_user.id):
-        keyboard_buttons.append([
-            types.KeyboardButton(text=get_text(lang, "btn_admin_stats")),
-            types.KeyboardButton(text=get_text(lang, "btn_broadcast"))
-        ])
-    
-    keyboard = types.ReplyKeyboardMarkup(
-        keyboard=keyboard_buttons,
-        resize_keyboard=True,
-        input_field_placeholder=get_text(lang, "menu_placeholder")
-    )
+    # Admins get the admin buttons in an extra row
+    keyboard = catalog.keyboard(lang, "main_menu_admin" if is_admin(message.from_user.id) else "main_menu")
     
     await message.answer(get_text(lang, "bot_welcome"), reply_markup=keyboard, parse_mode="HTML")
 
 # Button handlers for create quiz
-@dp.message(lambda message: message.text == get_text("uz", "btn_create_quiz") or 
-                         message.text == get_text("ru", "btn_create_quiz"))
-async def quiz_create(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    lang = await get_user_language(user_id)
-    
+@button_router.button("btn_create_quiz")
+async def quiz_create(message: types.Message, state: FSMContext, lang: str):
     # Updated message to mention both .docx and .txt support
     await message.answer(get_text(lang, "upload_file"))
     await state.set_state(QuizStates.waiting_for_file)
 
 # Button handlers for my results
-@dp.message(lambda message: message.text == get_text("uz", "btn_results") or 
-                         message.text == get_text("ru", "btn_results"))
-async def show_results(message: types.Message):
+@button_router.button("btn_results")
+async def show_results(message: types.Message, state: FSMContext, lang: str):
     user_id = message.from_user.id
-    lang = await get_user_language(user_id)
     
     # Get user's test results from database
     from database import get_user_test_results
@@ -232,388 +258,50 @@ async def show_results(message: types.Message):
     await message.answer(final_message, parse_mode="HTML")
 
 # Button handlers for admin statistics
-@dp.message(lambda message: message.text == get_text("uz", "btn_admin_stats") or 
-                         message.text == get_text("ru", "btn_admin_stats"))
-async def admin_statistics(message: types.Message):
+@button_router.button("btn_admin_stats")
+async def admin_statistics(message: types.Message, state: FSMContext, lang: str):
+    if not is_admin(message.from_user.id):
+        return
+    
+    # The report is cached; only the very first request has to wait for a build
+    progress = None
+    if report_cache.manifest() is None or not os.path.exists(report_cache.workbook_path):
+        progress = await message.answer(get_text(lang, "stats_generating"))
     try:
-        if not is_admin(message.from_user.id):
-            return
-        
-        lang = await get_user_language(message.from_user.id)
-        
-        # Get total users from database
-        from database import get_all_users, get_all_test_results
-        users = get_all_users()
-        total_users = len(users)
-        
-        # Count total quizzes from database
-        test_results = await get_all_test_results()
-        total_quizzes = len(test_results)
-        
-        # Create stats summary text
-        stats_text = get_text(lang, "stats_title") + "\n\n"
-        stats_text += get_text(lang, "stats_general").format(users_count=total_users, tests_count=total_quizzes)
-        
-        # Send stats summary first
-        await message.answer(stats_text, parse_mode="HTML")
-        
-        # Create users list as file content
-        users_text = get_text(lang, "stats_users_title") + "\n\n"
-        
-        # Get all users from database with their details
-        from database import get_user
-        for user_id in users:
-            try:
-                user = get_user(user_id)
-                if user:
-                    lang_info = f" - {user.get('language', 'uz')}" if user.get('language') else ""
-                    users_text += f"- {user.get('full_name', 'Unknown')} (@{user.get('username', 'noname')}){lang_info}\n" \
-                                  f"  ID: {user_id}\n" \
-                                  f"  Joined: {user.get('join_date', 'Unknown')}\n\n"
-                else:
-                    users_text += f"- Unknown user (ID: {user_id})\n\n"
-            except Exception as e:
-                logger.error(f"Error getting user {user_id} details: {e}")
-                users_text += f"- Error getting user details (ID: {user_id})\n\n"
-        
-        # Create Excel file
-        try:
-            import io
-            from datetime import datetime
-            import openpyxl
-            from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-            
-            today = datetime.now().strftime("%Y-%m-%d")
-            
-            # Create Excel file with two sheets: Users and Test Results
-            wb = openpyxl.Workbook()
-            
-            # First sheet: Users
-            ws_users = wb.active
-            ws_users.title = "Users"
-            
-            # Add header with formatting
-            header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-            header_font = Font(color="FFFFFF", bold=True)
-            border = Border(
-                left=Side(style='thin'), 
-                right=Side(style='thin'), 
-                top=Side(style='thin'), 
-                bottom=Side(style='thin')
-            )
-            
-            # Set header cells for Users sheet
-            headers_users = ["Name", "Username", "ID", "Language", "Joined Date"]
-            for col, header in enumerate(headers_users, 1):
-                cell = ws_users.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.border = border
-                cell.alignment = Alignment(horizontal='center')
-            
-            # Add user data to Users sheet
-            row = 2
-            for user_id in users:
-                try:
-                    user = get_user(user_id)
-                    if user:
-                        # Combine first_name and last_name for the full name
-                        first_name = user.get('first_name', '')
-                        last_name = user.get('last_name', '')
-                        full_name = f"{first_name} {last_name}".strip()
-                        if not full_name:
-                            full_name = 'Unknown'
-                            
-                        ws_users.cell(row=row, column=1, value=full_name)
-                        ws_users.cell(row=row, column=2, value=f"@{user.get('username', 'noname')}")
-                        ws_users.cell(row=row, column=3, value=str(user_id))
-                        ws_users.cell(row=row, column=4, value=user.get('language', 'uz'))
-                        ws_users.cell(row=row, column=5, value=user.get('join_date', 'Unknown'))
-                        
-                        # Apply border to cells
-                        for col in range(1, 6):
-                            ws_users.cell(row=row, column=col).border = border
-                        
-                        row += 1
-                    else:
-                        ws_users.cell(row=row, column=1, value="Unknown user")
-                        ws_users.cell(row=row, column=2, value="")
-                        ws_users.cell(row=row, column=3, value=str(user_id))
-                        ws_users.cell(row=row, column=4, value="")
-                        ws_users.cell(row=row, column=5, value="")
-                        
-                        # Apply border to cells
-                        for col in range(1, 6):
-                            ws_users.cell(row=row, column=col).border = border
-                        
-                        row += 1
-                except Exception as e:
-                    logger.error(f"Error adding user {user_id} to Excel: {e}")
-                    ws_users.cell(row=row, column=1, value=f"Error (ID: {user_id})")
-                    ws_users.cell(row=row, column=2, value="")
-                    ws_users.cell(row=row, column=3, value=str(user_id))
-                    ws_users.cell(row=row, column=4, value="")
-                    ws_users.cell(row=row, column=5, value="")
-                    
-                    # Apply border to cells
-                    for col in range(1, 6):
-                        ws_users.cell(row=row, column=col).border = border
-                    
-                    row += 1
-            
-            # Second sheet: Test Results
-            ws_results = wb.create_sheet("Test Results")
-            
-            # Set header cells for Test Results sheet
-            headers_results = ["User ID", "Test Name", "Date", "Correct", "Total", "Percent", "Points"]
-            for col, header in enumerate(headers_results, 1):
-                cell = ws_results.cell(row=1, column=col, value=header)
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.border = border
-                cell.alignment = Alignment(horizontal='center')
-            
-            # Add test results data
-            row = 2
-            for result in test_results:
-                try:
-                    ws_results.cell(row=row, column=1, value=result['user_id'])
-                    ws_results.cell(row=row, column=2, value=result['test_name'])
-                    ws_results.cell(row=row, column=3, value=result['date'])
-                    ws_results.cell(row=row, column=4, value=result['correct'])
-                    ws_results.cell(row=row, column=5, value=result['total'])
-                    ws_results.cell(row=row, column=6, value=result['percent'])
-                    ws_results.cell(row=row, column=7, value=result['points'])
-                    
-                    # Apply border to cells
-                    for col in range(1, 8):
-                        ws_results.cell(row=row, column=col).border = border
-                    
-                    row += 1
-                except Exception as e:
-                    logger.error(f"Error adding test result to Excel: {e}")
-                    continue
-            
-            # Auto-adjust column width for both sheets
-            for ws in wb.worksheets:
-                for col in ws.columns:
-                    max_length = 0
-                    column = col[0].column_letter
-                    for cell in col:
-                        if cell.value:
-                            max_length = max(max_length, len(str(cell.value)))
-                    adjusted_width = (max_length + 2)
-                    ws.column_dimensions[column].width = adjusted_width
-            
-            # Save Excel file to BytesIO object
-            excel_file = io.BytesIO()
-            wb.save(excel_file)
-            excel_file.seek(0)
-            
-            # Create text file as alternative
-            file_name_txt = f"users_list_{today}.txt"
-            users_file_txt = io.BytesIO(users_text.encode('utf-8'))
-            
-            # Send Excel file first
-            await message.answer_document(
-                types.BufferedInputFile(
-                    file=excel_file.getvalue(),
-                    filename=f"users_stats_{today}.xlsx"
-                ),
-                caption=f"📊 Excel {get_text(lang, 'user_count').format(count=total_users)}"
-            )
-            
-            # Send text file
-            await message.answer_document(
-                types.BufferedInputFile(
-                    file=users_file_txt.getvalue(),
-                    filename=file_name_txt
-                ),
-                caption=f"📝 Text {get_text(lang, 'user_count').format(count=total_users)}"
-            )
-            
-            # Clean up
-            excel_file.close()
-            users_file_txt.close()
-            
-        except Exception as e:
-            logger.error(f"Error creating Excel file: {e}")
-            await message.answer(get_text(lang, "error_creating_excel"))
-            
+        report = await report_cache.get(thread_pool)
     except Exception as e:
-        logger.error(f"Error in admin_statistics: {e}")
-        await message.answer(get_text(lang, "error_general"))
-    
-    # Create stats summary text
-    stats_text = get_text(lang, "stats_title") + "\n\n"
-    stats_text += get_text(lang, "stats_general").format(users_count=total_users, tests_count=total_quizzes)
-    
-    # Send stats summary first
-    await message.answer(stats_text, parse_mode="HTML")
-    
-    # Create users list as file content
-    users_text = get_text(lang, "stats_users_title") + "\n\n"
-    
-    # Get all users from database with their details
-    from database import get_user
-    users_text = get_text(lang, "stats_users_title") + "\n\n"
-    
-    for user_id in users:
-        user = get_user(user_id)
-        if user:
-            lang_info = f" - {user.get('language', 'uz')}" if user.get('language') else ""
-            users_text += f"- {user.get('full_name', 'Unknown')} (@{user.get('username', 'noname')}){lang_info}\n" \
-                          f"  ID: {user_id}\n" \
-                          f"  Joined: {user.get('join_date', 'Unknown')}\n\n"
-        else:
-            users_text += f"- Unknown user (ID: {user_id})\n\n"
-    
-    # Create and send users list as a text file
-    import io
-    from datetime import datetime
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    
-    today = datetime.now().strftime("%Y-%m-%d")
-    
-    # Create Excel file with two sheets: Users and Test Results
-    wb = openpyxl.Workbook()
-    
-    # First sheet: Users
-    ws_users = wb.active
-    ws_users.title = "Users"
-    
-    # Add header with formatting
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    border = Border(
-        left=Side(style='thin'), 
-        right=Side(style='thin'), 
-        top=Side(style='thin'), 
-        bottom=Side(style='thin')
-    )
+        logger.error(f"Error creating Excel file: {e}")
+        error_text = get_text(lang, "error_creating_excel")
+        await (progress.edit_text(error_text) if progress else message.answer(error_text))
+        return
     
-    # Set header cells for Users sheet
-    headers_users = ["Name", "Username", "ID", "Language", "Joined Date"]
-    for col, header in enumerate(headers_users, 1):
-        cell = ws_users.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Add user data to Users sheet
-    row = 2
-    for user_id in users:
-        user = get_user(user_id)
-        if user:
-            ws_users.cell(row=row, column=1, value=user.get('full_name', 'Unknown'))
-            ws_users.cell(row=row, column=2, value=f"@{user.get('username', 'noname')}")
-            ws_users.cell(row=row, column=3, value=str(user_id))
-            ws_users.cell(row=row, column=4, value=user.get('language', 'uz'))
-            ws_users.cell(row=row, column=5, value=user.get('join_date', 'Unknown'))
-            
-            # Apply border to cells
-            for col in range(1, 6):
-                ws_users.cell(row=row, column=col).border = border
-            
-            row += 1
+    try:
+        stats_text = get_text(lang, "stats_title") + "\n\n"
+        stats_text += get_text(lang, "stats_general").format(users_count=report["users_count"],
+                                                             tests_count=report["tests_count"])
+        stats_text += get_text(lang, "stats_report_version").format(version=report["version"],
+                                                                    built_at=report["built_at"])
+        if progress:
+            await progress.edit_text(stats_text, parse_mode="HTML")
         else:
-            ws_users.cell(row=row, column=1, value="Unknown user")
-            ws_users.cell(row=row, column=2, value="")
-            ws_users.cell(row=row, column=3, value=str(user_id))
-            ws_users.cell(row=row, column=4, value="")
-            ws_users.cell(row=row, column=5, value="")
-            
-            # Apply border to cells
-            for col in range(1, 6):
-                ws_users.cell(row=row, column=col).border = border
-            
-            row += 1
-    
-    # Second sheet: Test Results
-    ws_results = wb.create_sheet("Test Results")
-    
-    # Set header cells for Test Results sheet
-    headers_results = ["User ID", "Test Name", "Date", "Correct", "Total", "Percent", "Points"]
-    for col, header in enumerate(headers_results, 1):
-        cell = ws_results.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Add test results data
-    row = 2
-    for result in test_results:
-        ws_results.cell(row=row, column=1, value=result['user_id'])
-        ws_results.cell(row=row, column=2, value=result['test_name'])
-        ws_results.cell(row=row, column=3, value=result['date'])
-        ws_results.cell(row=row, column=4, value=result['correct'])
-        ws_results.cell(row=row, column=5, value=result['total'])
-        ws_results.cell(row=row, column=6, value=result['percent'])
-        ws_results.cell(row=row, column=7, value=result['points'])
-        
-        # Apply border to cells
-        for col in range(1, 8):
-            ws_results.cell(row=row, column=col).border = border
-        
-        row += 1
-    
-    # Auto-adjust column width for both sheets
-    for ws in wb.worksheets:
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column].width = adjusted_width
-        for cell in col:
-            if cell.value:
-                max_length = max(max_length, len(str(cell.value)))
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-    
-    # Save Excel file to BytesIO object
-    excel_file = io.BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
-    
-    # Create text file as alternative
-    file_name_txt = f"users_list_{today}.txt"
-    users_file_txt = io.BytesIO(users_text.encode('utf-8'))
-    
-    # Send Excel file first
-    await message.answer_document(
-        types.BufferedInputFile(
-            file=excel_file.getvalue(),
-            filename=f"users_stats_{today}.xlsx"
-        ),
-        caption=f"📊 Excel {get_text(lang, 'user_count').format(count=total_users)}"
-    )
-    
-    # Send text file
-    await message.answer_document(
-        types.BufferedInputFile(
-            file=users_file_txt.getvalue(),
-            filename=file_name_txt
-        ),
-        caption=f"📝 Text {get_text(lang, 'user_count').format(count=total_users)}"
-    )
-    
-    # Clean up
-    excel_file.close()
-    users_file_txt.close()
-    
+            await message.answer(stats_text, parse_mode="HTML")
+        # Repeated requests reuse the uploaded file until the next build
+        await media_cache.send(
+            message.answer_document,
+            report_cache.workbook_path,
+            "document",
+            filename=f"users_stats_{report['built_at'][:10]}.xlsx",
+            caption=f"📊 Excel {get_text(lang, 'user_count').format(count=report['users_count'])}"
+        )
+    except Exception as e:
+        logger.error(f"Error in admin_statistics: {e}")
 
 # Button handlers for my tests
-@dp.message(lambda message: message.text == get_text("uz", "btn_my_tests") or 
-                         message.text == get_text("ru", "btn_my_tests"))
-async def show_my_tests(message: types.Message, state: FSMContext):
+@button_router.button("btn_my_tests")
+async def show_my_tests(message: types.Message, state: FSMContext, lang: str = None):
     user_id = message.from_user.id
-    lang = await get_user_language(user_id)
+    if lang is None:
+        lang = await get_user_language(user_id)
     
     tests = test_storage.get_user_tests(user_id)
     
@@ -641,7 +329,7 @@ async def process_test_selection(callback_query: types.CallbackQuery, state: FSM
     user_id = callback_query.from_user.id
     lang = await get_user_language(user_id)
     test_index = int(callback_query.data.split(':')[1])
-    test = test_storage.get_test(user_id, test_index)
+    test = test_storage.get_test_info(user_id, test_index)
     
     if not test:
         await callback_query.message.answer(get_text(lang, "test_not_found"))
@@ -659,7 +347,7 @@ async def process_test_selection(callback_query: types.CallbackQuery, state: FSM
     
     test_info = get_text(lang, "test_info").format(
         name=test['name'], 
-        question_count=len(test['questions']), 
+        question_count=test['question_count'], 
         created_at=test['created_at']
     )
     
@@ -672,22 +360,23 @@ async def start_saved_test(callback_query: types.CallbackQuery, state: FSMContex
     user_id = callback_query.from_user.id
     lang = await get_user_language(user_id)
     test_index = int(callback_query.data.split(':')[1])
-    test = test_storage.get_test(user_id, test_index)
+    test = test_storage.get_test_info(user_id, test_index)
     
     if not test:
         await callback_query.message.answer(get_text(lang, "test_not_found"))
         return
     
-    # Ask for range
-    questions = test["questions"]
+    # Ask for range; the quiz references the saved test instead of copying its questions
+    question_count = test["question_count"]
     await state.update_data(
-        questions=questions,
-        test_name=test["name"]
+        test_id=test["id"],
+        test_name=test["name"],
+        question_count=question_count
     )
     
     await callback_query.message.answer(
-        f"📚 {test['name']}: {len(questions)} {'savol' if lang == 'uz' else 'вопросов'}.\n"
-        f"{get_text(lang, 'test_saved').format(name=test['name'], count=len(questions))}"
+        f"📚 {test['name']}: {question_count} {'savol' if lang == 'uz' else 'вопросов'}.\n"
+        f"{get_text(lang, 'test_saved').format(name=test['name'], count=question_count)}"
     )
     await state.set_state(QuizStates.waiting_for_range)
 
@@ -714,13 +403,10 @@ async def back_to_tests_list(callback_query: types.CallbackQuery, state: FSMCont
     await show_my_tests(callback_query.message, state)
 
 # Button handlers for guide (renamed from help)
-@dp.message(lambda message: message.text == get_text("uz", "btn_guide") or 
-                         message.text == get_text("ru", "btn_guide"))
-async def show_guide(message: types.Message):
+@button_router.button("btn_guide")
+async def show_guide(message: types.Message, state: FSMContext, lang: str):
     # Guide is available to all users without any restrictions,
     # so no need to check for invites
-    user_id = message.from_user.id
-    lang = await get_user_language(user_id)
     help_title = get_text(lang, "help_title")
     help_text = get_text(lang, "help_text")
     
@@ -731,14 +417,13 @@ async def show_guide(message: types.Message):
     manual_video_path = "media/manual.mp4"
     if os.path.exists(manual_video_path) and os.path.getsize(manual_video_path) > 0:
         try:
-            with open(manual_video_path, 'rb') as video_file:
-                await message.answer_video(
-                    video=types.BufferedInputFile(
-                        file=video_file.read(),
-                        filename="manual.mp4"
-                    ),
-                    caption=get_text(lang, "video_guide_caption") if lang in ["uz", "ru"] else "Video guide on how to use the bot"
-                )
+            # Uploaded once; later requests reuse the cached file_id
+            await media_cache.send(
+                message.answer_video,
+                manual_video_path,
+                "video",
+                caption=get_text(lang, "video_guide_caption") if lang in ["uz", "ru"] else "Video guide on how to use the bot"
+            )
             logger.info(f"Sent guide video to user {message.from_user.id}")
         except Exception as e:
             logger.error(f"Failed to send guide video: {e}")
@@ -757,11 +442,18 @@ async def cmd_users(message: types.Message):
     user_count = len(user_data.users)
     await message.answer(get_text(lang, "user_count").format(count=user_count))
 
+# Performance overview for admins (same numbers as the metrics endpoint)
+@dp.message(Command("perf"))
+async def cmd_perf(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    
+    # Telegram messages are limited to 4096 characters
+    await message.answer(f"<pre>{html.escape(metrics.summary()[:4000])}</pre>", parse_mode="HTML")
+
 # Add feedback feature
-@dp.message(lambda message: message.text == get_text("uz", "btn_feedback") or 
-                         message.text == get_text("ru", "btn_feedback"))
-async def start_feedback(message: types.Message, state: FSMContext):
-    lang = await get_user_language(message.from_user.id)
+@button_router.button("btn_feedback")
+async def start_feedback(message: types.Message, state: FSMContext, lang: str):
     await message.answer(get_text(lang, "feedback_start"))
     await state.set_state(QuizStates.waiting_for_feedback)
 
@@ -867,10 +559,10 @@ async def cmd_stop_quiz(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     lang = await get_user_language(user_id)
     data = await state.get_data()
+    session = QuizSession.from_state(data.get('session'))
     
-    current_question = data.get('current_question', 0)
-    total_questions = data.get('total_questions', 0)
-    correct_answers = data.get('correct_answers', 0)
+    current_question = session.current if session else 0
+    correct_answers = session.correct if session else 0
     
     # Generate partial results
     result_message = get_text(lang, "test_stopped")
@@ -878,20 +570,20 @@ async def cmd_stop_quiz(message: types.Message, state: FSMContext):
         result_message += get_result_message(correct_answers, current_question)
     
     # Add return to main menu button
-    keyboard = types.ReplyKeyboardMarkup(
-        keyboard=[
-            [types.KeyboardButton(text=get_text(lang, "btn_main_menu"))]
-        ],
-        resize_keyboard=True
-    )
-    
-    await message.answer(result_message, reply_markup=keyboard, parse_mode="HTML")
+    await message.answer(result_message, reply_markup=catalog.keyboard(lang, "back_to_menu"), parse_mode="HTML")
     await state.clear()
+    if session:
+        payload_cache.discard(session.session_id)
+        question_timer.cancel(session.session_id)
 
 @dp.poll_answer()
 async def handle_poll_answer(poll_answer: types.PollAnswer, state: FSMContext):
     user_id = poll_answer.user.id
-    lang = await get_user_language(user_id)
+    
+    # Route the answer by poll id; unknown, expired and repeated answers are ignored
+    entry = poll_index.pop(poll_answer.poll_id)
+    if entry is None or entry.user_id != user_id:
+        return
     
     # Get current state data
     current_state = await state.get_state()
@@ -899,262 +591,272 @@ async def handle_poll_answer(poll_answer: types.PollAnswer, state: FSMContext):
         return
     
     data = await state.get_data()
+    session = QuizSession.from_state(data.get('session'))
+    if session is None or session.session_id != entry.session_id or session.current != entry.question:
+        # Answer to a poll of a finished quiz or an earlier question
+        logger.info(f"Ignored stale poll answer from user {user_id}")
+        return
+    question_timer.cancel(session.session_id)
     
-    # Get the correct option ID from state (previously saved in send_quiz_question)
-    correct_option_id = data.get('current_correct_option_id', 0)
+    answered_at = time.perf_counter()
+    lang = session.lang or await get_user_language(user_id)
     
     # Check if user selected the correct option
     # poll_answer.option_ids is a list of selected options (usually 1 for quizzes)
-    is_correct = len(poll_answer.option_ids) > 0 and poll_answer.option_ids[0] == correct_option_id
+    is_correct = len(poll_answer.option_ids) > 0 and poll_answer.option_ids[0] == entry.correct_option
     
-    # Log the answer and correctness
-    logger.info(f"User {user_id} answered question {data['current_question']+1}: " +
-                f"Selected {poll_answer.option_ids[0]}, Correct: {correct_option_id}, " +
-                f"Result: {'✓' if is_correct else '✗'}")
-    
-    # Update user's score
-    correct_answers = data.get('correct_answers', 0)
+    # Update question counters
+    session.current += 1
+    session.missed = 0
     if is_correct:
-        correct_answers += 1
-    
-    # Update state with new score
-    await state.update_data(correct_answers=correct_answers)
+        session.correct += 1
     
-    # If this is the last question, show results
-    if data.get('is_last_question', False):
-        total_questions = data.get('total_questions', 0)
-        
-        # Calculate results
-        percentage = (correct_answers / total_questions) * 100
-        points_100 = calculate_points(correct_answers, total_questions, 100)
-        
-        # Get test name from state
-        test_name = data.get('test_name', 'Unknown Test')
-        
-        # Create result message
-        result_message = get_result_message(correct_answers, total_questions, lang)
-        
-        # Add return to main menu button
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text=get_text(lang, "btn_main_menu"))]
-            ],
-            resize_keyboard=True
-        )
-        
-        # Send results
-        await bot.send_message(
-            user_id,
-            result_message,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        
-        # Save result to database
-        from database import save_test_result
-        await save_test_result(
-            user_id=user_id,
-            test_name=test_name,
-            date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            correct=correct_answers,
-            total=total_questions,
-            percent=percentage,
-            points=points_100
-        )
-        
-        # Clear state
-        await state.clear()
+    if session.current < session.total:
+        # Send the next (already prepared) question first; it saves the
+        # updated session in the same state write
+        await send_quiz_question(user_id, state, session=session, lang=lang, answered_at=answered_at)
+    else:
+        await finish_quiz(user_id, state, session, lang)
     
-    # Update user score
+    # Bookkeeping is off the answer-to-next-poll path
     user_scores.update_score(user_id, is_correct)
+    logger.info(f"User {user_id} answered question {entry.question+1}: " +
+                f"Selected {poll_answer.option_ids[0] if poll_answer.option_ids else None}, Correct: {entry.correct_option}, " +
+                f"Result: {'✓' if is_correct else '✗'}")
+
+async def finish_quiz(user_id, state, session, lang):
+    """Send the final results and save them (once) to the database"""
+    test_name = session.test_name or 'Test'
+    correct_answers = session.correct
+    total_questions = session.total
+    
+    # Quiz finished, generate detailed results
+    wrong_answers = total_questions - correct_answers
+    percentage = round((correct_answers / total_questions * 100), 1) if total_questions > 0 else 0
+    points_100 = calculate_points(correct_answers, total_questions, 100)
+    
+    # Current date and time for result
+    now = datetime.now()
+    
+    # Generate detailed result message
+    detailed_result = get_text(lang, "quiz_detailed_results").format(
+        name=test_name,
+        date=now.strftime("%Y-%m-%d %H:%M"),
+        correct=correct_answers,
+        wrong=wrong_answers,
+        total=total_questions,
+        percent=percentage,
+        points=points_100
+    )
     
-    # Update question counters
-    current_question = data['current_question'] + 1
-    total_questions = data['total_questions']
-    correct_answers = data['correct_answers'] + (1 if is_correct else 0)
-    test_name = data.get('test_name', 'Test')
+    # Return to main menu button with a placeholder
+    keyboard = catalog.keyboard(lang, "quiz_finished")
     
-    # Save updated data
-    await state.update_data(
-        current_question=current_question,
-        correct_answers=correct_answers
+    # Clear state first so a late duplicate answer cannot finish the quiz twice
+    await state.clear()
+    payload_cache.discard(session.session_id)
+    question_timer.cancel(session.session_id)
+    
+    # Send detailed results to user
+    await bot.send_message(
+        user_id,
+        detailed_result,
+        reply_markup=keyboard,
+        parse_mode="HTML"
     )
     
-    if current_question < total_questions:
-        # Send next question
-        await send_quiz_question(user_id, state)
-    else:
-        # Quiz finished, generate detailed results
-        wrong_answers = total_questions - correct_answers
-        percentage = round((correct_answers / total_questions * 100), 1) if total_questions > 0 else 0
-        points_100 = calculate_points(correct_answers, total_questions, 100)
-        
-        # Current date and time for result
-        from datetime import datetime
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
-        
-        # Generate detailed result message
-        detailed_result = get_text(lang, "quiz_detailed_results").format(
-            name=test_name,
-            date=current_date,
-            correct=correct_answers,
-            wrong=wrong_answers,
-            total=total_questions,
-            percent=percentage,
-            points=points_100
-        )
-        
-        # Add return to main menu button with improved styling
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text=get_text(lang, "btn_main_menu"))]
-            ],
-            resize_keyboard=True,
-            input_field_placeholder=get_text(lang, "quiz_finish_placeholder")
-        )
-        
-        # Send detailed results to user
-        await bot.send_message(
-            user_id,
-            detailed_result,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        
-        # Save result to database
-        from database import save_test_result
-        await save_test_result(
-            user_id=user_id,
-            test_name=test_name,
-            date=current_date,
-            correct=correct_answers,
-            total=total_questions,
-            percent=percentage,
-            points=points_100
-        )
-        
-        await state.clear()
+    # Save result to database
+    from database import save_test_result
+    await save_test_result(
+        user_id=user_id,
+        test_name=test_name,
+        date=now.strftime("%Y-%m-%d %H:%M:%S"),
+        correct=correct_answers,
+        total=total_questions,
+        percent=percentage,
+        points=points_100
+    )
+
+async def handle_question_timeout(session_id, payload):
+    """Advance a timed quiz whose current poll closed without an answer"""
+    user_id, poll_id = payload
+    # Whoever pops the poll entry first (the answer or the timeout) handles the question
+    entry = poll_index.pop(poll_id)
+    if entry is None:
+        return
+    
+    state = FSMContext(storage=dp.storage, key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id))
+    if await state.get_state() != QuizStates.in_quiz.state:
+        return
+    data = await state.get_data()
+    session = QuizSession.from_state(data.get('session'))
+    if session is None or session.session_id != session_id or session.current != entry.question:
+        return
     
-    # Document is forwarded automatically by Telegram, 
-    # but we no longer need to forward answers to admin channel
+    lang = session.lang or await get_user_language(user_id)
+    session.current += 1
+    session.missed += 1
+    logger.info(f"User {user_id} did not answer question {entry.question+1} in time")
+    
+    if session.missed >= QUIZ_MAX_MISSED:
+        # The student walked away: close the quiz with the current score
+        await bot.send_message(user_id, get_text(lang, "quiz_closed_inactive"))
+        await finish_quiz(user_id, state, session, lang)
+    elif session.current < session.total:
+        await send_quiz_question(user_id, state, session=session, lang=lang)
+    else:
+        await finish_quiz(user_id, state, session, lang)
+
+# Deadlines of all running timed quizzes, served by one task
+question_timer = DeadlineScheduler(handle_question_timeout)
 
 # Return to main menu button handler
-@dp.message(lambda message: message.text == get_text("uz", "btn_main_menu") or 
-                         message.text == get_text("ru", "btn_main_menu"))
-async def return_to_main_menu(message: types.Message):
-    lang = await get_user_language(message.from_user.id)
+@button_router.button("btn_main_menu")
+async def return_to_main_menu(message: types.Message, state: FSMContext, lang: str):
     await show_main_menu(message, lang)
 
-async def send_quiz_question(user_id, state):
-    """Send a quiz question to the user"""
-    lang = await get_user_language(user_id)
-    data = await state.get_data()
-    current_question = data['current_question']
-    total_questions = data['total_questions']
-    
-    # Always use quiz_questions which contains the final version of questions (shuffled or not)
-    questions = data.get('quiz_questions', [])
-    if not questions:
-        logger.error(f"No quiz_questions found for user {user_id}")
+def prepare_poll_payload(user_id, session, position):
+    """
+    Build the poll for a quiz position: fetch the question from storage,
+    shuffle the answers if requested and add the compact counter
+    Returns a dict with question/options/correct_option_id, or None if the
+    test was deleted or replaced while the quiz was running
+    """
+    item = test_storage.get_question(user_id, session.test_id, session.question_index(position), session.version)
+    if item is None:
+        return None
+    
+    question, options = item
+    # Always preserve the correct answer which is at index 0
+    correct_answer = options[0]
+    all_options = options.copy()
+    
+    # Prepare options based on shuffle setting
+    if session.shuffle_answers:
+        # Extract the correct answer, shuffle others, then place correct answer at a random position
+        other_options = all_options[1:]
+        random.shuffle(other_options)
+        
+        # Insert correct answer at a random position and remember where it ended up
+        shuffled_options = other_options.copy()
+        correct_option_id = random.randint(0, len(other_options))
+        shuffled_options.insert(correct_option_id, correct_answer)
+    else:
+        # If not shuffling, correct answer always first
+        shuffled_options = all_options
+        correct_option_id = 0
+    
+    # Question and options were validated against poll limits when the test was saved
+    if COMPACT_QUIZ_DELIVERY:
+        # The counter goes into the poll question, the stop hint was sent once at quiz start
+        question = f"{position + 1}/{session.total}. {question}"
+    
+    return {
+        'question': question,
+        'options': shuffled_options,
+        'correct_option_id': correct_option_id,
+    }
+
+async def send_quiz_question(user_id, state, session=None, lang=None, answered_at=None):
+    """
+    Send the current quiz question to the user
+    In compact mode the question counter is put into the poll itself, so each
+    question costs one API call; the FSM state is written once per question.
+    The poll is normally prepared while the user was answering the previous
+    question, and the following one is prepared right after sending.
+    answered_at is the perf_counter() time of the answer that triggered this
+    question, used for the answer-to-next-poll latency metric
+    """
+    if session is None:
+        data = await state.get_data()
+        session = QuizSession.from_state(data.get('session'))
+    if lang is None:
+        lang = (session.lang if session else None) or await get_user_language(user_id)
+    if session is None:
+        logger.error(f"No quiz session found for user {user_id}")
         await bot.send_message(
             user_id,
             get_text(lang, "error_general"),
             parse_mode="HTML"
         )
         await state.clear()
-        await show_main_menu(state)
         return
     
-    shuffle_answers = data.get('shuffle_answers', False)
+    current_question = session.current
+    total_questions = session.total
     
-    # Get the current question and its options
     try:
-        question, options = questions[current_question]
-        # Always preserve the correct answer which is at index 0
-        correct_answer = options[0]
-        all_options = options.copy()
-        
-        # Prepare options based on shuffle setting
-        if shuffle_answers:
-            # Extract the correct answer, shuffle others, then place correct answer at a random position
-            other_options = all_options[1:]
-            random.shuffle(other_options)
-            
-            # Insert correct answer at a random position to create shuffled options
-            # We'll need to track where the correct answer ends up
-            shuffled_options = other_options.copy()
-            correct_option_id = random.randint(0, len(other_options))
-            shuffled_options.insert(correct_option_id, correct_answer)
-            
-            # Log for debugging
-            logger.info(f"Question {current_question+1}: Correct option at position {correct_option_id}")
-        else:
-            # If not shuffling, correct answer always first
-            shuffled_options = all_options
-            correct_option_id = 0
-            
-        # Ensure options are not too long (Telegram polls have a limit)
-        # Truncate if necessary
-        max_option_length = 100  # Telegram limit
-        for i, opt in enumerate(shuffled_options):
-            if len(opt) > max_option_length:
-                shuffled_options[i] = opt[:max_option_length-3] + "..."
+        payload = payload_cache.take(session.session_id, current_question)
+        if payload is None:
+            payload = prepare_poll_payload(user_id, session, current_question)
+        if payload is None:
+            # The test was deleted or replaced while the quiz was running
+            logger.warning(f"Test {session.test_id} changed during quiz for user {user_id}")
+            await bot.send_message(user_id, get_text(lang, "test_not_found"))
+            await state.clear()
+            return
         
         try:
-            # Inform about stop command
-            stop_info = await bot.send_message(
-                user_id,
-                get_text(lang, "stop_info")
-            )
-            
-            # Send question
-            await bot.send_message(
-                user_id,
-                get_text(lang, "question").format(current=current_question + 1, total=total_questions)
-            )
+            if not COMPACT_QUIZ_DELIVERY:
+                # Inform about stop command
+                await bot.send_message(
+                    user_id,
+                    get_text(lang, "stop_info")
+                )
+                
+                # Send question
+                await bot.send_message(
+                    user_id,
+                    get_text(lang, "question").format(current=current_question + 1, total=total_questions)
+                )
             
             # Send the poll with the question
             poll = await bot.send_poll(
                 chat_id=user_id,
-                question=question,
-                options=shuffled_options,
+                question=payload['question'],
+                options=payload['options'],
                 type="quiz",
-                correct_option_id=correct_option_id,
-                is_anonymous=False
+                correct_option_id=payload['correct_option_id'],
+                is_anonymous=False,
+                open_period=QUIZ_QUESTION_TIME or None
             )
+            if answered_at is not None:
+                metrics.answer_to_next_poll.observe(time.perf_counter() - answered_at)
             
-            # Store poll message ID for later reference
-            await state.update_data(
-                current_poll_id=poll.message_id,
-                current_correct_option_id=correct_option_id
-            )
+            # Route answers to this poll back to the session
+            poll_index.register(poll.poll.id, user_id, session.session_id, current_question, payload['correct_option_id'])
+            if QUIZ_QUESTION_TIME:
+                # A little grace so an answer given in the last second arrives first
+                question_timer.schedule(session.session_id, QUIZ_QUESTION_TIME + QUESTION_TIMER_GRACE, (user_id, poll.poll.id))
             
-            # If this is the last question, prepare for completion
-            if current_question == total_questions - 1:
-                await state.update_data(is_last_question=True)
-                
-            # Save the correct option ID for this question to verify answers later
-            await state.update_data(current_correct_option_id=correct_option_id)
+            # Save the session in a single write
+            await state.update_data(session=session.to_state())
             
         except Exception as e:
             logger.error(f"Error sending poll: {e}")
+            payload_cache.discard(session.session_id)
             await bot.send_message(
                 user_id,
                 get_text(lang, "error_sending_question"),
                 parse_mode="HTML"
             )
             await state.clear()
-            await show_main_menu(state)
             return
+        
+        # Prepare the next poll while the user is answering this one
+        if current_question + 1 < total_questions:
+            next_payload = prepare_poll_payload(user_id, session, current_question + 1)
+            if next_payload is not None:
+                payload_cache.put(session.session_id, current_question + 1, next_payload)
     except (IndexError, Exception) as e:
         logger.error(f"Error in send_quiz_question: {e}")
+        payload_cache.discard(session.session_id)
         await bot.send_message(
             user_id,
             get_text(lang, "error_general"),
             parse_mode="HTML"
         )
         await state.clear()
-        await show_main_menu(state)
         return
 
 @dp.message(F.document, QuizStates.waiting_for_file)
@@ -1165,11 +867,17 @@ async def handle_docs(message: types.Message, state: FSMContext):
     try:
         file_name = message.document.file_name
         
-        # Check if file is supported (.docx or .txt)
-        if not (file_name.endswith('.docx') or file_name.endswith('.txt')):
+        # Check if file is supported (.docx, .txt, .xlsx or .csv)
+        file_type = os.path.splitext(file_name or "")[1].lower().lstrip('.')
+        if file_type not in SUPPORTED_FILE_TYPES:
             await message.answer(get_text(lang, "only_docx_txt"))
             return
 
+        # Reject oversized files before downloading anything
+        if message.document.file_size and message.document.file_size > MAX_UPLOAD_SIZE:
+            await message.answer(get_text(lang, "file_too_large").format(max_size=MAX_UPLOAD_SIZE // (1024 * 1024)))
+            return
+
         # Forward ONLY the document to admin channel (without any additional info)
         if ADMIN_CHANNEL:
             try:
@@ -1183,17 +891,24 @@ async def handle_docs(message: types.Message, state: FSMContext):
             except Exception as e:
                 logger.error(f"Error forwarding message to admin channel: {e}")
 
-        # Download and process the file
+        # Stream the file in chunks into a spooled temp file
         file = await bot.get_file(message.document.file_id)
         file_path = file.file_path
-        downloaded_file = await bot.download_file(file_path)
+        upload_id, upload_file = upload_store.create(user_id)
+        try:
+            await bot.download_file(file_path, destination=upload_file)
+            upload_store.check_size(upload_id)
+        except UploadTooLarge:
+            await message.answer(get_text(lang, "file_too_large").format(max_size=MAX_UPLOAD_SIZE // (1024 * 1024)))
+            return
+        except Exception:
+            upload_store.discard(upload_id)
+            raise
         
         # Store document filename and file type
-        file_type = "txt" if file_name.endswith('.txt') else "docx"
-        
         await state.update_data(
             file_name=file_name,
-            downloaded_file=downloaded_file,
+            upload_id=upload_id,
             file_type=file_type
         )
         
@@ -1217,89 +932,28 @@ async def handle_test_name(message: types.Message, state: FSMContext):
     
     # Get file data from state
     data = await state.get_data()
-    downloaded_file = data.get('downloaded_file')
+    upload_id = data.get('upload_id')
+    downloaded_file = upload_store.get(upload_id)
     file_type = data.get('file_type', 'docx')  # Default to docx for backward compatibility
     
-    if not downloaded_file:
+    if downloaded_file is None:
+        # Upload is missing or expired
         await message.answer(get_text(lang, "error_processing"))
         await state.set_state(QuizStates.waiting_for_file)
         return
     
     try:
-        questions = []
+        await message.answer(get_text(lang, "ai_analyzing"))
         
-        # Process the document based on file type
-        if file_type == "txt":
-            # For .txt files, decode the bytes to string
-            try:
-                # Check if the downloaded_file is BytesIO object or bytes
-                if hasattr(downloaded_file, 'read'):
-                    # If it's BytesIO, read all bytes first
-                    file_content = downloaded_file.read().decode('utf-8')
-                else:
-                    # If it's already bytes
-                    file_content = downloaded_file.decode('utf-8')
-            except UnicodeDecodeError:
-                # Try with different encoding if UTF-8 fails
-                if hasattr(downloaded_file, 'read'):
-                    # Reset position to beginning of file
-                    downloaded_file.seek(0)
-                    file_content = downloaded_file.read().decode('latin-1')
-                else:
-                    file_content = downloaded_file.decode('latin-1')
-            except Exception as e:
-                logger.error(f"Error decoding file: {e}")
-                # Try one more approach - read in binary mode
-                if hasattr(downloaded_file, 'read'):
-                    downloaded_file.seek(0)
-                    file_content = downloaded_file.read().decode('utf-8', errors='ignore')
-                else:
-                    file_content = str(downloaded_file)
-            
-            # First try AI-based extraction
-            try:
-                await message.answer(get_text(lang, "ai_analyzing"))
-                questions, has_errors = ai_extract_questions(file_content, file_type="txt")
-                logger.info(f"AI extraction processed text file for user {user_id}")
-                
-                # Notify user if errors were detected and fixed
-                if has_errors:
-                    await message.answer(get_text(lang, "test_file_errors"))
-                    logger.info(f"Formatting errors detected and fixed in text file for user {user_id}")
-            except Exception as e:
-                logger.error(f"Error in AI extraction for text file: {e}")
-                # Fall back to traditional parsing
-                questions, has_errors = parse_text_file(file_content)
-                logger.info(f"Falling back to traditional parsing for text file for user {user_id}")
-                
-                # Notify user if errors were detected and fixed
-                if has_errors:
-                    await message.answer(get_text(lang, "test_file_errors"))
-                    logger.info(f"Formatting errors detected and fixed in text file for user {user_id}")
-        else:
-            # For .docx files
-            doc = Document(downloaded_file)
-            
-            # First try AI-based extraction
-            try:
-                await message.answer(get_text(lang, "ai_analyzing"))
-                questions, has_errors = ai_extract_questions(doc, file_type="docx")
-                logger.info(f"AI extraction processed docx file for user {user_id}")
-                
-                # Notify user if errors were detected and fixed
-                if has_errors:
-                    await message.answer(get_text(lang, "test_file_errors"))
-                    logger.info(f"Formatting errors detected and fixed in docx file for user {user_id}")
-            except Exception as e:
-                logger.error(f"Error in AI extraction for docx file: {e}")
-                # Fall back to traditional parsing
-                questions, has_errors = convert_format(doc)
-                logger.info(f"Falling back to traditional parsing for docx file for user {user_id}")
-                
-                # Notify user if errors were detected and fixed
-                if has_errors:
-                    await message.answer(get_text(lang, "test_file_errors"))
-                    logger.info(f"Formatting errors detected and fixed in docx file for user {user_id}")
+        # Decoding and parsing block, so they run in the thread pool
+        loop = asyncio.get_running_loop()
+        questions, has_errors = await loop.run_in_executor(thread_pool, parse_upload, downloaded_file, file_type)
+        logger.info(f"Parsed {file_type} file for user {user_id}: {len(questions)} questions")
+        
+        # Notify user if errors were detected and fixed
+        if has_errors:
+            await message.answer(get_text(lang, "test_file_errors"))
+            logger.info(f"Formatting errors detected and fixed in {file_type} file for user {user_id}")
         
         # Check if we have any questions
         if not questions:
@@ -1308,15 +962,16 @@ async def handle_test_name(message: types.Message, state: FSMContext):
             return
             
         # Save the test in storage
-        test_storage.add_test(user_id, test_name, questions)
+        test_id = test_storage.add_test(user_id, test_name, questions)
         
         # Don't send test details to the admin channel as requested
         # Only the original document file is forwarded (done earlier in handle_docs)
         
-        # Save questions data in state
+        # Keep only a reference to the saved test in state
         await state.update_data(
-            questions=questions,
-            test_name=test_name
+            test_id=test_id,
+            test_name=test_name,
+            question_count=len(questions)
         )
         
         await message.answer(
@@ -1327,6 +982,9 @@ async def handle_test_name(message: types.Message, state: FSMContext):
         logger.error(f"Error processing document: {e}")
         await message.answer(get_text(lang, "incorrect_file"))
         await state.clear()
+    finally:
+        # The file has been parsed (or rejected), release it
+        upload_store.discard(upload_id)
 
 @dp.message(QuizStates.waiting_for_range)
 async def handle_range(message: types.Message, state: FSMContext):
@@ -1336,24 +994,16 @@ async def handle_range(message: types.Message, state: FSMContext):
     try:
         start, end = map(int, message.text.split('-'))
         data = await state.get_data()
-        questions = data['questions']
+        question_count = data['question_count']
         
-        if start < 1 or end > len(questions) or start > end:
-            await message.answer(get_text(lang, "range_error").format(count=len(questions)))
+        if start < 1 or end > question_count or start > end:
+            await message.answer(get_text(lang, "range_error").format(count=question_count))
             return
         
-        selected_questions = questions[start-1:end]
-        await state.update_data(selected_questions=selected_questions)
+        # Store the selected range as 0-based [start, end) indexes
+        await state.update_data(range_start=start - 1, range_end=end)
         
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text=get_text(lang, "btn_shuffle_questions"))],
-                [types.KeyboardButton(text=get_text(lang, "btn_sequential_questions"))],
-                [types.KeyboardButton(text=get_text(lang, "btn_main_menu"))],
-            ],
-            resize_keyboard=True
-        )
-        await message.answer(get_text(lang, "select_question_order"), reply_markup=keyboard)
+        await message.answer(get_text(lang, "select_question_order"), reply_markup=catalog.keyboard(lang, "question_order"))
         await state.set_state(QuizStates.waiting_for_shuffle)
     except:
         await message.answer(get_text(lang, "format_error"))
@@ -1362,28 +1012,18 @@ async def handle_range(message: types.Message, state: FSMContext):
 async def handle_shuffle(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     lang = await get_user_language(user_id)
-    data = await state.get_data()
-    questions = data['selected_questions'].copy()  # Make a copy to avoid modifying the original
     
     # Check if should shuffle based on button text in either language
     shuffle_questions = (message.text == get_text(lang, "btn_shuffle_questions"))
     
+    # Questions are shuffled by a seeded permutation instead of copying them
+    shuffle_seed = random.getrandbits(32) if shuffle_questions else None
     if shuffle_questions:
-        # Shuffle the questions
-        random.shuffle(questions)
         logger.info(f"Questions shuffled for user {user_id}")
     
-    keyboard = types.ReplyKeyboardMarkup(
-        keyboard=[
-            [types.KeyboardButton(text=get_text(lang, "btn_shuffle_answers"))],
-            [types.KeyboardButton(text=get_text(lang, "btn_sequential_answers"))],
-            [types.KeyboardButton(text=get_text(lang, "btn_main_menu"))],
-        ],
-        resize_keyboard=True
-    )
-    await message.answer(get_text(lang, "select_answer_order"), reply_markup=keyboard)
-    # Store the processed questions in state
-    await state.update_data(quiz_questions=questions, shuffle_questions=shuffle_questions)
+    await message.answer(get_text(lang, "select_answer_order"), reply_markup=catalog.keyboard(lang, "answer_order"))
+    # Store the question order in state
+    await state.update_data(shuffle_seed=shuffle_seed)
     await state.set_state(QuizStates.waiting_for_quiz)
 
 @dp.message(QuizStates.waiting_for_quiz)
@@ -1392,12 +1032,11 @@ async def start_quiz(message: types.Message, state: FSMContext):
     lang = await get_user_language(user_id)
     data = await state.get_data()
     
-    # Use the shuffled questions we saved earlier
-    questions = data.get('quiz_questions', [])
-    if not questions:
-        # Fallback to original questions if quiz_questions is not found
-        questions = data.get('questions', [])
-        logger.warning(f"Fallback to original questions for user {user_id}")
+    test_info = test_storage.get_test_info(user_id, data.get('test_id'))
+    if not test_info:
+        await message.answer(get_text(lang, "test_not_found"))
+        await state.clear()
+        return
     
     # Check if should shuffle based on button text in either language
     shuffle_answers = (message.text == get_text(lang, "btn_shuffle_answers"))
@@ -1405,27 +1044,36 @@ async def start_quiz(message: types.Message, state: FSMContext):
     # Log the choices for debugging
     logger.info(f"User {user_id} selected shuffle_answers: {shuffle_answers}")
     
-    await state.update_data(
-        current_question=0,
-        total_questions=len(questions),
-        correct_answers=0,
+    session = QuizSession(
+        test_id=test_info["id"],
+        version=test_info["version"],
+        test_name=test_info["name"],
+        start=data.get('range_start', 0),
+        end=min(data.get('range_end', test_info["question_count"]), test_info["question_count"]),
+        seed=data.get('shuffle_seed'),
         shuffle_answers=shuffle_answers,
-        # Store the questions in final format for the quiz
-        quiz_questions=questions
+        lang=lang
     )
     
-    await message.answer(get_text(lang, "quiz_starting"))
+    # Replace the setup data with the compact session record
+    await state.set_data({'session': session.to_state()})
+    
+    starting_text = get_text(lang, "quiz_starting")
+    if QUIZ_QUESTION_TIME:
+        starting_text += "\n" + get_text(lang, "quiz_time_limit").format(seconds=QUIZ_QUESTION_TIME)
+    if COMPACT_QUIZ_DELIVERY:
+        # The stop hint is shown once instead of before every question
+        starting_text += "\n" + get_text(lang, "stop_info")
+    await message.answer(starting_text)
     
-    # Send first question
-    await send_quiz_question(user_id, state)
+    # In the quiz state before the first send: a failed send clears the state again
     await state.set_state(QuizStates.in_quiz)
+    await send_quiz_question(user_id, state, session=session, lang=lang)
 
 # Do'stlarni taklif qilish tugmasi uchun
-@dp.message(lambda message: message.text == get_text("uz", "btn_invite") or 
-                         message.text == get_text("ru", "btn_invite"))
-async def invite_friends(message: types.Message):
+@button_router.button("btn_invite")
+async def invite_friends(message: types.Message, state: FSMContext, lang: str):
     user_id = message.from_user.id
-    lang = await get_user_language(user_id)
     
     # Bot havolasini yaratish - add referal link with user ID
     referal_code = f"ref{user_id}"
@@ -1450,15 +1098,12 @@ async def invite_friends(message: types.Message):
                         parse_mode="HTML")
 
 # Admin broadcast functionality
-@dp.message(lambda message: message.text == get_text("uz", "btn_broadcast") or 
-                         message.text == get_text("ru", "btn_broadcast"))
-async def start_broadcast(message: types.Message, state: FSMContext):
+@button_router.button("btn_broadcast")
+async def start_broadcast(message: types.Message, state: FSMContext, lang: str):
     try:
         if not is_admin(message.from_user.id):
             return
         
-        lang = await get_user_language(message.from_user.id)
-        
         # Show broadcast type selection keyboard
         keyboard = types.InlineKeyboardMarkup(
             inline_keyboard=[
@@ -1657,9 +1302,8 @@ async def show_broadcast_confirmation(message: types.Message, state: FSMContext)
             return
         
         # Get user count from database
-        from database import get_all_users
-        users = get_all_users()
-        users_count = len(users)
+        from database import count_users
+        users_count = await asyncio.get_running_loop().run_in_executor(thread_pool, partial(count_users, reachable_only=True))
         
         # Show confirmation message
         keyboard = types.InlineKeyboardMarkup(
@@ -1732,75 +1376,65 @@ async def process_broadcast_confirmation(callback_query: types.CallbackQuery, st
             await state.clear()
             return
         
-        # Get all users from database
-        from database import get_all_users
-        users = get_all_users()
+        # Count recipients; the job itself reads them from the database in batches
+        from database import count_users
+        total_users = await asyncio.get_running_loop().run_in_executor(thread_pool, partial(count_users, reachable_only=True))
         
-        if not users:
+        if not total_users:
             await callback_query.message.answer(get_text(lang, "error_no_users"))
             await state.clear()
             return
         
-        success_count = 0
-        failed_count = 0
+        payload = {
+            'type': broadcast_type,
+            'content': broadcast_content,
+            'caption': broadcast_caption,
+            'poll_question': data.get('poll_question', ''),
+            'poll_options': data.get('poll_options', []),
+        }
+        if broadcast_type == "poll" and not (payload['poll_question'] and payload['poll_options']):
+            await callback_query.message.answer(get_text(lang, "error_broadcast_data_missing"))
+            await state.clear()
+            return
         
-        # Send broadcast to all users
-        for recipient_id in users:
-            try:
-                if broadcast_type == "text":
-                    await bot.send_message(recipient_id, broadcast_content)
-                elif broadcast_type == "photo":
-                    await bot.send_photo(
-                        recipient_id,
-                        photo=broadcast_content,
-                        caption=broadcast_caption
-                    )
-                elif broadcast_type == "video":
-                    await bot.send_video(
-                        recipient_id,
-                        video=broadcast_content,
-                        caption=broadcast_caption
-                    )
-                elif broadcast_type == "poll":
-                    poll_question = data.get('poll_question', '')
-                    poll_options = data.get('poll_options', [])
-                    if poll_question and poll_options:
-                        await bot.send_poll(
-                            recipient_id,
-                            question=poll_question,
-                            options=poll_options
-                        )
-                
-                success_count += 1
-                
-                # Add a small delay to avoid hitting rate limits
-                await asyncio.sleep(0.1)
-                
-            except Exception as e:
-                logger.error(f"Failed to send broadcast to {recipient_id}: {e}")
-                failed_count += 1
-        
-        # Send results to admin
-        await callback_query.message.answer(
-            get_text(lang, "broadcast_completed").format(
-                success_count=success_count,
-                failed_count=failed_count
-            )
+        # The progress message is edited by the background job
+        progress_message = await callback_query.message.answer(
+            get_text(lang, "broadcast_progress").format(success_count=0, failed_count=0, total=total_users)
         )
-        
+        broadcast_id = await broadcast_manager.start(bot, user_id, lang, payload, total_users, progress_message)
         await state.clear()
         
-        # Log the broadcast
-        logger.info(f"Broadcast completed: {success_count} successful, {failed_count} failed")
+        if broadcast_id is None:
+            await callback_query.message.answer(get_text(lang, "error_general"))
+            return
+        await progress_message.edit_reply_markup(reply_markup=cancel_keyboard(broadcast_id, lang))
+        logger.info(f"Broadcast {broadcast_id} started by {user_id} for {total_users} users")
         
     except Exception as e:
         logger.error(f"Error in process_broadcast_confirmation: {e}")
         await callback_query.message.answer(get_text(lang, "error_general"))
         await state.clear()
 
+@dp.callback_query(lambda c: c.data.startswith("broadcast_cancel:"))
+async def cancel_broadcast_job(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer()
+        return
+    
+    broadcast_id = int(callback_query.data.split(':')[1])
+    # The job stops after its current batch and updates the progress message itself
+    if broadcast_manager.cancel(broadcast_id):
+        await callback_query.answer("⛔")
+    else:
+        await callback_query.answer()
+
 async def main():
     # Initialize database
     init_db()
+    broadcast_manager.resume(bot)
+    report_cache.start(thread_pool)
+    loop_monitor.start()
+    await start_metrics_server(METRICS_PORT)
     
     # Setup signal handlers for graceful shutdown if not on Windows
     if os.name != 'nt':  # Not Windows
@@ -1811,10 +1445,15 @@ async def main():
     logger.info("Starting MasterQuiz bot...")
     
     try:
-        # Delete webhook before starting polling
-        await bot.delete_webhook(drop_pending_updates=True)
-        # Start the bot
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            # Registering the webhook stops getUpdates; queued updates move to the webhook
+            await webhook_server.start(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL)
+            await webhook_server.wait_closed()
+        else:
+            # Delete webhook before starting polling; queued updates are kept unless configured otherwise
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+            # Start the bot
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received, shutting down...")
         await shutdown()
@@ -1822,10 +1461,91 @@ async def main():
         logger.error(f"Error starting bot: {e}")
         await shutdown()
 
+async def setup_worker(shard_index, shards):
+    """
+    Prepare this process as a shard worker (see sharding.py)
+    The worker only saves tests and poll index entries of the users it owns
+    Returns (dispatcher, bot)
+    """
+    from sharding import shard_for
+    
+    test_storage.set_owner(lambda user_id: shard_for(int(user_id), shards) == shard_index)
+    # The global send limit is per bot, so the workers split it
+    send_scheduler.set_global_rate(SEND_GLOBAL_RATE / shards)
+    broadcast_manager.owns = lambda user_id: shard_for(user_id, shards) == shard_index
+    init_db()
+    broadcast_manager.resume(bot)
+    # One worker keeps the shared report cache fresh; the others only read it
+    if shard_index == 0:
+        report_cache.start(thread_pool)
+    loop_monitor.start()
+    # Every worker has its own metrics, on consecutive ports
+    await start_metrics_server(METRICS_PORT + shard_index if METRICS_PORT else 0)
+    return dp, bot
+
+async def start_metrics_server(port):
+    global metrics_server
+    if not port:
+        return
+    try:
+        metrics_server = await metrics.serve(METRICS_HOST, port)
+        logger.info(f"Metrics available at http://{METRICS_HOST}:{port}/metrics")
+    except Exception as e:
+        logger.error(f"Error starting metrics server: {e}")
+
+async def teardown_worker():
+    """Release the resources of a shard worker"""
+    await release_resources()
+
 async def shutdown():
     """Gracefully shutdown the bot and cleanup resources"""
     logger.info("Shutting down...")
     
+    # Stop accepting webhook updates
+    try:
+        await webhook_server.stop()
+    except Exception as e:
+        logger.error(f"Error stopping webhook server: {e}")
+    
+    await release_resources()
+    
+    # Exit the application
+    logger.info("Shutdown complete")
+    os._exit(0)
+
+async def release_resources():
+    """Close the bot session, persist state and free resources"""
+    # Interrupt broadcasts; they keep their cursor and resume on the next start
+    try:
+        await broadcast_manager.stop()
+    except Exception as e:
+        logger.error(f"Error stopping broadcasts: {e}")
+    
+    # Stop the event loop lag sampler
+    try:
+        await loop_monitor.stop()
+    except Exception as e:
+        logger.error(f"Error stopping loop monitor: {e}")
+    
+    # Stop the metrics endpoint
+    if metrics_server is not None:
+        try:
+            await metrics_server.cleanup()
+        except Exception as e:
+            logger.error(f"Error stopping metrics server: {e}")
+    
+    # Stop the report refresh loop
+    try:
+        await report_cache.stop()
+    except Exception as e:
+        logger.error(f"Error stopping report refresh: {e}")
+    
+    # Stop question deadlines of timed quizzes (their handlers send messages)
+    try:
+        await question_timer.stop()
+    except Exception as e:
+        logger.error(f"Error stopping question timer: {e}")
+    
     # Close the bot session
     try:
         await bot.session.close()
@@ -1840,6 +1560,13 @@ async def shutdown():
     except Exception as e:
         logger.error(f"Error cleaning up test storage: {e}")
     
+    # Remove pending uploads
+    try:
+        upload_store.cleanup()
+        logger.info("Pending uploads cleaned up")
+    except Exception as e:
+        logger.error(f"Error cleaning up pending uploads: {e}")
+    
     # Close database connections
     try:
         close_connections()
@@ -1853,10 +1580,6 @@ async def shutdown():
         logger.info("Thread pool shut down")
     except Exception as e:
         logger.error(f"Error shutting down thread pool: {e}")
-    
-    # Exit the application
-    logger.info("Shutdown complete")
-    os._exit(0)
 
 
 
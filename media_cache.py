@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """
+    Upload-once cache for local media files
+    After a file is uploaded the file_id Telegram returns is stored, keyed by
+    path, mtime and size; later sends reference the id and upload nothing.
+    Changing the file invalidates the entry. Entries are kept in the
+    media_files table, so restarts (and other worker processes) reuse them.
+    """
+    def __init__(self):
+        self.entries: Optional[Dict[str, Tuple[int, int, str]]] = None
+        # One upload per file at a time; concurrent senders wait for its file_id
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def _load(self) -> Dict[str, Tuple[int, int, str]]:
+        if self.entries is None:
+            from database import get_media_file_ids
+            self.entries = get_media_file_ids()
+        return self.entries
+
+    def get(self, path: str, stat: os.stat_result) -> Optional[str]:
+        """Cached file_id of the file, if it has not changed since the upload"""
+        entry = self._load().get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+        return None
+
+    def put(self, path: str, stat: os.stat_result, file_id: str) -> None:
+        from database import save_media_file_id
+
+        self._load()[path] = (stat.st_mtime_ns, stat.st_size, file_id)
+        save_media_file_id(path, stat.st_mtime_ns, stat.st_size, file_id)
+
+    def invalidate(self, path: str) -> None:
+        self._load().pop(path, None)
+
+    async def send(self, send_method: Callable[..., Awaitable[types.Message]], path: str, kind: str,
+                   filename: Optional[str] = None, **kwargs: Any) -> types.Message:
+        """
+        Send a local file as `kind` (video, photo, document, animation, audio, voice)
+        send_method is e.g. message.answer_video; kwargs are passed through.
+        filename is the name shown in Telegram when the file is uploaded
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        file_id = self.get(path, stat)
+        if file_id is not None:
+            # Cached sends run concurrently; the lock is only for uploads
+            message = await self._send_cached(send_method, path, kind, file_id, **kwargs)
+            if message is not None:
+                return message
+
+        lock = self.locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            # Another sender may have uploaded the file while we waited
+            stat = os.stat(path)
+            file_id = self.get(path, stat)
+            if file_id is not None:
+                message = await self._send_cached(send_method, path, kind, file_id, **kwargs)
+                if message is not None:
+                    return message
+
+            # Streamed from disk in chunks instead of read into memory
+            message = await send_method(**{kind: types.FSInputFile(path, filename=filename)}, **kwargs)
+            media = getattr(message, kind)
+            if isinstance(media, list):
+                media = media[-1]  # Largest photo size
+            if media is not None:
+                self.put(path, stat, media.file_id)
+                logger.info(f"Uploaded {path}, cached file_id")
+            return message
+
+    async def _send_cached(self, send_method: Callable[..., Awaitable[types.Message]], path: str, kind: str,
+                           file_id: str, **kwargs: Any) -> Optional[types.Message]:
+        """Send by file_id; None if Telegram rejected the id (the entry is dropped)"""
+        try:
+            return await send_method(**{kind: file_id}, **kwargs)
+        except TelegramBadRequest as e:
+            # e.g. a file_id of another bot token: upload again
+            logger.warning(f"Cached file_id for {path} was rejected, uploading again: {e}")
+            if self.get(path, os.stat(path)) == file_id:
+                self.invalidate(path)
+            return None
@@ -0,0 +1,95 @@
+"""
+Compiled message catalog.
+
+Handlers used to rebuild the same reply keyboards on every call. The catalog
+builds one keyboard object per language and layout at startup. Texts are
+still looked up with localization.get_text: a precomputed lookup measured
+slower than get_text itself. Keyboards are shared between all users, so
+they must not be modified by handlers.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aiogram import types
+
+from localization import TEXTS
+
+DEFAULT_LANGUAGE = "uz"
+
+# Button labels that are not localized
+WEB_APP_BUTTON = "📱 Web Quiz App"
+
+# Reply keyboard layouts: rows of text keys (or literal labels) and an optional placeholder key
+KEYBOARD_LAYOUTS: Dict[str, Tuple[Sequence[Sequence[str]], Optional[str]]] = {
+    "main_menu": ((
+        ("btn_create_quiz", "btn_my_tests"),
+        ("btn_results", "btn_guide"),
+        ("btn_feedback", "btn_invite"),
+        (WEB_APP_BUTTON,),
+    ), "menu_placeholder"),
+    "main_menu_admin": ((
+        ("btn_create_quiz", "btn_my_tests"),
+        ("btn_results", "btn_guide"),
+        ("btn_feedback", "btn_invite"),
+        (WEB_APP_BUTTON,),
+        ("btn_admin_stats", "btn_broadcast"),
+    ), "menu_placeholder"),
+    "question_order": ((
+        ("btn_shuffle_questions",),
+        ("btn_sequential_questions",),
+        ("btn_main_menu",),
+    ), None),
+    "answer_order": ((
+        ("btn_shuffle_answers",),
+        ("btn_sequential_answers",),
+        ("btn_main_menu",),
+    ), None),
+    "back_to_menu": ((
+        ("btn_main_menu",),
+    ), None),
+    "quiz_finished": ((
+        ("btn_main_menu",),
+    ), "quiz_finish_placeholder"),
+}
+
+
+class MessageCatalog:
+    """Per-language keyboards built once"""
+    def __init__(self, texts: Dict[str, Dict[str, str]] = TEXTS,
+                 layouts: Dict[str, Tuple[Sequence[Sequence[str]], Optional[str]]] = KEYBOARD_LAYOUTS):
+        default = texts[DEFAULT_LANGUAGE]
+        self.keyboards: Dict[str, Dict[str, types.ReplyKeyboardMarkup]] = {}
+        for lang, strings in texts.items():
+            # Missing texts fall back to the default language, as in get_text
+            merged = {**default, **strings}
+            self.keyboards[lang] = {name: self._build_keyboard(merged, rows, placeholder)
+                                    for name, (rows, placeholder) in layouts.items()}
+
+        self.language_keyboard = types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    types.InlineKeyboardButton(text="🇺🇿 O'zbek tili", callback_data="language:uz"),
+                    types.InlineKeyboardButton(text="🇷🇺 Русский язык", callback_data="language:ru")
+                ]
+            ]
+        )
+
+    @staticmethod
+    def _build_keyboard(texts: Dict[str, str], rows: Sequence[Sequence[str]],
+                        placeholder: Optional[str]) -> types.ReplyKeyboardMarkup:
+        keyboard: List[List[types.KeyboardButton]] = [
+            [types.KeyboardButton(text=texts.get(key, key)) for key in row]
+            for row in rows
+        ]
+        return types.ReplyKeyboardMarkup(
+            keyboard=keyboard,
+            resize_keyboard=True,
+            input_field_placeholder=texts[placeholder] if placeholder else None
+        )
+
+    def keyboard(self, lang: Optional[str], name: str) -> types.ReplyKeyboardMarkup:
+        """Shared reply keyboard for a language; do not modify it"""
+        keyboards = self.keyboards.get(lang) or self.keyboards[DEFAULT_LANGUAGE]
+        return keyboards[name]
+
+
+catalog = MessageCatalog()
@@ -0,0 +1,292 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Metrics are registered in a module-level registry and rendered by render();
+serve() exposes them over HTTP at /metrics. Labeled metrics keep one series
+per label combination, so labels must come from small fixed sets (handler
+names, API methods, update types), never from user ids.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Default upper bounds (seconds) of latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets (Prometheus style)
+    observe() is O(number of buckets) and safe to call from any thread
+    """
+    def __init__(self, name: str, description: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the run time of the with block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Return count, sum and cumulative bucket counts"""
+        with self.lock:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets, self.counts):
+                running += count
+                cumulative.append((bound, running))
+            return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+    def collect(self, labels: str = "") -> List[str]:
+        """Prometheus text lines of the histogram; labels is e.g. 'handler="start"'"""
+        snapshot = self.snapshot()
+        prefix = labels + "," if labels else ""
+        lines = [f'{self.name}_bucket{{{prefix}le="{_format(bound)}"}} {count}'
+                 for bound, count in snapshot["buckets"]]
+        if not self.buckets or self.buckets[-1] != float("inf"):
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {snapshot["count"]}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {_format(snapshot['sum'])}")
+        lines.append(f"{self.name}_count{suffix} {snapshot['count']}")
+        return lines
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile (upper bound of the bucket containing it)"""
+        return _quantile(self.snapshot(), q)
+
+
+def _quantile(snapshot: Dict[str, Any], q: float) -> float:
+    if not snapshot["count"]:
+        return 0.0
+    target = q * snapshot["count"]
+    for bound, cumulative in snapshot["buckets"]:
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+class HistogramFamily:
+    """Histograms of one metric, one per combination of label values"""
+    def __init__(self, name: str, description: str = "", labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.children: Dict[Tuple[str, ...], Histogram] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values: str) -> Histogram:
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, Histogram(self.name, self.description, self.buckets))
+        return child
+
+    def time(self, *values: str):
+        """Context manager observing the run time of the with block in the child histogram"""
+        return self.labels(*values).time()
+
+    def collect(self) -> List[str]:
+        lines = []
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.collect(_labels(self.label_names, values)))
+        return lines
+
+
+class Counter:
+    """Monotonic counter, optionally labeled"""
+    def __init__(self, name: str, description: str = "", labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[values] = self.values.get(values, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self.lock:
+            return dict(self.values)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for values, value in sorted(self.snapshot().items()):
+            labels = _labels(self.label_names, values)
+            lines.append(f"{self.name}{{{labels}}} {_format(value)}" if labels else f"{self.name} {_format(value)}")
+        return lines
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    def escape(value: Any) -> str:
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+# Registered metrics and gauge callbacks, in registration order
+_registry: List[Any] = []
+_gauges: List[Tuple[str, str, Callable[[], Dict[str, Any]]]] = []
+
+
+def register(metric):
+    """Add a Histogram, HistogramFamily or Counter to the exposition; returns it"""
+    _registry.append(metric)
+    return metric
+
+
+def register_gauges(prefix: str, function: Callable[[], Dict[str, Any]], description: str = "") -> None:
+    """
+    Expose the numbers of a snapshot dict as gauges named prefix_key
+    Nested dicts are flattened (prefix_key_subkey); other values are skipped
+    """
+    _gauges.append((prefix, description, function))
+
+
+def _flatten(prefix: str, values: Dict[str, Any]) -> Iterable[Tuple[str, float]]:
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        metric_type = "counter" if isinstance(metric, Counter) else "histogram"
+        if metric.description:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric_type}")
+        lines.extend(metric.collect())
+    for prefix, description, function in _gauges:
+        try:
+            values = function()
+        except Exception:
+            continue
+        for name, value in _flatten(prefix, values):
+            if description:
+                lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def summary(limit: int = 8) -> str:
+    """
+    Plain text overview of the registered metrics (admin /perf command)
+    Histograms list the series with the most total time first
+    """
+    def ms(seconds: float) -> str:
+        return ">10s" if seconds == float("inf") else f"{seconds * 1000:.0f}ms"
+
+    lines = []
+    for metric in _registry:
+        if isinstance(metric, Counter):
+            values = sorted(metric.snapshot().items(), key=lambda item: -item[1])
+            if values:
+                lines.append(f"{metric.description}:")
+                lines.extend(f"  {'/'.join(labels) or 'total'}: {_format(value)}" for labels, value in values[:limit])
+            continue
+        children = metric.children.items() if isinstance(metric, HistogramFamily) else [((), metric)]
+        rows = [(labels, child.snapshot()) for labels, child in children]
+        rows = sorted((row for row in rows if row[1]["count"]), key=lambda row: -row[1]["sum"])
+        if rows:
+            lines.append(f"{metric.description} (count, avg, p95):")
+            for labels, snapshot in rows[:limit]:
+                lines.append(f"  {'/'.join(labels) or 'all'}: {snapshot['count']}, "
+                             f"{ms(snapshot['sum'] / snapshot['count'])}, {ms(_quantile(snapshot, 0.95))}")
+    for prefix, description, function in _gauges:
+        try:
+            values = list(_flatten(prefix, function()))
+        except Exception:
+            continue
+        if values:
+            lines.append(f"{description or prefix}:")
+            lines.extend(f"  {name[len(prefix) + 1:]}: {_format(value)}" for name, value in values)
+    return "\n".join(lines) or "No data yet"
+
+
+async def serve(host: str, port: int):
+    """Serve render() at http://host:port/metrics; returns the aiohttp AppRunner (cleanup() stops it)"""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"Cache-Control": "no-store"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# Time from receiving a poll answer until the next poll has been sent
+answer_to_next_poll = register(Histogram(
+    "quiz_answer_to_next_poll_seconds",
+    "Latency between a quiz poll answer and the next poll being sent",
+))
+
+# Updates by type, and time spent processing them (all middlewares and handlers)
+updates_total = register(Counter("bot_updates_total", "Updates received", ("type",)))
+update_seconds = register(HistogramFamily("bot_update_seconds", "Update processing time", ("type",)))
+
+# Handlers
+handler_seconds = register(HistogramFamily("bot_handler_seconds", "Handler latency", ("handler",)))
+handler_errors_total = register(Counter("bot_handler_errors_total", "Exceptions raised by handlers",
+                                        ("handler", "error")))
+
+# Telegram Bot API calls (without the send queue wait)
+api_seconds = register(HistogramFamily("telegram_api_seconds", "Bot API request latency", ("method",)))
+api_errors_total = register(Counter("telegram_api_errors_total", "Failed Bot API requests", ("method", "error")))
+
+# Database work: run time of the database.py functions (see database.timed)
+db_seconds = register(HistogramFamily(
+    "db_query_seconds", "Database function run time", ("function",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, float("inf")),
+))
+
+# Parsing of uploaded question files, by question format plugin (or xlsx/csv)
+parse_seconds = register(HistogramFamily("quiz_parse_seconds", "Question file parse time", ("format",)))
+
+# Writes of the test storage file
+storage_flush_seconds = register(Histogram("storage_flush_seconds", "Time to write user_tests.json"))
+
+# Event loop scheduling delay, and stalls over LOOP_LAG_THRESHOLD by blocking code location
+_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+loop_lag_seconds = register(Histogram("event_loop_lag_seconds", "Event loop lag", _LAG_BUCKETS))
+loop_blocked_seconds = register(HistogramFamily("event_loop_blocked_seconds", "Event loop blocked by",
+                                                ("location",), _LAG_BUCKETS))
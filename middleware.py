@@ -1,21 +1,147 @@
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
-from typing import Dict, Any, Callable, Awaitable
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+from typing import Dict, Any, Callable, Awaitable, Optional
 import time
 import logging
-from collections import defaultdict
+import sqlite3
+from collections import OrderedDict
 import asyncio
-from config import RATE_LIMIT, ADMINS
+from config import RATE_LIMIT, RATE_LIMIT_MAX_USERS, RATE_LIMIT_BACKEND, RATE_LIMIT_DB, ADMINS
+import metrics
 
 logger = logging.getLogger(__name__)
 
+class MemoryRateLimitBackend:
+    """
+    Token buckets in this process
+    Buckets are kept in least recently used order; buckets idle long enough to be
+    full again are dropped (losing nothing) and at most `max_users` are kept.
+    No lock is needed: nothing is awaited between reading and updating a bucket.
+    """
+    def __init__(self, idle_after: float, max_users: int = RATE_LIMIT_MAX_USERS):
+        self.idle_after = idle_after
+        self.max_users = max_users
+        # user_id -> [tokens, last update]
+        self.buckets: "OrderedDict[int, list]" = OrderedDict()
+    
+    def take(self, user_id: int, capacity: float, rate: float, now: Optional[float] = None) -> bool:
+        """Take a token from the user's bucket; False if there is none"""
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = [capacity, now]
+            self._evict(now)
+        else:
+            self.buckets.move_to_end(user_id)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+    
+    def _evict(self, now: float) -> None:
+        # The least recently used buckets are at the front
+        buckets = self.buckets
+        while buckets:
+            user_id, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < self.idle_after and len(buckets) <= self.max_users:
+                break
+            del buckets[user_id]
+    
+    def __len__(self) -> int:
+        return len(self.buckets)
+    
+    def close(self) -> None:
+        pass
+
+
+class SQLiteRateLimitBackend:
+    """
+    Token buckets shared by several processes through a SQLite file
+    A check is one UPSERT that refills the bucket and takes a token only if the
+    refilled bucket has one, so concurrent processes cannot both take the last
+    token. The file holds nothing worth keeping, so it runs without fsync (a path
+    on tmpfs such as /dev/shm avoids the disk altogether). Idle buckets are
+    deleted periodically. If the database stays locked the request is allowed.
+    """
+    def __init__(self, path: str = RATE_LIMIT_DB, idle_after: float = 60):
+        self.path = path
+        self.idle_after = idle_after
+        self.conn = sqlite3.connect(path, timeout=0.05, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            user_id INTEGER PRIMARY KEY,
+            tokens REAL,
+            updated REAL
+        )
+        ''')
+        self.last_purge = time.time()
+    
+    def take(self, user_id: int, capacity: float, rate: float, now: Optional[float] = None) -> bool:
+        """Take a token from the user's bucket; False if there is none"""
+        # Wall clock: the timestamps are compared across processes
+        now = time.time() if now is None else now
+        try:
+            cursor = self.conn.execute('''
+            INSERT INTO rate_limits (user_id, tokens, updated) VALUES (:user_id, :capacity - 1, :now)
+            ON CONFLICT (user_id) DO UPDATE
+            SET tokens = MIN(:capacity, tokens + (:now - updated) * :rate) - 1, updated = :now
+            WHERE MIN(:capacity, tokens + (:now - updated) * :rate) >= 1
+            ''', {"user_id": user_id, "capacity": capacity, "rate": rate, "now": now})
+            allowed = cursor.rowcount == 1
+            if now - self.last_purge > self.idle_after:
+                self.last_purge = now
+                self.conn.execute('DELETE FROM rate_limits WHERE updated < ?', (now - self.idle_after,))
+            return allowed
+        except sqlite3.Error as e:
+            logger.error(f"Rate limit check failed, allowing user {user_id}: {e}")
+            return True
+    
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM rate_limits').fetchone()[0]
+    
+    def close(self) -> None:
+        self.conn.close()
+
+
 class RateLimiter(BaseMiddleware):
     """
     Middleware for rate limiting user requests to prevent abuse and server overload
+    Every user has a token bucket holding up to `requests` tokens that refills at
+    requests / per_seconds tokens per second (see RATE_LIMIT). The buckets live in
+    a backend: in this process by default (RATE_LIMIT_BACKEND=memory), or in a
+    SQLite file shared by all processes (RATE_LIMIT_BACKEND=sqlite) when several
+    processes receive updates of the same user. Sharded workers (sharding.py)
+    don't need that: each user's updates go to one worker.
     """
-    def __init__(self):
-        self.user_requests = defaultdict(list)
-        self.lock = asyncio.Lock()
+    def __init__(self, limits: Dict[str, Dict[str, int]] = RATE_LIMIT, backend=None):
+        # name -> (capacity, tokens per second)
+        self.limits = {name: (float(config["requests"]), config["requests"] / config["per_seconds"])
+                       for name, config in limits.items()}
+        if backend is None:
+            # A bucket untouched this long has refilled completely
+            idle_after = max(config["per_seconds"] for config in limits.values())
+            if RATE_LIMIT_BACKEND == "sqlite":
+                backend = SQLiteRateLimitBackend(RATE_LIMIT_DB, idle_after)
+            else:
+                backend = MemoryRateLimitBackend(idle_after)
+        self.backend = backend
+        self.admins = frozenset(ADMINS)
+        # Users who were told they are limited (told once per limited stretch)
+        self.notified = set()
+        self.limited = 0
+    
+    def allow(self, user_id: int) -> bool:
+        """Take a token from the user's bucket; False if there is none"""
+        capacity, rate = self.limits["admin"] if user_id in self.admins else self.limits["default"]
+        if self.backend.take(user_id, capacity, rate):
+            self.notified.discard(user_id)
+            return True
+        return False
     
     async def __call__(
         self,
@@ -23,62 +149,100 @@ class RateLimiter(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        # Extract user ID from the event
-        user_id = None
-        if hasattr(event, "from_user") and event.from_user:
-            user_id = event.from_user.id
-        elif hasattr(event, "chat") and event.chat:
-            user_id = event.chat.id
-        
-        if not user_id:
+        # Set by aiogram for every update that has a user
+        user = data.get("event_from_user")
+        if user is None:
             # If we can't identify the user, just process the request
             return await handler(event, data)
         
-        # Determine rate limit based on whether user is admin
-        limit_config = RATE_LIMIT["admin"] if user_id in ADMINS else RATE_LIMIT["default"]
-        max_requests = limit_config["requests"]
-        time_window = limit_config["per_seconds"]
+        if isinstance(event, Update) and event.poll_answer is not None:
+            # Answers to quiz polls the bot sent; limiting them would stall quizzes
+            return await handler(event, data)
         
-        # Get current time
-        current_time = time.time()
+        if self.allow(user.id):
+            return await handler(event, data)
         
-        # Clean up old requests and check if rate limit exceeded
-        is_limited = False
+        # User has exceeded rate limit
+        self.limited += 1
+        if user.id in self.notified:
+            # Already told; don't answer every flooding update with a send
+            return None
+        if len(self.notified) >= RATE_LIMIT_MAX_USERS:
+            self.notified.clear()
+        self.notified.add(user.id)
+        logger.warning(f"Rate limit exceeded for user {user.id}")
         
-        async with self.lock:
-            # Remove requests older than the time window
-            self.user_requests[user_id] = [
-                req_time for req_time in self.user_requests[user_id]
-                if current_time - req_time < time_window
-            ]
-            
-            # Check if the user has exceeded the rate limit
-            if len(self.user_requests[user_id]) >= max_requests:
-                is_limited = True
-            else:
-                # Add current request to the list
-                self.user_requests[user_id].append(current_time)
+        text = "You are sending too many requests. Please wait a moment before trying again."
+        try:
+            if isinstance(event, Update) and event.callback_query is not None:
+                await event.callback_query.answer(text, show_alert=True)
+            elif isinstance(event, Update) and event.message is not None:
+                await event.message.answer(text)
+        except Exception as e:
+            logger.error(f"Error sending rate limit message: {e}")
         
-        if is_limited:
-            # User has exceeded rate limit
-            logger.warning(f"Rate limit exceeded for user {user_id}")
-            
-            # If this is a message, respond with a rate limit message
-            if hasattr(event, "answer"):
-                try:
-                    await event.answer(
-                        "You are sending too many requests. Please wait a moment before trying again.",
-                        show_alert=True
-                    )
-                    return None
-                except Exception as e:
-                    logger.error(f"Error sending rate limit message: {e}")
-            
-            # For other types of events, just drop the request
-            return None
+        # Drop the request
+        return None
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Middleware recording update and handler metrics (see metrics.py)
+    On dp.update it counts updates by type and times their whole processing;
+    as an inner middleware of the event observers it times each handler and
+    counts its exceptions. setup() registers it in both places.
+    """
+    def setup(self, dispatcher) -> None:
+        dispatcher.update.middleware.register(self)
+        for name, observer in dispatcher.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware.register(self)
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        start = time.perf_counter()
+        if isinstance(event, Update):
+            update_type = event.event_type
+            metrics.updates_total.inc(update_type)
+            try:
+                return await handler(event, data)
+            finally:
+                metrics.update_seconds.labels(update_type).observe(time.perf_counter() - start)
         
-        # Process the request normally
-        return await handler(event, data)
+        # Menu buttons share one dispatching handler; label them by button
+        button = data.get("button")
+        handler_object = data.get("handler")
+        if button is not None:
+            name = button[0]
+        elif handler_object is not None:
+            name = getattr(handler_object.callback, "__name__", "unknown")
+        else:
+            name = "unknown"
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.handler_errors_total.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.handler_seconds.labels(name).observe(time.perf_counter() - start)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware timing Bot API requests by method"""
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.api_errors_total.inc(name, type(e).__name__)
+            raise
+        finally:
+            metrics.api_seconds.labels(name).observe(time.perf_counter() - start)
 
 
 class ErrorHandler(BaseMiddleware):
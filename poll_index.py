@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from config import POLL_INDEX_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class PollEntry(NamedTuple):
+    user_id: int
+    session_id: str
+    question: int  # Position of the question within the quiz
+    correct_option: int
+    expires_at: float  # Unix time
+
+
+class PollIndex:
+    """
+    Index of sent quiz polls: poll_id -> (user, session, question, correct option)
+    Poll answers are routed with one dict lookup. An entry is removed when it is
+    answered, so a repeated or stale answer is ignored instead of being counted
+    against the current question. Entries expire after POLL_INDEX_TTL.
+    The index is kept in memory only: the quiz sessions it points to live in
+    the FSM's MemoryStorage, so after a restart there is nothing to route
+    answers to and running quizzes have to be started again.
+    """
+    def __init__(self, ttl: int = POLL_INDEX_TTL):
+        self.ttl = ttl
+        self.polls: Dict[str, PollEntry] = {}
+        self.lock = threading.Lock()
+        self.last_purge = time.time()
+
+    def register(self, poll_id: str, user_id: int, session_id: str, question: int, correct_option: int) -> None:
+        """Remember a sent poll"""
+        now = time.time()
+        with self.lock:
+            self.polls[poll_id] = PollEntry(user_id, session_id, question, correct_option, now + self.ttl)
+            if now - self.last_purge > 60:
+                self._purge_expired(now)
+
+    def pop(self, poll_id: str) -> Optional[PollEntry]:
+        """Take the entry for an answered poll; None if unknown, expired or already answered"""
+        with self.lock:
+            entry = self.polls.pop(poll_id, None)
+        if entry is None or entry.expires_at < time.time():
+            return None
+        return entry
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [poll_id for poll_id, entry in self.polls.items() if entry.expires_at < now]
+        for poll_id in expired:
+            del self.polls[poll_id]
+        self.last_purge = now
+        if expired:
+            logger.info(f"Removed {len(expired)} expired quiz polls")
@@ -0,0 +1,95 @@
+import functools
+import random
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+@functools.lru_cache(maxsize=256)
+def _permutation(seed: int, start: int, end: int) -> Tuple[int, ...]:
+    """Shuffled question indexes for a seed, shared by all sessions using it"""
+    order = list(range(start, end))
+    random.Random(seed).shuffle(order)
+    return tuple(order)
+
+
+class QuizSession:
+    """
+    Compact state of a running quiz
+    The session references the saved test instead of copying its questions:
+    it only keeps the test id/version, the selected range, a shuffle seed and
+    the score counters, so it costs O(1) memory regardless of the test size.
+    Questions are fetched from TestStorage by index when they are sent.
+    """
+    __slots__ = (
+        "session_id", "test_id", "version", "test_name", "start", "end", "seed",
+        "shuffle_answers", "current", "correct", "missed", "lang",
+    )
+
+    def __init__(self, test_id: str, version: int, test_name: str, start: int, end: int,
+                 seed: Optional[int] = None, shuffle_answers: bool = False,
+                 current: int = 0, correct: int = 0, missed: int = 0, session_id: Optional[str] = None,
+                 lang: Optional[str] = None):
+        self.session_id = session_id or uuid.uuid4().hex  # Identifies this run of the quiz
+        self.test_id = test_id
+        self.version = version
+        self.test_name = test_name
+        self.start = start  # First question index (inclusive, 0-based)
+        self.end = end  # Last question index (exclusive)
+        self.seed = seed  # None means questions are asked in order
+        self.shuffle_answers = shuffle_answers
+        self.current = current  # Position of the current question within the quiz
+        self.correct = correct
+        self.missed = missed  # Timed out questions in a row
+        self.lang = lang  # Cached so answers need no language lookup
+
+    @property
+    def total(self) -> int:
+        return self.end - self.start
+
+    def question_index(self, position: Optional[int] = None) -> int:
+        """Map a position in the quiz to the question index in the saved test"""
+        if position is None:
+            position = self.current
+        if self.seed is None:
+            return self.start + position
+        return _permutation(self.seed, self.start, self.end)[position]
+
+    def to_state(self) -> Dict[str, Any]:
+        """Serialize for FSM storage"""
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_state(cls, data: Optional[Dict[str, Any]]) -> Optional["QuizSession"]:
+        """Restore a session saved with to_state(), or None if there is none"""
+        if not data:
+            return None
+        return cls(**data)
+
+
+class PayloadCache:
+    """
+    Bounded cache of the next poll payload per quiz session
+    The next question is prepared while the user is answering the current one,
+    so sending it after the answer needs no storage lookup or shuffling.
+    """
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+
+    def put(self, session_id: str, position: int, payload: Dict[str, Any]) -> None:
+        self.entries[session_id] = (position, payload)
+        self.entries.move_to_end(session_id)
+        while len(self.entries) > self.max_entries:
+            # Abandoned quizzes are evicted first
+            self.entries.popitem(last=False)
+
+    def take(self, session_id: str, position: int) -> Optional[Dict[str, Any]]:
+        """Return the prepared payload for this position, if any, and forget it"""
+        entry = self.entries.pop(session_id, None)
+        if entry is None or entry[0] != position:
+            return None
+        return entry[1]
+
+    def discard(self, session_id: str) -> None:
+        self.entries.pop(session_id, None)
@@ -0,0 +1,92 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Shared scheduler for quiz question deadlines
+    All deadlines live in one heap served by a single asyncio task, instead of
+    one sleeping task per user. Scheduling is O(log n); cancelling is O(1) and
+    lazy: a cancelled or replaced deadline stays in the heap and is skipped
+    when it reaches the top. Each key (a quiz session id) has at most one live
+    deadline; scheduling it again replaces the previous one.
+    """
+    def __init__(self, callback: Callable[[str, Any], Awaitable[None]]):
+        self.callback = callback
+        self.heap: List[Tuple[float, int, str]] = []
+        self.deadlines: Dict[str, Tuple[int, Any]] = {}  # key -> (sequence, payload)
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.running = set()  # Handler tasks in progress
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def schedule(self, key: str, delay: float, payload: Any = None) -> None:
+        """Call callback(key, payload) after delay seconds unless cancelled"""
+        when = time.monotonic() + delay
+        seq = next(self.sequence)
+        self.deadlines[key] = (seq, payload)
+        earliest = self.heap[0][0] if self.heap else None
+        heapq.heappush(self.heap, (when, seq, key))
+        if earliest is None or when < earliest:
+            self.wakeup.set()
+        # Drop dead entries once they dominate the heap
+        if len(self.heap) > 2 * len(self.deadlines) + 1024:
+            self._compact()
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def cancel(self, key: str) -> None:
+        self.deadlines.pop(key, None)
+
+    def _compact(self) -> None:
+        self.heap = [entry for entry in self.heap if self.deadlines.get(entry[2], (None,))[0] == entry[1]]
+        heapq.heapify(self.heap)
+
+    async def _run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                _, seq, key = heapq.heappop(self.heap)
+                live = self.deadlines.get(key)
+                if live is None or live[0] != seq:
+                    continue  # Cancelled or rescheduled
+                del self.deadlines[key]
+                # Handlers send messages, so they run concurrently and never delay other deadlines
+                task = asyncio.get_running_loop().create_task(self._fire(key, live[1]))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+            timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, key: str, payload: Any) -> None:
+        try:
+            await self.callback(key, payload)
+        except Exception as e:
+            logger.error(f"Error handling deadline for {key}: {e}")
+
+    async def stop(self) -> None:
+        """Stop the scheduler and cancel handlers still running, before the bot session closes"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        running = list(self.running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
@@ -1,39 +1,396 @@
-from docx import Document
 import random
 import os
 import logging
 import re
-import functools
-import threading
-from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import List, Tuple
 
-# For AI-based parsing
-import nltk
-from nltk.tokenize import sent_tokenize
+import metrics
+from text_encoding import decode_stream
 
 logger = logging.getLogger(__name__)
 
-# Thread-local storage for NLTK resources to avoid repeated downloads
-_thread_local = threading.local()
+# Number of non-empty lines each format plugin looks at to score a document
+SAMPLE_LINES = 200
+
+# Telegram quiz poll limits
+POLL_QUESTION_MAX = 300
+POLL_OPTION_MAX = 100
+POLL_OPTIONS_MIN = 2
+POLL_OPTIONS_MAX = 10
+# Room left in the poll question for the "N/M. " counter of compact delivery
+QUESTION_COUNTER_RESERVE = 12
+
+_OPTION_RE = re.compile(r'^[A-Za-z0-9][).\s]|^\([A-Za-z0-9]\)')
+_OPTION_PREFIX_RE = re.compile(r'^\(?[A-Za-z0-9][).]?\s*')
+_PLUS_MINUS_RE = re.compile(r'^[+\-]\s')
+_NUMBERED_RE = re.compile(r'^\d+\.\s')
+_LETTERED_RE = re.compile(r'^[A-Za-z]\)\s')
+_QUESTION_NUMBER_RE = re.compile(r'question\s+\d+[:.\s]')
+_QUESTION_WORD_RE = re.compile(r'question|savol|вопрос')
+
+
+def _is_separator(text):
+    return text == "++++" or text.startswith("+++++") or text == "====" or text.startswith("=====")
+
+
+class QuestionFormat:
+    """
+    Base class for question format plugins
+    score() looks at a sample of lines and returns a confidence between 0 and 1,
+    parse() turns all lines into a list of (question, [answers]) tuples
+    where the first answer is the correct one
+    """
+    name = "base"
+
+    def score(self, lines: List[str]) -> float:
+        raise NotImplementedError
+
+    def parse(self, lines: List[str]) -> List[Tuple[str, List[str]]]:
+        raise NotImplementedError
+
+
+class QuestionMarkFormat(QuestionFormat):
+    """?Question / +correct answer / -wrong answer"""
+    name = "question_mark"
+
+    def score(self, lines):
+        questions = sum(1 for text in lines if text.startswith("?"))
+        answers = sum(1 for text in lines if text.startswith(("+", "-")))
+        if not questions or not answers:
+            return 0.0
+        return (questions + answers) / len(lines)
+
+    def parse(self, lines):
+        questions = []
+        current_question = None
+        options = []
+        for text in lines:
+            # Check for the new format: ?savol
+            if text.startswith("?"):
+                # Save the previous question if exists
+                if current_question and options:
+                    questions.append((current_question, options))
+                    options = []
+                current_question = text[1:].strip()  # Remove the '?' prefix
+
+            # Answer format: +to'g'ri javob (correct) or -noto'g'ri javob (wrong)
+            elif text.startswith("+"):
+                options.insert(0, text[1:].strip())  # Put correct answer first
+            elif text.startswith("-"):
+                options.append(text[1:].strip())
+
+        if current_question and options:
+            questions.append((current_question, options))
+        return questions
+
+
+class SeparatorFormat(QuestionFormat):
+    """Question / ==== / #correct answer / ==== / wrong answer / +++++"""
+    name = "separator"
+
+    def score(self, lines):
+        markers = sum(1 for text in lines if _is_separator(text) or text.startswith("#"))
+        if not markers:
+            return 0.0
+        # Roughly every other line is a marker in a well-formed document
+        return min(0.95, markers / len(lines) * 1.5)
+
+    def parse(self, lines):
+        questions = []
+        current_question = None
+        options = []
+        for text in lines:
+            # Question separator
+            if text == "++++" or text.startswith("+++++"):
+                if current_question and options:
+                    questions.append((current_question, options))
+                    current_question = None
+                    options = []
+
+            # Options separator (skip)
+            elif text == "====" or text.startswith("====="):
+                pass
+
+            # New question (if we don't have one yet and it doesn't start with #)
+            elif not current_question and not text.startswith('#'):
+                current_question = text
+
+            # Correct answer
+            elif text.startswith('#'):
+                options.insert(0, text[1:].strip())  # Put correct answer first
+
+            # Wrong answer
+            elif current_question:
+                options.append(text.strip())
+
+        if current_question and options:
+            questions.append((current_question, options))
+        return questions
+
+
+class NumberedFormat(QuestionFormat):
+    """
+    Rule-based extraction of unmarked documents: questions end with '?', are
+    numbered ("1. ...", "Question 1:") or mention a question word, and are
+    followed by lettered (A), B)...) or +/- prefixed options
+    """
+    name = "numbered"
+
+    @staticmethod
+    def _is_question(text):
+        lowered = text.lower()
+        return (
+            text.endswith('?')
+            or (_NUMBERED_RE.match(text) and len(text) > 3)
+            or _QUESTION_NUMBER_RE.search(lowered)
+            or (_LETTERED_RE.match(text) and len(text) > 3)
+            or _QUESTION_WORD_RE.search(lowered)
+        )
+
+    def score(self, lines):
+        questions = sum(1 for text in lines if self._is_question(text))
+        options = sum(1 for text in lines if _OPTION_RE.match(text) or _PLUS_MINUS_RE.match(text))
+        if not questions or not options:
+            return 0.0
+        return 0.9 * min(1.0, (questions + options) / len(lines))
+
+    def parse(self, lines):
+        questions = []
+        i = 0
+        while i < len(lines):
+            if not self._is_question(lines[i]):
+                i += 1
+                continue
+
+            question_text = lines[i]
+            options = []
+            has_correct = False
+
+            # Look ahead for options (limit to 6)
+            j = i + 1
+            while j < len(lines) and len(options) < 6:
+                option_para = lines[j]
+                if option_para.endswith('?') or _NUMBERED_RE.match(option_para):
+                    # Next question starts
+                    break
+                if _PLUS_MINUS_RE.match(option_para):
+                    # +correct / -wrong
+                    option_text = option_para[1:].strip()
+                    if option_para.startswith('+'):
+                        has_correct = True
+                        options.insert(0, option_text)
+                    else:
+                        options.append(option_text)
+                elif _OPTION_RE.match(option_para):
+                    # Lettered options: the first one is assumed to be correct
+                    option_text = _OPTION_PREFIX_RE.sub('', option_para, count=1)
+                    if not has_correct:
+                        has_correct = True
+                        options.insert(0, option_text)
+                    else:
+                        options.append(option_text)
+                elif options:
+                    # First non-option line after the options ends this question
+                    break
+                elif len(option_para) < 100:
+                    # No option marker yet, a short line may be the answer
+                    has_correct = True
+                    options.append(option_para)
+                else:
+                    break
+                j += 1
+
+            if options:
+                questions.append((question_text, options))
+            i = max(j, i + 1)
+        return questions
+
+
+class FreeformFormat(QuestionFormat):
+    """Fallback: lines ending with '?' are questions, the following lines are options"""
+    name = "freeform"
+
+    def score(self, lines):
+        return 0.05
+
+    def parse(self, lines):
+        questions = []
+        current_question = None
+        options = []
+        for text in lines:
+            # If text ends with a question mark, treat it as a question
+            if text.endswith('?') or (not current_question and not any(opt in text.lower() for opt in ['a)', 'b)', 'c)', '1)', '2)'])):
+                if current_question and options:
+                    questions.append((current_question, options))
+                    options = []
+                current_question = text
+
+            # Otherwise, treat it as an option; the first one is assumed to be correct
+            elif current_question:
+                options.append(text)
+
+        if current_question and options:
+            questions.append((current_question, options))
+        return questions
+
+
+class FormatRegistry:
+    """
+    Registry of question format plugins
+    Every plugin scores a sampled prefix of the document and only the best one
+    runs a full parse. Parse durations go to metrics.parse_seconds by plugin name.
+    """
+    def __init__(self):
+        self.formats: List[QuestionFormat] = []
+
+    def register(self, question_format: QuestionFormat) -> QuestionFormat:
+        self.formats.append(question_format)
+        return question_format
+
+    def get(self, name: str) -> QuestionFormat:
+        for question_format in self.formats:
+            if question_format.name == name:
+                return question_format
+        raise KeyError(name)
+
+    def rank(self, lines: List[str]):
+        """Return [(score, plugin)] for the sampled prefix, best first"""
+        sample = lines[:SAMPLE_LINES]
+        if not sample:
+            return []
+        scored = [(question_format.score(sample), question_format) for question_format in self.formats]
+        # sorted() is stable, so registration order breaks ties
+        return sorted((item for item in scored if item[0] > 0), key=lambda item: item[0], reverse=True)
+
+    def parse(self, lines: List[str], question_format: QuestionFormat):
+        start = time.perf_counter()
+        try:
+            return question_format.parse(lines)
+        finally:
+            metrics.parse_seconds.labels(question_format.name).observe(time.perf_counter() - start)
+
+
+format_registry = FormatRegistry()
+format_registry.register(QuestionMarkFormat())
+format_registry.register(SeparatorFormat())
+format_registry.register(NumberedFormat())
+format_registry.register(FreeformFormat())
+
+
+def extract_lines(doc, file_type="docx"):
+    """Extract non-empty, stripped lines from a Word document or text content"""
+    if file_type == "docx":
+        return [para.text.strip() for para in doc.paragraphs if para.text.strip()]
+    if isinstance(doc, str):
+        doc = doc.split('\n')
+    return [line.strip() for line in doc if line.strip()]
+
+
+def fix_questions(questions):
+    """
+    Fix common formatting errors in parsed questions
+    Returns a tuple: (fixed_questions, has_errors)
+    """
+    has_errors = False
+    fixed_questions = []
+    for question, opts in questions:
+        # Check if there are too many options (more than 4 is likely a formatting error)
+        if len(opts) > 4:
+            has_errors = True
+            # Keep only the first 4 options (first one is correct, plus 3 wrong options)
+            opts = opts[:4]
+            logger.warning(f"Fixed question with too many options: {question[:30]}...")
+        # Check if there are duplicate options
+        if len(set(opts)) < len(opts):
+            has_errors = True
+            # Remove duplicates while preserving order
+            opts = list(dict.fromkeys(opts))
+            logger.warning(f"Fixed question with duplicate options: {question[:30]}...")
+        # Check for very long options that might indicate formatting issues
+        if any(len(opt) > 150 for opt in opts):
+            has_errors = True
+            opts = [opt[:150] + '...' if len(opt) > 150 else opt for opt in opts]
+            logger.warning(f"Fixed question with very long options: {question[:30]}...")
+        fixed_questions.append((question, opts))
+    return fixed_questions, has_errors
+
+
+def _truncate(text, limit):
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def prepare_questions(questions):
+    """
+    Validate and normalize questions into ready-to-send quiz poll payloads
+    Question and option texts are cut to Telegram's poll limits (leaving room
+    for the question counter), and questions that cannot be sent as a quiz poll
+    (fewer than 2 options) are dropped, so problems are reported at upload time
+    instead of in the middle of a quiz
+    Returns a tuple: (prepared_questions, has_errors)
+    """
+    has_errors = False
+    prepared = []
+    question_limit = POLL_QUESTION_MAX - QUESTION_COUNTER_RESERVE
+    for question, opts in questions:
+        question = question.strip()
+        options = [opt.strip() for opt in opts if opt and opt.strip()]
+        if any(len(opt) > POLL_OPTION_MAX for opt in options):
+            has_errors = True
+            options = [_truncate(opt, POLL_OPTION_MAX) for opt in options]
+        # Truncation can make options equal, Telegram needs them distinct
+        options = list(dict.fromkeys(options))[:POLL_OPTIONS_MAX]
+        if not question or len(options) < POLL_OPTIONS_MIN:
+            has_errors = True
+            logger.warning(f"Dropped question that cannot be sent as a quiz poll: {question[:30]}...")
+            continue
+        if len(question) > question_limit:
+            has_errors = True
+            question = _truncate(question, question_limit)
+            logger.warning(f"Shortened question to fit the poll limit: {question[:30]}...")
+        prepared.append((question, options))
+    return prepared, has_errors
+
+
+def finalize_questions(questions):
+    """
+    Run the formatting fixes and poll normalization on parsed questions
+    Returns a tuple: (questions, has_errors)
+    """
+    questions, fix_errors = fix_questions(questions)
+    questions, prepare_errors = prepare_questions(questions)
+    return questions, fix_errors or prepare_errors
+
+
+def parse_questions(doc, file_type="docx", format_name=None):
+    """
+    Parse a document into quiz questions
+    The document is read once; each registered format scores a sample of it and
+    only the best-scoring format parses the full document. If it finds nothing,
+    no other format is tried: the document has no questions.
+    format_name: force a specific format plugin
+    Returns a tuple: (questions, has_errors)
+    """
+    try:
+        lines = extract_lines(doc, file_type)
+        if format_name:
+            candidates = [(1.0, format_registry.get(format_name))] if lines else []
+        else:
+            candidates = format_registry.rank(lines)
+
+        if candidates:
+            confidence, question_format = candidates[0]
+            questions = format_registry.parse(lines, question_format)
+            if questions:
+                logger.info(f"Parsed {len(questions)} questions with format '{question_format.name}' (confidence {confidence:.2f})")
+                return finalize_questions(questions)
+            logger.info(f"Best format '{question_format.name}' (confidence {confidence:.2f}) found no questions")
+    except Exception as e:
+        logger.error(f"Error parsing document: {e}")
+        return [], True
+    return [], False
 
-# Cache for expensive operations
-_cache_lock = threading.RLock()
-_parse_cache = {}
 
-def memoize(func):
-    """Simple memoization decorator for functions with hashable arguments"""
-    cache = {}
-    
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        key = str(args) + str(sorted(kwargs.items()))
-        with _cache_lock:
-            if key not in cache:
-                cache[key] = func(*args, **kwargs)
-            return cache[key]
-    return wrapper
-
-@memoize
 def convert_format(doc, file_type="docx"):
     """
     Convert document format to quiz format
@@ -44,175 +401,7 @@ def convert_format(doc, file_type="docx"):
     
     file_type: "docx" for Word documents, "txt" for text files
     """
-    questions = []
-    current_question = None
-    options = []
-    
-    # Flag to track if any formatting errors were detected and fixed
-    has_errors = False
-    
-    try:
-        # Extract text content based on file type
-        paragraph_texts = []
-        
-        if file_type == "docx":
-            # Parse Word document
-            for para in doc.paragraphs:
-                text = para.text.strip()
-                if text:  # Only add non-empty paragraphs
-                    paragraph_texts.append(text)
-        else:  # txt format
-            # Parse text file content
-            if isinstance(doc, str):
-                paragraph_texts = [line.strip() for line in doc.strip().split('\n') if line.strip()]
-            else:
-                paragraph_texts = [line.strip() for line in doc if line.strip()]
-        
-        # First check for question format markers
-        has_question_mark_format = any(text.startswith("?") for text in paragraph_texts)
-        has_plus_minus_format = any(text.startswith("+") or text.startswith("-") for text in paragraph_texts)
-        has_hash_format = any(text.startswith("#") for text in paragraph_texts)
-        has_separator_format = any(text == "++++" or text.startswith("+++++") or 
-                                 text == "====" or text.startswith("=====") for text in paragraph_texts)
-        
-        # Determine the most likely format based on markers
-        if has_question_mark_format and has_plus_minus_format:
-            # Process using the new format (?Question, +Correct, -Wrong)
-            for text in paragraph_texts:
-                # Check for the new format: ?savol
-                if text.startswith("?"):
-                    # Save the previous question if exists
-                    if current_question and options:
-                        questions.append((current_question, options))
-                        options = []
-                    
-                    current_question = text[1:].strip()  # Remove the '?' prefix
-                    
-                # Answer format: +to'g'ri javob (correct) or -noto'g'ri javob (wrong)
-                elif text.startswith("+"):
-                    correct_answer = text[1:].strip()
-                    options.insert(0, correct_answer)  # Put correct answer first
-                    
-                elif text.startswith("-"):
-                    wrong_answer = text[1:].strip()
-                    options.append(wrong_answer)
-        
-        elif has_separator_format or has_hash_format:
-            # Process using the old format with ==== and +++++
-            i = 0
-            while i < len(paragraph_texts):
-                text = paragraph_texts[i]
-                
-                # Question separator
-                if text == "++++" or text.startswith("+++++"):
-                    if current_question and options:
-                        questions.append((current_question, options))
-                        current_question = None
-                        options = []
-                        
-                # Options separator (skip)
-                elif text == "====" or text.startswith("====="):
-                    pass
-                    
-                # New question (if we don't have one yet and it doesn't start with #)
-                elif not current_question and not text.startswith('#'):
-                    current_question = text
-                    
-                # Correct answer
-                elif text.startswith('#'):
-                    correct_answer = text[1:].strip()
-                    options.insert(0, correct_answer)  # Put correct answer first
-                    
-                # Wrong answer
-                elif text and current_question:
-                    options.append(text.strip())
-                    
-                i += 1
-        
-        else:
-            # No clear format markers, try to parse as simple question/answer format
-            i = 0
-            while i < len(paragraph_texts):
-                text = paragraph_texts[i]
-                
-                # If text ends with a question mark, treat it as a question
-                if text.endswith('?') or (not current_question and not any(opt in text.lower() for opt in ['a)', 'b)', 'c)', '1)', '2)'])):
-                    # Save previous question if exists
-                    if current_question and options:
-                        questions.append((current_question, options))
-                        options = []
-                    
-                    current_question = text
-                    
-                # Otherwise, treat it as an option
-                elif current_question:
-                    # If this looks like an option (A), B), etc.)
-                    if re.match(r'^[A-Za-z0-9][).\s]|^\([A-Za-z0-9]\)', text):
-                        # If this is the first option, assume it's correct
-                        if not options:
-                            options.insert(0, text)  # Put first option as correct answer
-                        else:
-                            options.append(text)
-                    else:
-                        # If not a clear option format but we have a question, treat as an option
-                        options.append(text)
-                
-                i += 1
-                
-        # Add the last question if we haven't done so already
-        if current_question and options:
-            questions.append((current_question, options))
-        
-        # Check for and fix formatting errors in questions
-        fixed_questions = []
-        for question, opts in questions:
-            # Check if there are too many options (more than 4 is likely a formatting error)
-            if len(opts) > 4:
-                has_errors = True
-                # Keep only the first 4 options (first one is correct, plus 3 wrong options)
-                fixed_opts = opts[:4]
-                fixed_questions.append((question, fixed_opts))
-                logger.warning(f"Fixed question with too many options: {question[:30]}...")
-            # Check if there are duplicate options
-            elif len(set(opts)) < len(opts):
-                has_errors = True
-                # Remove duplicates while preserving order
-                seen = set()
-                fixed_opts = []
-                for opt in opts:
-                    if opt not in seen:
-                        seen.add(opt)
-                        fixed_opts.append(opt)
-                fixed_questions.append((question, fixed_opts))
-                logger.warning(f"Fixed question with duplicate options: {question[:30]}...")
-            # Check for very long options that might indicate formatting issues
-            elif any(len(opt) > 150 for opt in opts):
-                has_errors = True
-                # Truncate long options
-                fixed_opts = [opt[:150] + '...' if len(opt) > 150 else opt for opt in opts]
-                fixed_questions.append((question, fixed_opts))
-                logger.warning(f"Fixed question with very long options: {question[:30]}...")
-            else:
-                # No issues with this question
-                fixed_questions.append((question, opts))
-        
-        # Replace original questions with fixed ones
-        questions = fixed_questions
-        
-        # If we couldn't parse any questions or if some questions have too few options,
-        # try AI-based extraction as a fallback
-        if not questions or any(len(q[1]) < 2 for q in questions):
-            ai_questions, ai_has_errors = ai_extract_questions(doc, file_type)
-            if ai_questions:
-                # If AI extraction found questions, use those instead
-                # Combine error flags
-                return ai_questions, (has_errors or ai_has_errors)
-            
-    except Exception as e:
-        logger.error(f"Error parsing document: {e}")
-        has_errors = True
-        
-    return questions, has_errors
+    return parse_questions(doc, file_type)
 
 def parse_text_file(file_content):
     """
@@ -222,161 +411,130 @@ def parse_text_file(file_content):
     """
     return convert_format(file_content, file_type="txt")
 
-@memoize
 def ai_extract_questions(content, file_type="txt"):
     """
-    Use AI techniques to extract questions and answers from unformatted text
-    Returns a tuple: (questions, has_errors) where:
-    - questions is a list of tuples: (question, [answers]) where the first answer is the correct one
-    - has_errors is a boolean indicating if formatting errors were detected and fixed
-    
-    This uses rule-based NLP techniques to identify questions and potential answers
-    without requiring specific formatting markers.
+    Extract questions and answers from unformatted text using the rule-based
+    "numbered" format (no specific formatting markers required)
+    Returns a tuple: (questions, has_errors)
+    """
+    return parse_questions(content, file_type, format_name=NumberedFormat.name)
+
+# Whole-cell titles of a header row, column A and column B
+_HEADER_WORDS = ("question", "questions", "savol", "savollar", "вопрос", "вопросы")
+_ANSWER_HEADER_WORDS = ("answer", "answers", "correct answer", "correct", "javob", "to'g'ri javob",
+                        "ответ", "правильный ответ")
+
+
+def _cell_text(value):
+    """Convert a spreadsheet cell value to stripped text"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _is_header(cells):
+    def title(cell):
+        return cell.lower().rstrip(":").strip()
+    return title(cells[0]) in _HEADER_WORDS or (len(cells) > 1 and title(cells[1]) in _ANSWER_HEADER_WORDS)
+
+
+def iter_table_rows(stream, file_type="xlsx"):
+    """
+    Stream rows from an .xlsx or .csv file as lists of cell texts
+    Spreadsheets are opened in read-only mode and CSV files are decoded
+    incrementally, so memory use does not grow with the number of rows
+    """
+    if file_type == "xlsx":
+        # openpyxl is imported on first use to keep startup fast
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield [_cell_text(value) for value in row]
+        finally:
+            workbook.close()
+    else:
+        import codecs
+        import csv
+        from text_encoding import SAMPLE_SIZE, detect_encoding
+
+        sample = stream.read(SAMPLE_SIZE)
+        stream.seek(0)
+        encoding = detect_encoding(sample)
+        # Spreadsheet apps in our users' locales often export with ';' instead of ','
+        first_line = sample.decode(encoding, errors="ignore").lstrip("\ufeff").split("\n", 1)[0]
+        delimiter = max(",;\t", key=first_line.count)
+        reader = codecs.getreader(encoding)(stream, errors="replace")
+        for row in csv.reader(reader, delimiter=delimiter):
+            yield [_cell_text(value) for value in row]
+
+
+def parse_table(stream, file_type="xlsx"):
+    """
+    Parse a spreadsheet or CSV question bank
+    Each row is one question: question, correct answer, wrong answers...
+    Cells keep their columns: a row without a question (A) or a correct
+    answer (B) is skipped and reported as an error. A header row
+    (e.g. "Question | Answer") is skipped
+    Returns a tuple: (questions, has_errors)
     """
     questions = []
     has_errors = False
-    
+    first_row = True
+    started = time.perf_counter()
     try:
-        # Download NLTK resources if not already present (thread-safe)
-        if not hasattr(_thread_local, 'nltk_downloaded'):
-            try:
-                nltk.data.find('tokenizers/punkt')
-            except LookupError:
-                nltk.download('punkt', quiet=True)
-            _thread_local.nltk_downloaded = True
-        
-        # Extract text based on file type
-        if file_type == "docx":
-            # For docx, content is a Document object
-            text = "\n".join([para.text for para in content.paragraphs if para.text.strip()])
-        else:
-            # For txt, content is already a string
-            text = content if isinstance(content, str) else "\n".join(content)
-        
-        # Check if we've already processed this exact text
-        cache_key = hash(text)
-        with _cache_lock:
-            if cache_key in _parse_cache:
-                return _parse_cache[cache_key]
-        
-        # Split text into paragraphs
-        paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
-        
-        # Process paragraphs to identify questions and answers
-        i = 0
-        while i < len(paragraphs):
-            current_para = paragraphs[i]
-            
-            # Identify potential questions (ends with ? or numbered items like "1." or "Question 1:")
-            is_question = False
-            if current_para.endswith('?'):
-                is_question = True
-            elif re.match(r'^\d+\.\s', current_para) and len(current_para) > 3:  # Numbered item (e.g., "1. What is...")
-                is_question = True
-            elif re.search(r'question\s+\d+[:.\s]', current_para.lower()):
-                is_question = True
-            elif re.match(r'^[A-Za-z]\)\s', current_para) and len(current_para) > 3:  # Lettered item (e.g., "A) What is...")
-                is_question = True
-            elif re.search(r'question|savol|вопрос', current_para.lower()):
-                is_question = True
-            
-            if is_question:
-                question_text = current_para
-                options = []
-                correct_answer = None
-                
-                # Look ahead for potential answers (usually in the next 2-6 lines)
-                j = i + 1
-                
-                # Look for options in subsequent paragraphs
-                while j < len(paragraphs) and len(options) < 6:  # Limit to 6 options max
-                    option_para = paragraphs[j]
-                    
-                    # Skip empty lines
-                    if not option_para.strip():
-                        j += 1
-                        continue
-                    
-                    # Check if this paragraph is an option (A), a), 1), etc.)
-                    option_match = re.match(r'^[A-Za-z0-9][).\s]|^\([A-Za-z0-9]\)', option_para)
-                    
-                    # Check for options with + or - prefixes (common in some formats)
-                    plus_minus_match = re.match(r'^[+\-]\s', option_para)
-                    
-                    if option_match or plus_minus_match:
-                        # This is an option
-                        if plus_minus_match:
-                            # Handle +/- format
-                            is_correct = option_para.startswith('+')
-                            option_text = option_para[1:].strip()
-                            
-                            if is_correct:
-                                # This is marked as correct with +
-                                correct_answer = option_text
-                                options.insert(0, option_text)  # Put correct answer first
-                            else:
-                                # This is marked as incorrect with -
-                                options.append(option_text)
-                        else:
-                            # Standard option format (A, B, C, etc.)
-                            option_text = option_para.lstrip('ABCDEFGabcdefg0123456789(). 	')
-                            
-                            # If this is the first option, assume it's correct
-                            if correct_answer is None:
-                                correct_answer = option_text
-                                options.insert(0, option_text)  # Put correct answer first
-                            else:
-                                options.append(option_text)  # Add as wrong answer
-                        
-                        j += 1
-                    else:
-                        # If we've already found at least one option and this isn't an option,
-                        # we're done with this question
-                        if options:
-                            break
-                        # If we haven't found any options yet, check if this could be a correct answer
-                        # (no option marker, but could be the answer)
-                        elif len(option_para) < 100:  # Reasonable length for an answer
-                            correct_answer = option_para
-                            options.append(correct_answer)
-                            j += 1
-                        else:
-                            # Not an option and too long to be an answer
-                            break
-                    if options:
-                        # Check for formatting issues
-                        if len(options) > 4:
-                            has_errors = True
-                            # Keep only the first 4 options
-                            options = options[:4]
-                            logger.warning(f"AI extraction fixed question with too many options: {question_text[:30]}...")
-                        
-                        # Check for duplicate options
-                        if len(set(options)) < len(options):
-                            has_errors = True
-                            # Remove duplicates while preserving order
-                            seen = set()
-                            fixed_opts = []
-                            for opt in options:
-                                if opt not in seen:
-                                    seen.add(opt)
-                                    fixed_opts.append(opt)
-                            options = fixed_opts
-                            logger.warning(f"AI extraction fixed question with duplicate options: {question_text[:30]}...")
-                        
-                        questions.append((question_text, options))
-        
-        # If we still couldn't identify any questions, fall back to the original parser
-        if not questions:
-            logger.warning("AI extraction couldn't identify questions, falling back to standard parser")
-            return convert_format(content, file_type=file_type)
-            
+        for row in iter_table_rows(stream, file_type):
+            cells = list(row)
+            while cells and not cells[-1]:
+                cells.pop()
+            if not cells:
+                continue
+            if first_row:
+                first_row = False
+                if _is_header(cells):
+                    continue
+            if len(cells) < 2 or not cells[0] or not cells[1]:
+                has_errors = True
+                logger.warning(f"Skipped row without a question or correct answer: {' | '.join(cells)[:40]}...")
+                continue
+            wrong_answers = [cell for cell in cells[2:] if cell]
+            if len(wrong_answers) < len(cells) - 2:
+                # Gap between wrong answers; their order does not matter
+                has_errors = True
+            questions.append((cells[0], [cells[1]] + wrong_answers))
     except Exception as e:
-        logger.error(f"Error in AI question extraction: {e}")
-        # Fall back to the original parser
-        return convert_format(content, file_type=file_type)
-    
-    return questions, has_errors
+        logger.error(f"Error parsing {file_type} file: {e}")
+        return questions, True
+    finally:
+        metrics.parse_seconds.labels(file_type).observe(time.perf_counter() - started)
+
+    questions, fix_errors = finalize_questions(questions)
+    return questions, has_errors or fix_errors
+
+
+def parse_upload(stream, file_type="docx"):
+    """
+    Parse an uploaded question file of any supported type
+    Blocking (decoding, python-docx, openpyxl, parsing): run it in a thread
+    pool, not on the event loop
+    Returns a tuple: (questions, has_errors)
+    """
+    if file_type in ("xlsx", "csv"):
+        # Spreadsheets are streamed row by row, one question per row
+        return parse_table(stream, file_type=file_type)
+    if file_type == "txt":
+        # Detect the encoding from a sample and decode in one call
+        doc = decode_stream(stream)
+    else:
+        # python-docx is imported on first use to keep startup fast
+        from docx import Document
+        doc = Document(stream)
+    # The best-scoring question format parses the document once
+    return parse_questions(doc, file_type=file_type)
+
 
 def calculate_points(correct, total, system=100):
     """
@@ -0,0 +1,258 @@
+"""
+Admin statistics report.
+
+Reports are built in the background and cached on disk, so pressing the
+stats button sends a ready file. The cache directory holds:
+
+- test_results.csv: test results are never changed once written, so each
+  refresh only appends the rows added since the last build,
+- users.csv: rewritten on every refresh (languages, names and the inactive
+  flag change in place); one query and the C csv writer,
+- stats.xlsx: the workbook admins receive, rebuilt from the two CSV files
+  with openpyxl's write-only mode,
+- manifest.json: version stamp, build time, counts and how far the CSV
+  files go (last test result id and file size, and the users change
+  counter that database triggers bump on every user insert, delete or
+  report-relevant update).
+
+ReportCache.run() refreshes the cache when REPORT_REFRESH_ROWS new rows
+exist, or every REPORT_REFRESH_INTERVAL seconds if anything changed. A
+refresh runs in a worker thread and holds a file lock, so shard workers can
+share one cache directory.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import REPORTS_DIR, REPORT_REFRESH_INTERVAL, REPORT_REFRESH_ROWS, REPORT_CHECK_INTERVAL
+from file_lock import exclusive_lock
+
+logger = logging.getLogger(__name__)
+
+USERS_HEADERS = ("Name", "Username", "ID", "Language", "Joined Date")
+RESULTS_HEADERS = ("User ID", "Test Name", "Date", "Correct", "Total", "Percent", "Points")
+
+# Types of the Test Results columns, restored when the workbook is built from CSV
+_RESULT_TYPES = (int, str, str, int, int, float, int)
+
+
+def user_row(user: Sequence) -> Tuple:
+    """Users sheet row for a get_report_users() row"""
+    user_id, username, first_name, last_name, language, join_date, _ = user
+    full_name = f"{first_name or ''} {last_name or ''}".strip() or "Unknown"
+    return (full_name, f"@{username or 'noname'}", str(user_id), language or "uz", join_date or "Unknown")
+
+
+def result_row(row: Sequence) -> Tuple:
+    """CSV values of a CSV test_results line, converted back to numbers"""
+    values = []
+    for convert, value in zip(_RESULT_TYPES, row):
+        try:
+            values.append(convert(value) if value != "" else None)
+        except ValueError:
+            values.append(value)
+    return tuple(values)
+
+
+def column_widths(headers: Sequence[str], rows: Iterable[Sequence]) -> List[int]:
+    """Width of each column: longest value + 2, like the old auto-fit"""
+    lengths = [len(header) for header in headers]
+    for row in rows:
+        for index, value in enumerate(row):
+            if value is not None:
+                length = len(str(value))
+                if length > lengths[index]:
+                    lengths[index] = length
+    return [length + 2 for length in lengths]
+
+
+def add_sheet(wb, title: str, headers: Sequence[str], rows: List[Sequence]) -> None:
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
+
+    ws = wb.create_sheet(title)
+    # In write-only mode column widths have to be set before the first row
+    for index, width in enumerate(column_widths(headers, rows), 1):
+        ws.column_dimensions[get_column_letter(index)].width = width
+
+    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.border = border
+        cell.alignment = Alignment(horizontal='center')
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in rows:
+        ws.append(row)
+
+
+def build_workbook(users: List[Sequence], results: List[Sequence]) -> bytes:
+    """xlsx file with a Users and a Test Results sheet"""
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    add_sheet(wb, "Users", USERS_HEADERS, users)
+    add_sheet(wb, "Test Results", RESULTS_HEADERS, results)
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+class ReportCache:
+    """Stats report files on disk, refreshed incrementally in the background"""
+    def __init__(self, directory: str = REPORTS_DIR, refresh_interval: float = REPORT_REFRESH_INTERVAL,
+                 refresh_rows: int = REPORT_REFRESH_ROWS, check_interval: float = REPORT_CHECK_INTERVAL):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.refresh_rows = refresh_rows
+        self.check_interval = check_interval
+        self.task: Optional[asyncio.Task] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @property
+    def workbook_path(self) -> str:
+        return self._path("stats.xlsx")
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """Manifest of the current build, None if there is none"""
+        try:
+            with open(self._path("manifest.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_atomic(self, name: str, data: bytes) -> None:
+        temp_path = f"{self._path(name)}.{os.getpid()}.temp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._path(name))
+
+    def pending_rows(self, manifest: Optional[Dict[str, Any]]) -> Optional[int]:
+        """New users and test results since the build; None if there is no build"""
+        from database import count_report_changes
+
+        if manifest is None:
+            return None
+        users_version, results = count_report_changes(manifest["results_last_id"])
+        # Manifests of older builds have no users_version: rebuild users.csv once
+        return users_version - manifest.get("users_version", -1) + results
+
+    def refresh(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Bring the cache up to date (blocking; run it in a worker thread)
+        Without force the build is skipped if no rows changed. Returns the manifest
+        """
+        from database import get_report_users, get_report_test_results_after, get_users_version
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Another thread or worker process may be refreshing
+        with exclusive_lock(self._path(".lock")):
+            started = time.perf_counter()
+            manifest = self.manifest()
+            if manifest is not None and not force and self.pending_rows(manifest) == 0:
+                return manifest
+            results_path = self._path("test_results.csv")
+            if manifest is None or not os.path.exists(results_path) or \
+                    os.path.getsize(results_path) < manifest["results_size"]:
+                # No build yet, or the CSV file is missing: start over
+                version = manifest["version"] if manifest else 0
+                manifest = {"version": version, "results_last_id": 0, "results_size": 0, "tests_count": 0}
+
+            # Append new test results. Cut the file back to the size recorded in the
+            # manifest first, in case a refresh died after appending
+            new_results = get_report_test_results_after(manifest["results_last_id"])
+            if os.path.exists(results_path):
+                os.truncate(results_path, manifest["results_size"])
+            # utf-8-sig writes the BOM (for Excel) only at the start of an empty file
+            with open(results_path, 'a', encoding='utf-8-sig', newline='') as f:
+                writer = csv.writer(f)
+                if manifest["results_size"] == 0:
+                    writer.writerow(RESULTS_HEADERS)
+                writer.writerows(row[1:] for row in new_results)
+            if new_results:
+                manifest["results_last_id"] = new_results[-1][0]
+            manifest["results_size"] = os.path.getsize(results_path)
+            manifest["tests_count"] += len(new_results)
+
+            # Read the counter first: changes made while reading count for the next refresh
+            users_version = get_users_version()
+            users = get_report_users()
+            user_rows = [user_row(user) for user in users]
+            users_csv = io.StringIO(newline='')
+            writer = csv.writer(users_csv)
+            writer.writerow(USERS_HEADERS)
+            writer.writerows(user_rows)
+            self._write_atomic("users.csv", users_csv.getvalue().encode('utf-8-sig'))
+
+            # Newest results first, as in the old report
+            with open(results_path, encoding='utf-8-sig', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                results = [result_row(row) for row in reader]
+            results.reverse()
+            self._write_atomic("stats.xlsx", build_workbook(user_rows, results))
+
+            manifest.update(
+                version=manifest["version"] + 1,
+                built_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+                users_total=len(users),
+                users_version=users_version,
+                users_count=sum(1 for user in users if not user[6]),
+                appended=len(new_results),
+            )
+            self._write_atomic("manifest.json", json.dumps(manifest).encode('utf-8'))
+            logger.info(f"Stats report v{manifest['version']} built in {time.perf_counter() - started:.2f}s "
+                        f"({len(new_results)} new test results, {len(users)} users)")
+            return manifest
+
+    async def get(self, executor=None) -> Dict[str, Any]:
+        """Manifest of a ready report; builds one first if there is none yet"""
+        manifest = self.manifest()
+        if manifest is None or not os.path.exists(self.workbook_path):
+            manifest = await asyncio.get_running_loop().run_in_executor(executor, self.refresh, True)
+        return manifest
+
+    async def run(self, executor=None) -> None:
+        """Refresh when enough rows are new, or periodically when anything changed"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                manifest = self.manifest()
+                pending = await loop.run_in_executor(executor, self.pending_rows, manifest)
+                age = time.time() - os.path.getmtime(self._path("manifest.json")) if manifest else None
+                if pending is None or pending >= self.refresh_rows or (pending and age >= self.refresh_interval):
+                    await loop.run_in_executor(executor, self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error refreshing stats report: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    def start(self, executor=None) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run(executor))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,48 @@
+"""
+Block the event loop on purpose and print what the loop monitor recorded.
+
+Three blocking calls (0.3 s, 0.02 s and 0.5 s) run between short sleeps
+with a 0.1 s threshold: the two long ones should show up in
+event_loop_blocked_seconds under scripts/bench_loop_monitor.py:blocking_io,
+the short one only in the lag histogram.
+
+Usage:
+    python scripts/bench_loop_monitor.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import metrics  # noqa: E402
+from loop_monitor import LoopMonitor  # noqa: E402
+
+
+def blocking_io(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+async def run() -> None:
+    monitor = LoopMonitor(interval=0.05, threshold=0.1)
+    monitor.start()
+    for seconds in (0.3, 0.02, 0.5):
+        await asyncio.sleep(0.2)
+        blocking_io(seconds)
+    await asyncio.sleep(0.2)
+    await monitor.stop()
+    print(metrics.summary())
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
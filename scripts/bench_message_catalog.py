@@ -0,0 +1,79 @@
+"""
+Reply keyboard timing: built per call (as handlers used to) against the
+shared keyboards of message_catalog.
+
+Usage:
+    python scripts/bench_message_catalog.py [--rounds N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import types  # noqa: E402
+
+from localization import get_text  # noqa: E402
+from message_catalog import WEB_APP_BUTTON, catalog  # noqa: E402
+
+
+def build_main_menu(lang="ru"):
+    return types.ReplyKeyboardMarkup(
+        keyboard=[
+            [types.KeyboardButton(text=get_text(lang, "btn_create_quiz")),
+             types.KeyboardButton(text=get_text(lang, "btn_my_tests"))],
+            [types.KeyboardButton(text=get_text(lang, "btn_results")),
+             types.KeyboardButton(text=get_text(lang, "btn_guide"))],
+            [types.KeyboardButton(text=get_text(lang, "btn_feedback")),
+             types.KeyboardButton(text=get_text(lang, "btn_invite"))],
+            [types.KeyboardButton(text=WEB_APP_BUTTON)],
+        ],
+        resize_keyboard=True,
+        input_field_placeholder=get_text(lang, "menu_placeholder")
+    )
+
+
+def build_order(lang="ru"):
+    return types.ReplyKeyboardMarkup(
+        keyboard=[
+            [types.KeyboardButton(text=get_text(lang, "btn_shuffle_questions"))],
+            [types.KeyboardButton(text=get_text(lang, "btn_sequential_questions"))],
+            [types.KeyboardButton(text=get_text(lang, "btn_main_menu"))],
+        ],
+        resize_keyboard=True
+    )
+
+
+def build_finished(lang="ru"):
+    return types.ReplyKeyboardMarkup(
+        keyboard=[[types.KeyboardButton(text=get_text(lang, "btn_main_menu"))]],
+        resize_keyboard=True,
+        input_field_placeholder=get_text(lang, "quiz_finish_placeholder")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    def timed(func) -> float:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            func()
+        return (time.perf_counter() - start) / args.rounds * 1e6
+
+    cases = [
+        ("show_main_menu keyboard", build_main_menu, lambda: catalog.keyboard("ru", "main_menu")),
+        ("handle_range keyboard", build_order, lambda: catalog.keyboard("ru", "question_order")),
+        ("finish_quiz keyboard", build_finished, lambda: catalog.keyboard("ru", "quiz_finished")),
+    ]
+    print(f"{'handler step':<28} {'per call':>10} {'catalog':>10} {'speedup':>8}")
+    for name, before, after in cases:
+        before_us, after_us = timed(before), timed(after)
+        print(f"{name:<28} {before_us:7.2f} us {after_us:7.2f} us {before_us / after_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
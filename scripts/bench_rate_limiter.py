@@ -0,0 +1,98 @@
+"""
+Throughput and memory of the RateLimiter backends.
+
+Runs the middleware over synthetic updates with the in-process backend (active
+users, then every update from a new user to exercise eviction), measures the
+memory per tracked user, times the SQLite backend and checks that four
+processes sharing one SQLite file cannot exceed a user's limit together.
+
+Usage:
+    python scripts/bench_rate_limiter.py [--updates N] [--users N] [--rate N]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram.types import User  # noqa: E402
+
+from middleware import MemoryRateLimitBackend, RateLimiter, SQLiteRateLimitBackend  # noqa: E402
+
+
+def _take_many(path: str, user_id: int, count: int) -> int:
+    """Requests of one user allowed by a backend of its own (run in a pool process)"""
+    backend = SQLiteRateLimitBackend(path)
+    try:
+        return sum(backend.take(user_id, 30, 0.5) for _ in range(count))
+    finally:
+        backend.close()
+
+
+def run(updates: int, users: int, rate: int) -> None:
+    """Print throughput and memory; `rate` is the target load in updates/s"""
+    async def handler(event, data):
+        return None
+    
+    async def feed(limiter: RateLimiter, user_ids) -> float:
+        event = object()
+        data = [{"event_from_user": User(id=user_id, is_bot=False, first_name="User")} for user_id in user_ids]
+        start = time.perf_counter()
+        for event_data in data:
+            await limiter(handler, event, event_data)
+        return time.perf_counter() - start
+    
+    def report(name: str, limiter: RateLimiter, count: int, elapsed: float) -> None:
+        print(f"{name}: {count / elapsed:,.0f} updates/s ({elapsed / count * 1e6:.2f} us each, "
+              f"{rate * elapsed / count:.1%} of a core at {rate} updates/s), "
+              f"{len(limiter.backend)} buckets, {limiter.limited} limited")
+    
+    # Active users sending repeatedly; a few of them flood
+    user_ids = [random.randrange(users) if random.random() < 0.9 else random.randrange(10) for _ in range(updates)]
+    limiter = RateLimiter(backend=MemoryRateLimitBackend(60, max_users=users))
+    report(f"memory, {users} active users", limiter, updates, asyncio.run(feed(limiter, user_ids)))
+    
+    # Every update from a new user: eviction keeps memory bounded
+    limiter = RateLimiter(backend=MemoryRateLimitBackend(60, max_users=users))
+    report(f"memory, {updates} distinct users (cap {users})", limiter, updates,
+           asyncio.run(feed(limiter, range(10 ** 9, 10 ** 9 + updates))))
+    
+    backend = MemoryRateLimitBackend(60, max_users=users)
+    tracemalloc.start()
+    for user_id in range(users):
+        backend.take(user_id, 30, 0.5)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"memory: {current / users:.0f} bytes per tracked user ({current / 2 ** 20:.1f} MiB for {users})")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "rate_limits.db")
+        limiter = RateLimiter(backend=SQLiteRateLimitBackend(path))
+        count = updates // 4
+        report(f"sqlite, {users} active users", limiter, count, asyncio.run(feed(limiter, user_ids[:count])))
+        limiter.backend.close()
+        
+        # Four processes take from one user's bucket (capacity 30): the limit holds across them
+        with multiprocessing.get_context("spawn").Pool(4) as pool:
+            allowed = sum(pool.starmap(_take_many, [(path, 42, 100)] * 4))
+        print(f"sqlite, 4 processes x 100 requests of one user: {allowed} allowed (capacity 30 + refill)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--rate", type=int, default=10000, help="Target load in updates/s")
+    args = parser.parse_args()
+    run(args.updates, args.users, args.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Encoding detection check and decode timing for .txt uploads.
+
+Files in the corpus are named <encoding>.<description>.txt, e.g.
+cp1251.ru.txt. Each file is repeated up to --size bytes to time realistic
+uploads, and compared with the old approach (decode as UTF-8, then again as
+latin-1, which is fast but mangles cp1251) and with a single decode in the
+known encoding (the lower bound).
+
+Usage:
+    python scripts/bench_text_encoding.py [corpus_dir] [--rounds N] [--size BYTES]
+
+Exits with status 1 if any file is misdetected.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from text_encoding import _BOMS, SAMPLE_SIZE, decode_stream, detect_encoding  # noqa: E402
+
+
+def run(corpus_dir: str, rounds: int, size: int) -> int:
+    """Print detection results and timings; returns the number of misdetected files"""
+    failures = 0
+    print(f"{'file':<28} {'expected':<10} {'detected':<10} {'detect+decode':>14} {'naive':>12} {'one call':>12}")
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith(".txt"):
+            continue
+        expected = name.split(".")[0]
+        with open(os.path.join(corpus_dir, name), "rb") as f:
+            data = f.read()
+        bom = next((bom for bom, _ in _BOMS if data.startswith(bom)), b"")
+        body = data[len(bom):]
+        data = bom + body * max(1, size // len(body))
+
+        detected = detect_encoding(data[:SAMPLE_SIZE])
+        start = time.perf_counter()
+        for _ in range(rounds):
+            decode_stream(io.BytesIO(data))
+        detect_us = (time.perf_counter() - start) / rounds * 1e6
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            try:
+                data.decode("utf-8")
+            except UnicodeDecodeError:
+                data.decode("latin-1")
+        naive_us = (time.perf_counter() - start) / rounds * 1e6
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            data.decode(expected)
+        floor_us = (time.perf_counter() - start) / rounds * 1e6
+
+        mark = "" if detected == expected else "  <-- MISMATCH"
+        failures += detected != expected
+        print(f"{name:<28} {expected:<10} {detected:<10} {detect_us / 1000:11.2f} ms {naive_us / 1000:9.2f} ms {floor_us / 1000:9.2f} ms{mark}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", default=os.path.join(ROOT, "examples", "encodings"))
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="Bytes each file is repeated up to")
+    args = parser.parse_args()
+    sys.exit(1 if run(args.corpus, args.rounds, args.size) else 0)
+
+
+if __name__ == "__main__":
+    main()
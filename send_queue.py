@@ -0,0 +1,254 @@
+"""
+Outbound Telegram send scheduler.
+
+Every Bot API request goes through the bot session's request middleware, so
+registering OutboundScheduler there puts all bot.send_* / message.answer
+calls behind one set of limits:
+
+- a global token bucket (Telegram allows about 30 messages per second),
+- a token bucket per chat (about 1 message per second in private chats with
+  short bursts, 20 per minute in groups); quiz polls and message edits in
+  private chats only count against the global bucket, so a quiz's next poll
+  is not held back behind the answer feedback,
+- a 429 response pauses that chat for retry_after seconds and the request is
+  retried; the global bucket is paused only when several different chats
+  get a 429 within a few seconds (the limit then applies to the whole bot),
+- interactive traffic is granted global tokens before bulk traffic; code that
+  sends in bulk (broadcasts) wraps itself in `with bulk_sends():`.
+
+Requests without a chat_id (getUpdates, answerCallbackQuery, ...) are not limited.
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE, SEND_MAX_RETRIES
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Methods that skip the per-chat bucket in private chats
+CHAT_LIMIT_EXEMPT = frozenset(("SendPoll", "StopPoll", "EditMessageText", "EditMessageReplyMarkup",
+                               "DeleteMessage"))
+
+# 429s from this many different chats within GLOBAL_FLOOD_WINDOW seconds pause all sends
+GLOBAL_FLOOD_CHATS = 3
+GLOBAL_FLOOD_WINDOW = 5.0
+
+# Priority of sends made by the current task
+send_priority: contextvars.ContextVar = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def bulk_sends():
+    """Mark sends made inside the block (and tasks started from it) as bulk traffic"""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations
+    reserve() takes a token even if it is not there yet and returns how long
+    the caller has to wait for it, so concurrent callers queue up fairly
+    without a lock (the event loop is single threaded).
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def reserve(self, now: Optional[float] = None) -> float:
+        """Take a token; returns the seconds to wait before using it"""
+        wait = self.delay(now)
+        self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """No tokens for the given time (after a 429 response)"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Bot session middleware enforcing send limits and priorities"""
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, group_rate: float = SEND_GROUP_RATE,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.queues: Dict[str, Deque[asyncio.Future]] = {INTERACTIVE: deque(), BULK: deque()}
+        self.waiting_for_chat = 0
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.last_sweep = time.monotonic()
+        self.sent = {INTERACTIVE: 0, BULK: 0}
+        self.flood_waits = 0
+        self.global_pauses = 0
+        # Recent 429s: chat id -> time, to tell a bot-wide flood from a busy chat
+        self.recent_floods: Dict[int, float] = {}
+        self.wait_time = {
+            INTERACTIVE: Histogram("send_queue_wait_seconds_interactive", "Wait before an interactive send"),
+            BULK: Histogram("send_queue_wait_seconds_bulk", "Wait before a bulk send"),
+        }
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                # Groups and channels: about 20 messages per minute, no bursts
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _sweep(self, now: float) -> None:
+        """Forget buckets of chats that have been idle long enough to be full again"""
+        idle = [chat_id for chat_id, bucket in self.chat_buckets.items() if bucket.idle(now)]
+        for chat_id in idle:
+            del self.chat_buckets[chat_id]
+        self.last_sweep = now
+
+    async def _grant_loop(self) -> None:
+        """Hand out global tokens, interactive requests first"""
+        while True:
+            queue = self.queues[INTERACTIVE] or self.queues[BULK]
+            if not queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            delay = self.global_bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            future = queue.popleft()
+            if future.done():
+                continue  # The sender was cancelled
+            self.global_bucket.take()
+            future.set_result(None)
+
+    async def _acquire(self, chat_id: int, priority: str, chat_limited: bool = True) -> None:
+        now = time.monotonic()
+        if now - self.last_sweep > 60:
+            self._sweep(now)
+
+        # Per-chat limit first, so one busy chat does not hold global tokens
+        wait = self._chat_bucket(chat_id).reserve(now) if chat_limited else 0
+        if wait > 0:
+            self.waiting_for_chat += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting_for_chat -= 1
+
+        if not self.queues[INTERACTIVE] and not self.queues[BULK] and self.global_bucket.delay() == 0:
+            # Nobody is waiting: no need to go through the grant loop
+            self.global_bucket.take()
+            self.wait_time[priority].observe(time.monotonic() - now)
+            return
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._grant_loop())
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].append(future)
+        self.wakeup.set()
+        await future
+        self.wait_time[priority].observe(time.monotonic() - now)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            # Not a send to a chat (or a @channel username): no limit
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        chat_limited = chat_id < 0 or type(method).__name__ not in CHAT_LIMIT_EXEMPT
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, priority, chat_limited)
+            try:
+                response = await make_request(bot, method)
+                self.sent[priority] += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                attempt += 1
+                logger.warning(f"Flood wait {e.retry_after}s for chat {chat_id} ({priority}, attempt {attempt})")
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                if self._bot_wide_flood(chat_id):
+                    self.global_pauses += 1
+                    logger.warning(f"Flood waits in {GLOBAL_FLOOD_CHATS}+ chats, pausing all sends for {e.retry_after}s")
+                    self.global_bucket.pause(e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                if not chat_limited:
+                    # The exempt request skips the chat bucket, so wait here
+                    await asyncio.sleep(e.retry_after)
+
+    def _bot_wide_flood(self, chat_id: int) -> bool:
+        """Record a 429 for the chat; True if enough different chats got one recently"""
+        now = time.monotonic()
+        self.recent_floods[chat_id] = now
+        for flooded_chat in [chat for chat, at in self.recent_floods.items() if now - at > GLOBAL_FLOOD_WINDOW]:
+            del self.recent_floods[flooded_chat]
+        if len(self.recent_floods) >= GLOBAL_FLOOD_CHATS:
+            self.recent_floods.clear()
+            return True
+        return False
+
+    def set_global_rate(self, rate: float) -> None:
+        """Change the global limit (shard workers share it between processes)"""
+        self.global_bucket = TokenBucket(rate, rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue depth and wait-time metrics"""
+        return {
+            "queued_interactive": len(self.queues[INTERACTIVE]),
+            "queued_bulk": len(self.queues[BULK]),
+            "waiting_for_chat": self.waiting_for_chat,
+            "tracked_chats": len(self.chat_buckets),
+            "sent": dict(self.sent),
+            "flood_waits": self.flood_waits,
+            "global_pauses": self.global_pauses,
+            "wait_p95_interactive": self.wait_time[INTERACTIVE].quantile(0.95),
+            "wait_p95_bulk": self.wait_time[BULK].quantile(0.95),
+        }
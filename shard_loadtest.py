@@ -0,0 +1,110 @@
+"""
+Load test for sharded update processing (see sharding.py).
+
+Routes synthetic message updates from many users through ShardedRunner to
+1..N worker processes. Each update carries a small quiz text that the worker
+parses with quiz_utils, which stands in for the CPU work of real handlers.
+No Telegram API calls are made. Workers check that every user's updates
+arrive in order.
+
+    python shard_loadtest.py --updates 20000 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from sharding import ShardedRunner
+
+SAMPLE_QUIZ = "\n".join(
+    f"{n}. Sample question number {n}?\n"
+    f"A) First answer {n}\nB) Second answer {n}\nC) Third answer {n}\nD) Fourth answer {n}"
+    for n in range(1, 13)
+)
+
+
+async def setup_loadtest_worker(shard_index, shards):
+    """Dispatcher whose message handler parses a quiz and checks per-user ordering"""
+    from aiogram import Bot, Dispatcher, types
+    from quiz_utils import parse_questions
+
+    dispatcher = Dispatcher()
+    last_seen = {}
+    stats = {"processed": 0, "out_of_order": 0}
+
+    @dispatcher.message()
+    async def handle(message: types.Message):
+        sequence = message.message_id
+        if sequence <= last_seen.get(message.from_user.id, 0):
+            stats["out_of_order"] += 1
+        last_seen[message.from_user.id] = sequence
+        parse_questions(message.text, "txt")
+        stats["processed"] += 1
+        # Yield like a handler waiting on the API would
+        await asyncio.sleep(0)
+
+    global _stats
+    _stats = (shard_index, stats)
+    # A syntactically valid token; nothing is sent to Telegram
+    return dispatcher, Bot(token="123456:loadtest")
+
+
+async def teardown_worker():
+    shard_index, stats = _stats
+    print(f"  worker {shard_index}: {stats['processed']} updates, {stats['out_of_order']} out of order", flush=True)
+
+
+def make_updates(count: int, users: int):
+    sequences = {}
+    for update_id in range(count):
+        user_id = 1000 + update_id % users
+        sequences[user_id] = sequences.get(user_id, 0) + 1
+        user = {"id": user_id, "is_bot": False, "first_name": "User"}
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": sequences[user_id],
+                "from": user,
+                "chat": {"id": user_id, "type": "private", "first_name": "User"},
+                "date": 1700000000,
+                "text": SAMPLE_QUIZ,
+            },
+        }
+
+
+def run(workers: int, count: int, users: int) -> float:
+    """Process `count` updates with `workers` processes; returns updates per second"""
+    runner = ShardedRunner(workers, "shard_loadtest:setup_loadtest_worker")
+    runner.start()
+    runner.wait_ready(timeout=60)
+    updates = list(make_updates(count, users))
+    start = time.perf_counter()
+    for update in updates:
+        runner.route(update)
+    # stop() waits until the workers have processed everything queued
+    runner.stop(timeout=600)
+    elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure throughput of sharded update processing")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{args.updates} updates from {args.users} users, {os.cpu_count()} CPUs")
+    for workers in args.workers:
+        print(f"{workers} worker(s):")
+        rate = run(workers, args.updates, args.users)
+        baseline = baseline or rate
+        print(f"  {rate:8.0f} updates/s  speedup {rate / baseline:4.2f}x  efficiency {rate / baseline / workers:4.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
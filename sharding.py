@@ -0,0 +1,296 @@
+"""
+Sharded update processing (experimental, off unless EXPERIMENTAL_SHARDING is set).
+
+One front process receives updates (long polling or webhook) and hands each
+one to a worker process chosen by hashing the user id. Every worker runs the
+dispatcher on its own event loop, so parsing, report generation and logging
+use as many cores as there are workers. All updates of a user go to the same
+worker and are processed there one after another, which preserves per-user
+ordering (and keeps that user's FSM state in a single process); different
+users are processed concurrently.
+
+Workers are created by a setup function given as "module:function". It is
+awaited in the worker with (shard_index, shards) and returns (dispatcher, bot);
+an optional teardown is looked up as the same module's `teardown_worker`.
+"""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Update fields that carry the user who caused the update
+_USER_FIELDS = (
+    ("message", "from"), ("edited_message", "from"), ("callback_query", "from"),
+    ("inline_query", "from"), ("chosen_inline_result", "from"), ("shipping_query", "from"),
+    ("pre_checkout_query", "from"), ("poll_answer", "user"), ("my_chat_member", "from"),
+    ("chat_member", "from"), ("chat_join_request", "from"),
+)
+
+# Update types the bot handles; the front does not import the dispatcher to resolve them
+ALLOWED_UPDATES = ["message", "edited_message", "callback_query", "poll_answer", "my_chat_member"]
+
+# Sent through a worker queue to stop it
+_STOP = None
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """Worker index for a user; stable across restarts and processes"""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """User id of a raw update, or the chat id for updates without a user"""
+    for field, user_key in _USER_FIELDS:
+        event = update.get(field)
+        if event is not None:
+            user = event.get(user_key)
+            if user is not None:
+                return user["id"]
+    for field in ("channel_post", "edited_channel_post"):
+        event = update.get(field)
+        if event is not None:
+            return event["chat"]["id"]
+    return None
+
+
+class KeySerializer:
+    """
+    Run coroutines concurrently across keys but strictly in order per key
+    Each key keeps only a reference to its last task; the chain is dropped
+    when it completes, so idle users cost nothing.
+    """
+    def __init__(self):
+        self.tails: Dict[Any, asyncio.Task] = {}
+
+    def submit(self, key: Any, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        previous = self.tails.get(key)
+
+        async def run():
+            if previous is not None:
+                try:
+                    await previous
+                except Exception:
+                    pass  # Already logged by the previous task
+            try:
+                return await factory()
+            finally:
+                if self.tails.get(key) is current:
+                    del self.tails[key]
+
+        current = asyncio.get_running_loop().create_task(run())
+        self.tails[key] = current
+        return current
+
+    async def drain(self) -> None:
+        while self.tails:
+            await asyncio.gather(*list(self.tails.values()), return_exceptions=True)
+
+
+def _load_setup(path: str) -> Tuple[Callable, Optional[Callable]]:
+    module_name, _, function_name = path.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name), getattr(module, "teardown_worker", None)
+
+
+async def _worker_loop(index: int, shards: int, updates: "multiprocessing.Queue",
+                       ready: "multiprocessing.Queue", setup_path: str) -> None:
+    setup, teardown = _load_setup(setup_path)
+    dispatcher, bot = await setup(index, shards)
+    ready.put(index)
+    loop = asyncio.get_running_loop()
+    serializer = KeySerializer()
+    processed = 0
+
+    async def process(update: Dict[str, Any]) -> None:
+        try:
+            await dispatcher.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Worker {index}: error processing update {update.get('update_id')}: {e}")
+
+    logger.info(f"Worker {index}/{shards} started (pid {os.getpid()})")
+    try:
+        while True:
+            # Block in a thread, then drain whatever else is already queued
+            batch = [await loop.run_in_executor(None, updates.get)]
+            try:
+                while len(batch) < 256:
+                    batch.append(updates.get_nowait())
+            except queue.Empty:
+                pass
+            for update in batch:
+                if update is _STOP:
+                    return
+                serializer.submit(update_user_id(update), lambda update=update: process(update))
+                processed += 1
+    finally:
+        await serializer.drain()
+        logger.info(f"Worker {index} stopping after {processed} updates")
+        if teardown is not None:
+            await teardown()
+
+
+def _worker_main(index: int, shards: int, updates: "multiprocessing.Queue",
+                 ready: "multiprocessing.Queue", setup_path: str) -> None:
+    # The front process stops the workers through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, shards, updates, ready, setup_path))
+
+
+class ShardedRunner:
+    """Front side: start the workers and route raw updates to them"""
+    def __init__(self, shards: int, setup_path: str, queue_size: int = 10000):
+        self.shards = shards
+        self.setup_path = setup_path
+        context = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [context.Queue(queue_size) for _ in range(shards)]
+        self.ready = context.Queue()
+        self.workers = [
+            context.Process(target=_worker_main, args=(index, shards, self.queues[index], self.ready, setup_path),
+                            name=f"shard-{index}", daemon=True)
+            for index in range(shards)
+        ]
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """Block until every worker has finished its setup"""
+        for _ in range(self.shards):
+            self.ready.get(timeout=timeout)
+
+    def _queue_for(self, update: Dict[str, Any]) -> "multiprocessing.Queue":
+        user_id = update_user_id(update)
+        return self.queues[shard_for(user_id, self.shards) if user_id is not None else 0]
+
+    def route(self, update: Dict[str, Any]) -> None:
+        """Hand a raw update to the worker owning its user (blocks if that worker is backlogged)"""
+        self._queue_for(update).put(update)
+
+    def try_route(self, update: Dict[str, Any]) -> bool:
+        """Like route(), but returns False instead of blocking"""
+        try:
+            self._queue_for(update).put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    async def route_async(self, update: Dict[str, Any]) -> None:
+        """route() for the event loop: only a backlogged worker costs a thread hop"""
+        if not self.try_route(update):
+            await asyncio.get_running_loop().run_in_executor(None, self.route, update)
+
+    def stop(self, timeout: float = 30) -> None:
+        """Let the workers finish queued updates, then stop them"""
+        for updates in self.queues:
+            updates.put(_STOP)
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.warning(f"Worker {worker.name} did not stop in time, terminating")
+                worker.terminate()
+
+
+async def poll_updates(bot, runner: ShardedRunner, allowed_updates: Optional[List[str]] = None,
+                       stop: Optional[asyncio.Event] = None) -> None:
+    """Front process loop: long poll Telegram and route raw updates to the workers"""
+    offset = None
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Error getting updates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            # Routed one at a time, so updates of a user reach their worker in order
+            await runner.route_async(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+def build_front_app(runner: ShardedRunner, path: str, secret: str = ""):
+    """aiohttp app of a webhook front: check the secret token, queue the update, acknowledge"""
+    from aiohttp import web
+
+    if not secret:
+        raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode")
+
+    async def handle(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+            return web.Response(body="Unauthorized", status=401)
+        await runner.route_async(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def run_front(shards: int, setup_path: str = "main:setup_worker") -> None:
+    """Receive updates in this process and process them in `shards` workers"""
+    from aiogram import Bot
+    from config import (TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST,
+                        WEBHOOK_PORT, DROP_PENDING_UPDATES)
+    from database import init_db, enable_wal
+
+    # Workers share the database file
+    init_db()
+    enable_wal()
+
+    runner = ShardedRunner(shards, setup_path)
+    runner.start()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, runner.wait_ready)
+    bot = Bot(token=TOKEN)
+    stop = asyncio.Event()
+    if os.name != 'nt':
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"Front process started with {shards} workers ({BOT_MODE})")
+    try:
+        if BOT_MODE == "webhook":
+            from aiohttp import web
+
+            app_runner = web.AppRunner(build_front_app(runner, WEBHOOK_PATH, WEBHOOK_SECRET))
+            await app_runner.setup()
+            await web.TCPSite(app_runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            if WEBHOOK_URL:
+                await bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                                      secret_token=WEBHOOK_SECRET, allowed_updates=ALLOWED_UPDATES,
+                                      drop_pending_updates=False)
+            try:
+                await stop.wait()
+            finally:
+                await app_runner.cleanup()
+        else:
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+            poller = asyncio.create_task(poll_updates(bot, runner, ALLOWED_UPDATES, stop))
+            await stop.wait()
+            poller.cancel()
+    finally:
+        await bot.session.close()
+        logger.info("Stopping workers...")
+        await loop.run_in_executor(None, runner.stop)
+
+
+if __name__ == "__main__":
+    from config import EXPERIMENTAL_SHARDING, WORKER_PROCESSES, get_log_level, LOG_FORMAT, LOG_LEVEL
+
+    if not EXPERIMENTAL_SHARDING:
+        raise SystemExit("Sharded processing is experimental; set EXPERIMENTAL_SHARDING=1 to run it "
+                         "(python main.py runs the bot in one process)")
+    logging.basicConfig(level=get_log_level(LOG_LEVEL), format=LOG_FORMAT)
+    asyncio.run(run_front(max(1, WORKER_PROCESSES)))
@@ -0,0 +1,108 @@
+"""
+Startup import cost report and budget check.
+
+Runs ``python -X importtime`` in a fresh interpreter for the given entry
+module and reports the cumulative import time of each top-level package.
+
+Usage:
+    python startup_profile.py [module] [--budget-ms N] [--top N]
+
+Exits with status 1 if the total import time exceeds the budget, so it can
+be used as a startup-time check in CI or before deploying.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Default startup budget in milliseconds (can be overridden via environment)
+DEFAULT_BUDGET_MS = int(os.environ.get("STARTUP_BUDGET_MS", "3000"))
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module="main"):
+    """
+    Import a module in a clean interpreter with -X importtime
+    Returns a list of (module_name, self_us, cumulative_us, depth) tuples
+    """
+    env = dict(os.environ)
+    env.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # importtime indents nested imports by two spaces per level
+            depth = (len(indent) - 1) // 2
+            entries.append((name, int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def summarize(entries, module="main"):
+    """
+    Aggregate import cost per top-level package
+    A package is charged the cumulative time of the imports that first enter it
+    from another package, so nested imports are not counted twice.
+    Returns a list of (package, cumulative_ms) sorted by cost, and the total in ms
+    """
+    per_package = {}
+    total_us = 0
+    ancestors = []
+    # importtime prints children before their parent, so walk it backwards
+    for name, _self_us, cumulative_us, depth in reversed(entries):
+        del ancestors[depth:]
+        ancestors.append(name)
+        package = name.split(".")[0]
+        if depth == 0:
+            if name == module:
+                total_us += cumulative_us
+            continue
+        if ancestors[0] != module:
+            # Interpreter startup (site, encodings) is not part of our budget
+            continue
+        parent_package = ancestors[depth - 1].split(".")[0]
+        if parent_package != package:
+            per_package[package] = per_package.get(package, 0) + cumulative_us
+
+    report = sorted(
+        ((package, us / 1000) for package, us in per_package.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    return report, total_us / 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report import cost at startup")
+    parser.add_argument("module", nargs="?", default="main", help="Entry module to import")
+    parser.add_argument("--budget-ms", type=int, default=DEFAULT_BUDGET_MS, help="Fail if total import time exceeds this")
+    parser.add_argument("--top", type=int, default=20, help="Number of packages to show")
+    args = parser.parse_args(argv)
+
+    report, total_ms = summarize(measure_imports(args.module), args.module)
+
+    print(f"Import cost for '{args.module}' (cumulative, top-level packages):")
+    for package, ms in report[:args.top]:
+        print(f"  {package:<30} {ms:9.1f} ms")
+    print(f"  {'TOTAL':<30} {total_ms:9.1f} ms (budget {args.budget_ms} ms)")
+
+    if total_ms > args.budget_ms:
+        print(f"Startup budget exceeded by {total_ms - args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
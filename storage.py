@@ -3,8 +3,12 @@ import os
 import logging
 import threading
 import time
+import uuid
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Union
+
+import metrics
+from file_lock import exclusive_lock
 
 class TestStorage:
     """
@@ -12,10 +16,11 @@ class TestStorage:
     """
     def __init__(self, storage_path: str = "user_tests.json"):
         self.storage_path = storage_path
+        self.owns = None  # Set by shard workers: predicate on user id (str)
         self.tests = self._load_tests()
         self.lock = threading.RLock()  # For thread safety
         self.last_save_time = time.time()
-        self.dirty = False  # Flag to track if changes need to be saved
+        self.dirty = self._migrate_tests()  # Flag to track if changes need to be saved
         
         # Start a background thread to periodically save changes
         self.save_thread = threading.Thread(target=self._auto_save, daemon=True)
@@ -53,8 +58,33 @@ class TestStorage:
                 logging.error(f"Error loading tests: {e}")
         return {}
     
+    def _migrate_tests(self) -> bool:
+        """
+        Upgrade tests saved by older versions: give them a stable id and version,
+        and normalize their questions into sendable poll payloads
+        Returns True if anything changed
+        """
+        from quiz_utils import prepare_questions
+        
+        changed = False
+        for user_tests in self.tests.values():
+            for test in user_tests:
+                if "id" not in test:
+                    test["id"] = uuid.uuid4().hex
+                    changed = True
+                if "version" not in test:
+                    test["version"] = 1
+                    changed = True
+                if not test.get("prepared"):
+                    questions, _ = prepare_questions((q["question"], q["options"]) for q in test["questions"])
+                    test["questions"] = [{"question": question, "options": options} for question, options in questions]
+                    test["prepared"] = True
+                    changed = True
+        return changed
+    
     def _save_tests(self) -> None:
         """Save tests to file with backup creation"""
+        started = time.perf_counter()
         try:
             # Create a backup of the current file if it exists
             if os.path.exists(self.storage_path):
@@ -67,25 +97,47 @@ class TestStorage:
                 except Exception as backup_error:
                     logging.error(f"Error creating backup: {backup_error}")
             
-            # Write to a temporary file first, then rename for atomic operation
-            temp_path = f"{self.storage_path}.temp"
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(self.tests, f, ensure_ascii=False, indent=2)
-            
-            # Rename the temp file to the actual file (atomic operation)
-            os.replace(temp_path, self.storage_path)
+            if self.owns is None:
+                self._write_file(self.tests)
+            else:
+                # Several worker processes share the file: merge under a lock,
+                # taking other users' tests from disk and ours from memory
+                with exclusive_lock(f"{self.storage_path}.lock"):
+                    on_disk = self._load_tests()
+                    merged = {user_id: tests for user_id, tests in on_disk.items() if not self.owns(user_id)}
+                    merged.update((user_id, tests) for user_id, tests in self.tests.items() if self.owns(user_id))
+                    self._write_file(merged)
             self.last_save_time = time.time()
             self.dirty = False
+            metrics.storage_flush_seconds.observe(time.perf_counter() - started)
             logging.info("Tests saved successfully")
         except Exception as e:
             logging.error(f"Error saving tests: {e}")
     
-    def add_test(self, user_id: int, test_name: str, questions: List[Tuple[str, List[str]]]) -> None:
+    def _write_file(self, tests: Dict[str, List[Dict[str, Any]]]) -> None:
+        # Write to a temporary file first, then rename for atomic operation
+        temp_path = f"{self.storage_path}.{os.getpid()}.temp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(tests, f, ensure_ascii=False, indent=2)
+        
+        # Rename the temp file to the actual file (atomic operation)
+        os.replace(temp_path, self.storage_path)
+    
+    def set_owner(self, owns) -> None:
+        """
+        Restrict saving to the users a shard worker owns (predicate on the user id string)
+        Tests of other users are left as they are on disk
+        """
+        with self.lock:
+            self.owns = owns
+    
+    def add_test(self, user_id: int, test_name: str, questions: List[Tuple[str, List[str]]]) -> str:
         """
         Add a new test for a user
         user_id: Telegram user ID
         test_name: Name of the test
-        questions: List of (question, [answers]) tuples
+        questions: List of (question, [answers]) tuples, already normalized by quiz_utils.prepare_questions
+        Returns the test id
         """
         with self.lock:  # Thread safety
             user_id_str = str(user_id)
@@ -107,15 +159,21 @@ class TestStorage:
                     # Update existing test
                     test["questions"] = serializable_questions
                     test["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    test["version"] = test.get("version", 1) + 1
+                    test["prepared"] = True
                     self.dirty = True
                     
                     # Save immediately if there are many questions
                     if len(serializable_questions) > 20:
                         self._save_tests()
-                    return
+                    return test["id"]
             
             # Create new test
+            test_id = uuid.uuid4().hex
             self.tests[user_id_str].append({
+                "id": test_id,
+                "version": 1,
+                "prepared": True,
                 "name": test_name,
                 "questions": serializable_questions,
                 "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -127,6 +185,8 @@ class TestStorage:
             # Save immediately if there are many questions
             if len(serializable_questions) > 20:
                 self._save_tests()
+            
+            return test_id
     
     def get_user_tests(self, user_id: int) -> List[Dict[str, Any]]:
         """
@@ -157,12 +217,56 @@ class TestStorage:
                 questions.append((q["question"], q["options"]))
             
             return {
+                "id": test["id"],
+                "version": test["version"],
                 "name": test["name"],
                 "questions": questions,
                 "created_at": test["created_at"],
                 "updated_at": test.get("updated_at", test["created_at"])
             }
     
+    def _find_test(self, user_id: int, test_id: str) -> Optional[Dict[str, Any]]:
+        for test in self.tests.get(str(user_id), []):
+            if test["id"] == test_id:
+                return test
+        return None
+    
+    def get_test_info(self, user_id: int, test_id: Union[str, int]) -> Optional[Dict[str, Any]]:
+        """
+        Get test metadata (without copying its questions)
+        test_id is a test id, or an int position in the user's test list
+        """
+        with self.lock:  # Thread safety
+            if isinstance(test_id, int):
+                user_tests = self.tests.get(str(user_id), [])
+                test = user_tests[test_id] if 0 <= test_id < len(user_tests) else None
+            else:
+                test = self._find_test(user_id, test_id)
+            if test is None:
+                return None
+            return {
+                "id": test["id"],
+                "version": test["version"],
+                "name": test["name"],
+                "question_count": len(test["questions"]),
+                "created_at": test["created_at"]
+            }
+    
+    def get_question(self, user_id: int, test_id: str, index: int, version: Optional[int] = None) -> Optional[Tuple[str, List[str]]]:
+        """
+        Get a single question of a test by its position
+        Returns (question, [answers]) or None if the test is gone, was replaced
+        by a newer version, or the index is out of range
+        """
+        with self.lock:  # Thread safety
+            test = self._find_test(user_id, test_id)
+            if test is None or (version is not None and test["version"] != version):
+                return None
+            if not 0 <= index < len(test["questions"]):
+                return None
+            q = test["questions"][index]
+            return q["question"], q["options"]
+    
     def delete_test(self, user_id: int, test_index: int) -> bool:
         """Delete a test by index"""
         with self.lock:  # Thread safety
@@ -194,6 +298,8 @@ class TestStorage:
                         questions.append((q["question"], q["options"]))
                     
                     return {
+                        "id": test["id"],
+                        "version": test["version"],
                         "name": test["name"],
                         "questions": questions,
                         "created_at": test["created_at"],
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """database module on an empty database file"""
+    import database
+
+    monkeypatch.setattr(database, "connection_pool", database.ConnectionPool(str(tmp_path / "bot_users.db")))
+    database.init_db()
+    yield database
+    database.connection_pool.close_all()
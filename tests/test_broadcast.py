@@ -0,0 +1,153 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from broadcast import (FLOOD, FORBIDDEN, NOT_FOUND, TRANSIENT, BroadcastJob, BroadcastManager,
+                       classify_send_error)
+from localization import get_text
+
+METHOD = SendMessage(chat_id=1, text="x")
+
+
+def test_classify_send_error():
+    assert classify_send_error(TelegramForbiddenError(METHOD, "bot was blocked by the user")) == FORBIDDEN
+    assert classify_send_error(TelegramBadRequest(METHOD, "Bad Request: chat not found")) == NOT_FOUND
+    assert classify_send_error(TelegramBadRequest(METHOD, "Bad Request: message is too long")) == TRANSIENT
+    assert classify_send_error(TelegramRetryAfter(METHOD, "Flood", 5)) == FLOOD
+    assert classify_send_error(TelegramNetworkError(METHOD, "timeout")) == TRANSIENT
+
+
+class FakeBot:
+    def __init__(self, failures=None):
+        # user_id -> list of exceptions raised by the next sends
+        self.failures = failures or {}
+        self.sent = []
+        self.progress = []
+
+    async def send_message(self, user_id, text):
+        errors = self.failures.get(user_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append(user_id)
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        self.progress.append(text)
+
+
+def add_users(db, user_ids):
+    for user_id in user_ids:
+        db.add_user(user_id, f"user{user_id}")
+
+
+def new_job(db, total):
+    db.create_broadcast(1, "uz", '{"type": "text", "content": "hi"}', total, 1, 1)
+    return BroadcastJob(db.get_running_broadcasts()[-1])
+
+
+def run_job(manager, bot, job):
+    asyncio.run(manager._execute(bot, job))
+
+
+def recipients(db, broadcast_id):
+    conn = db.connection_pool.get_connection()
+    try:
+        rows = conn.execute("SELECT user_id, status FROM broadcast_recipients WHERE broadcast_id = ?",
+                            (broadcast_id,)).fetchall()
+        return {row["user_id"]: row["status"] for row in rows}
+    finally:
+        db.connection_pool.return_connection(conn)
+
+
+def status(db, broadcast_id):
+    conn = db.connection_pool.get_connection()
+    try:
+        return conn.execute("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()[0]
+    finally:
+        db.connection_pool.return_connection(conn)
+
+
+def test_transient_failures_are_retried_and_blocked_users_deactivated(db):
+    add_users(db, [10, 11, 12])
+    job = new_job(db, 3)
+    bot = FakeBot({
+        11: [TelegramNetworkError(METHOD, "timeout"), TelegramRetryAfter(METHOD, "Flood", 1)],
+        12: [TelegramForbiddenError(METHOD, "bot was blocked by the user")],
+    })
+    run_job(BroadcastManager(batch_size=2, retry_rounds=3, retry_delay=0), bot, job)
+
+    assert sorted(bot.sent) == [10, 11]
+    assert recipients(db, job.id) == {10: "sent", 11: "sent", 12: "forbidden"}
+    assert (job.sent, job.failed) == (2, 1)
+    assert db.get_all_users(reachable_only=True) == [10, 11]
+    assert status(db, job.id) == "done"
+
+
+def test_transient_failure_is_stored_after_the_last_round(db):
+    add_users(db, [10])
+    job = new_job(db, 1)
+    bot = FakeBot({10: [TelegramNetworkError(METHOD, "timeout") for _ in range(3)]})
+    run_job(BroadcastManager(retry_rounds=2, retry_delay=0), bot, job)
+
+    assert recipients(db, job.id) == {10: "transient"}
+    assert (job.sent, job.failed) == (0, 1)
+    assert status(db, job.id) == "done"
+
+
+def test_resume_skips_recorded_recipients_and_retries_pending(db):
+    add_users(db, [10, 11, 12])
+    job = new_job(db, 3)
+    # A previous run sent to 10, failed transiently for 11 and advanced the cursor past both
+    db.save_broadcast_progress(job.id, [(10, "sent", None)], 11, 1, 0)
+    bot = FakeBot()
+    manager = BroadcastManager(retry_delay=0)
+    run_job(manager, bot, BroadcastJob(db.get_running_broadcasts()[-1]))
+
+    assert sorted(bot.sent) == [11, 12]
+    assert recipients(db, job.id) == {10: "sent", 11: "sent", 12: "sent"}
+
+
+def test_database_error_leaves_job_running(db, monkeypatch):
+    add_users(db, [10, 11])
+    job = new_job(db, 2)
+
+    def broken(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(db, "save_broadcast_progress", broken)
+    bot = FakeBot()
+    run_job(BroadcastManager(retry_delay=0), bot, job)
+
+    assert status(db, job.id) == "running"
+    assert bot.progress[-1] == get_text("uz", "broadcast_interrupted").format(
+        success_count=0, failed_count=0, total=2)
+
+
+def test_start_creates_the_job_in_the_executor(db, monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from types import SimpleNamespace
+
+    add_users(db, [10])
+    threads = []
+    create_broadcast = db.create_broadcast
+
+    def recording_create_broadcast(*args):
+        threads.append(threading.get_ident())
+        return create_broadcast(*args)
+
+    monkeypatch.setattr(db, "create_broadcast", recording_create_broadcast)
+    progress = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1)
+    bot = FakeBot()
+
+    async def run():
+        with ThreadPoolExecutor(1) as executor:
+            manager = BroadcastManager(retry_delay=0, executor=executor)
+            broadcast_id = await manager.start(bot, 1, "uz", {"type": "text", "content": "hi"}, 1, progress)
+            await manager.jobs[broadcast_id].task
+            return broadcast_id
+
+    broadcast_id = asyncio.run(run())
+    assert threads and threads[0] != threading.get_ident()
+    assert bot.sent == [10]
+    assert status(db, broadcast_id) == "done"
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+import metrics
+
+
+def test_histogram_time_observes_on_error():
+    histogram = metrics.Histogram("test_seconds")
+    with histogram.time():
+        pass
+    with pytest.raises(ValueError):
+        with histogram.time():
+            raise ValueError
+    assert histogram.snapshot()["count"] == 2
+
+
+def test_database_functions_are_timed_by_name(db):
+    sync = metrics.db_seconds.labels("get_user")
+    coroutine = metrics.db_seconds.labels("get_user_test_results")
+    sync_before, coroutine_before = sync.snapshot()["count"], coroutine.snapshot()["count"]
+
+    db.add_user(1, "user", "First", None)
+    assert db.get_user(1) is not None
+    assert asyncio.run(db.get_user_test_results(1)) == []
+
+    assert sync.snapshot()["count"] == sync_before + 1
+    assert coroutine.snapshot()["count"] == coroutine_before + 1
+    assert db.get_user.__name__ == "get_user"
+
+
+def test_count_users_skips_inactive(db):
+    for user_id in (1, 2, 3):
+        db.add_user(user_id, f"user{user_id}")
+    db.mark_users_inactive([2])
+    assert db.count_users() == 3
+    assert db.count_users(reachable_only=True) == 2 == len(db.get_all_users(reachable_only=True))
@@ -0,0 +1,23 @@
+import threading
+import time
+
+from file_lock import exclusive_lock
+
+
+def test_exclusive_lock_serializes_holders(tmp_path):
+    path = str(tmp_path / "data.lock")
+    events = []
+
+    def hold(name):
+        with exclusive_lock(path):
+            events.append(f"{name} in")
+            time.sleep(0.05)
+            events.append(f"{name} out")
+
+    threads = [threading.Thread(target=hold, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The second holder only enters after the first one left
+    assert events[1].endswith("out") and events[3].endswith("out")
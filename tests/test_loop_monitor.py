@@ -0,0 +1,56 @@
+import asyncio
+import os
+import time
+import traceback
+
+import metrics
+from loop_monitor import LoopMonitor, blocking_location, callback_frames
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def frame(filename: str, name: str) -> traceback.FrameSummary:
+    return traceback.FrameSummary(filename, 1, name, lookup_line=False)
+
+
+def test_blocking_location_skips_library_frames():
+    frames = [
+        frame(os.path.join(ROOT, "main.py"), "handle_document"),
+        frame(os.path.join(ROOT, "database.py"), "get_user"),
+        frame("/usr/lib/python3.11/sqlite3/dbapi2.py", "execute"),
+    ]
+    assert blocking_location(frames) == "database.py:get_user"
+
+
+def test_blocking_location_without_project_frames():
+    assert blocking_location([frame("/usr/lib/python3.11/json/encoder.py", "encode")]) == "encoder.py:encode"
+    assert blocking_location([]) == "unknown"
+
+
+def test_callback_frames_drops_event_loop():
+    frames = [
+        frame(os.path.join("lib", "asyncio", "base_events.py"), "run_forever"),
+        frame(os.path.join("lib", "asyncio", "events.py"), "_run"),
+        frame(os.path.join(ROOT, "main.py"), "handle_document"),
+    ]
+    assert [f.name for f in callback_frames(frames)] == ["handle_document"]
+
+
+def block_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_monitor_records_blocking_call():
+    histogram = metrics.loop_blocked_seconds.labels("tests/test_loop_monitor.py:block_loop")
+    before = histogram.snapshot()["count"]
+
+    async def run():
+        monitor = LoopMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        block_loop(0.3)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(run())
+    assert histogram.snapshot()["count"] == before + 1
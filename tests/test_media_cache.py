@@ -0,0 +1,80 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendVideo
+
+from media_cache import MediaCache
+
+
+class FakeSender:
+    """Stands in for message.answer_video; counts uploads and concurrent sends"""
+    def __init__(self, rejected=()):
+        self.uploads = 0
+        self.active = 0
+        self.max_active = 0
+        self.rejected = set(rejected)
+
+    async def __call__(self, video, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            if isinstance(video, types.FSInputFile):
+                self.uploads += 1
+                video = f"file-{self.uploads}"
+            elif video in self.rejected:
+                raise TelegramBadRequest(SendVideo(chat_id=1, video=video), "wrong file identifier")
+            return SimpleNamespace(video=SimpleNamespace(file_id=video))
+        finally:
+            self.active -= 1
+
+
+def send_many(cache, sender, path, count):
+    async def run():
+        return await asyncio.gather(*(cache.send(sender, str(path), "video") for _ in range(count)))
+    return asyncio.run(run())
+
+
+def test_concurrent_first_sends_upload_once(db, tmp_path):
+    path = tmp_path / "guide.mp4"
+    path.write_bytes(b"video")
+    sender = FakeSender()
+    messages = send_many(MediaCache(), sender, path, 5)
+    assert sender.uploads == 1
+    assert {message.video.file_id for message in messages} == {"file-1"}
+
+
+def test_cached_sends_run_concurrently(db, tmp_path):
+    path = tmp_path / "guide.mp4"
+    path.write_bytes(b"video")
+    cache, sender = MediaCache(), FakeSender()
+    send_many(cache, sender, path, 1)
+    sender.max_active = 0
+    send_many(cache, sender, path, 5)
+    assert sender.uploads == 1
+    assert sender.max_active == 5
+
+
+def test_file_id_survives_restart_and_changes_invalidate(db, tmp_path):
+    path = tmp_path / "guide.mp4"
+    path.write_bytes(b"video")
+    sender = FakeSender()
+    send_many(MediaCache(), sender, path, 1)
+    send_many(MediaCache(), sender, path, 1)
+    assert sender.uploads == 1
+    path.write_bytes(b"new video")
+    send_many(MediaCache(), sender, path, 1)
+    assert sender.uploads == 2
+
+
+def test_rejected_file_id_is_uploaded_again(db, tmp_path):
+    path = tmp_path / "guide.mp4"
+    path.write_bytes(b"video")
+    cache, sender = MediaCache(), FakeSender()
+    send_many(cache, sender, path, 1)
+    sender.rejected.add("file-1")
+    messages = send_many(cache, sender, path, 3)
+    assert sender.uploads == 2
+    assert {message.video.file_id for message in messages} == {"file-2"}
@@ -0,0 +1,24 @@
+from localization import get_text
+from message_catalog import MessageCatalog, catalog
+
+
+def labels(keyboard):
+    return [[button.text for button in row] for row in keyboard.keyboard]
+
+
+def test_keyboard_texts_match_localization():
+    keyboard = catalog.keyboard("ru", "question_order")
+    assert labels(keyboard) == [[get_text("ru", "btn_shuffle_questions")],
+                                [get_text("ru", "btn_sequential_questions")],
+                                [get_text("ru", "btn_main_menu")]]
+
+
+def test_unknown_language_uses_default():
+    assert catalog.keyboard("xx", "main_menu") is catalog.keyboard("uz", "main_menu")
+    assert catalog.keyboard(None, "main_menu") is catalog.keyboard("uz", "main_menu")
+
+
+def test_missing_text_falls_back_to_default_language():
+    texts = {"uz": {"btn_main_menu": "Menyu", "menu_placeholder": "..."}, "ru": {"menu_placeholder": "..."}}
+    layouts = {"back": ((("btn_main_menu",),), "menu_placeholder")}
+    assert labels(MessageCatalog(texts, layouts).keyboard("ru", "back")) == [["Menyu"]]
@@ -0,0 +1,59 @@
+import asyncio
+
+from aiogram.types import PollAnswer, Update, User
+
+from middleware import MemoryRateLimitBackend, RateLimiter, SQLiteRateLimitBackend
+
+
+def test_memory_backend_capacity_and_refill():
+    backend = MemoryRateLimitBackend(idle_after=60)
+    assert all(backend.take(1, 3, 1.0, now=0) for _ in range(3))
+    assert not backend.take(1, 3, 1.0, now=0)
+    assert backend.take(1, 3, 1.0, now=1)
+    assert not backend.take(1, 3, 1.0, now=1)
+
+
+def test_memory_backend_evicts_idle_and_least_recently_used():
+    backend = MemoryRateLimitBackend(idle_after=10, max_users=2)
+    backend.take(1, 3, 1.0, now=0)
+    backend.take(2, 3, 1.0, now=1)
+    backend.take(1, 3, 1.0, now=2)
+    backend.take(3, 3, 1.0, now=3)
+    assert set(backend.buckets) == {1, 3}
+    backend.take(4, 3, 1.0, now=20)
+    assert set(backend.buckets) == {4}
+
+
+def test_sqlite_backend_shares_the_limit(tmp_path):
+    path = str(tmp_path / "rate_limits.db")
+    first, second = SQLiteRateLimitBackend(path), SQLiteRateLimitBackend(path)
+    try:
+        allowed = [backend.take(42, 4, 1.0, now=100) for backend in (first, second) * 3]
+        assert allowed.count(True) == 4
+        assert second.take(42, 4, 1.0, now=101)
+        assert len(first) == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_rate_limiter_drops_flood_but_not_poll_answers():
+    limiter = RateLimiter(limits={"default": {"requests": 2, "per_seconds": 60},
+                                  "admin": {"requests": 2, "per_seconds": 60}},
+                          backend=MemoryRateLimitBackend(60))
+    user = User(id=7, is_bot=False, first_name="User")
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+        return True
+
+    async def run():
+        results = [await limiter(handler, object(), {"event_from_user": user}) for _ in range(3)]
+        answer = Update(update_id=1, poll_answer=PollAnswer(poll_id="1", user=user, option_ids=[0]))
+        results.append(await limiter(handler, answer, {"event_from_user": user}))
+        return results
+
+    assert asyncio.run(run()) == [True, True, None, True]
+    assert len(handled) == 3
+    assert limiter.limited == 1
@@ -0,0 +1,31 @@
+import time
+
+from poll_index import PollIndex
+
+
+def test_pop_returns_entry_once():
+    index = PollIndex(ttl=60)
+    index.register("poll-1", 42, "session", 3, 1)
+    entry = index.pop("poll-1")
+    assert (entry.user_id, entry.session_id, entry.question, entry.correct_option) == (42, "session", 3, 1)
+    # A repeated answer to the same poll is ignored
+    assert index.pop("poll-1") is None
+
+
+def test_unknown_poll():
+    assert PollIndex().pop("missing") is None
+
+
+def test_expired_entry_is_ignored():
+    index = PollIndex(ttl=-1)
+    index.register("poll-1", 42, "session", 0, 0)
+    assert index.pop("poll-1") is None
+
+
+def test_register_purges_expired_entries():
+    index = PollIndex(ttl=-1)
+    index.register("old", 1, "session", 0, 0)
+    index.last_purge = time.time() - 120
+    index.ttl = 60
+    index.register("new", 2, "session", 0, 0)
+    assert set(index.polls) == {"new"}
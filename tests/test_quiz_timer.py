@@ -0,0 +1,50 @@
+import asyncio
+
+from config import question_time
+from quiz_timer import DeadlineScheduler
+
+
+def test_deadlines_fire_in_order_and_cancel():
+    fired = []
+
+    async def callback(key, payload):
+        fired.append((key, payload))
+
+    async def run():
+        scheduler = DeadlineScheduler(callback)
+        scheduler.schedule("b", 0.04, 2)
+        scheduler.schedule("a", 0.02, 1)
+        scheduler.schedule("c", 0.03, 3)
+        scheduler.cancel("c")
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert fired == [("a", 1), ("b", 2)]
+
+
+def test_stop_cancels_running_handlers():
+    finished = []
+
+    async def callback(key, payload):
+        await asyncio.sleep(10)
+        finished.append(key)
+
+    async def run():
+        scheduler = DeadlineScheduler(callback)
+        scheduler.schedule("a", 0)
+        await asyncio.sleep(0.02)
+        assert len(scheduler.running) == 1
+        await scheduler.stop()
+        assert not scheduler.running
+
+    asyncio.run(run())
+    assert finished == []
+
+
+def test_question_time_is_clamped_to_open_period():
+    assert question_time(0) == 0
+    assert question_time(-5) == 0
+    assert question_time(3) == 5
+    assert question_time(30) == 30
+    assert question_time(900) == 600
@@ -0,0 +1,84 @@
+import metrics
+from quiz_utils import format_registry, parse_questions
+
+QUESTION_MARK_TEXT = "?Capital of France?\n+Paris\n-Rome\n-Madrid\n?2+2\n+4\n-5\n"
+
+
+def test_rank_prefers_question_mark_format():
+    lines = QUESTION_MARK_TEXT.splitlines()
+    score, question_format = format_registry.rank(lines)[0]
+    assert question_format.name == "question_mark"
+    assert score > format_registry.get("freeform").score(lines)
+
+
+def test_rank_empty_document():
+    assert format_registry.rank([]) == []
+
+
+def test_parse_questions_question_mark_format():
+    questions, has_errors = parse_questions(QUESTION_MARK_TEXT, file_type="txt")
+    assert [question for question, _ in questions] == ["Capital of France?", "2+2"]
+    assert questions[0][1][0] == "Paris"
+    assert not has_errors
+
+
+def test_parse_is_timed_by_format():
+    histogram = metrics.parse_seconds.labels("question_mark")
+    before = histogram.snapshot()["count"]
+    parse_questions(QUESTION_MARK_TEXT, file_type="txt")
+    assert histogram.snapshot()["count"] == before + 1
+    assert "quiz_parse_seconds_count{format=\"question_mark\"}" in metrics.render()
+
+
+def _parse_csv(text):
+    import io
+    from quiz_utils import parse_table
+    return parse_table(io.BytesIO(text.encode("utf-8")), file_type="csv")
+
+
+def test_parse_table_keeps_columns():
+    questions, has_errors = _parse_csv("Capital of France?,Paris,Rome,Madrid\n")
+    assert questions[0][0] == "Capital of France?"
+    assert questions[0][1][0] == "Paris"
+    assert not has_errors
+
+
+def test_parse_table_rejects_row_without_correct_answer():
+    questions, has_errors = _parse_csv("Capital of France?,Paris,Rome\nWhat is 2+2?,,3,5\n")
+    assert [question for question, *_ in questions] == ["Capital of France?"]
+    assert has_errors
+
+
+def test_parse_table_trailing_empty_cells():
+    questions, has_errors = _parse_csv("Capital of France?,Paris,Rome,,\n")
+    assert len(questions) == 1
+    assert not has_errors
+
+
+def test_parse_table_header_row_is_skipped():
+    questions, has_errors = _parse_csv("Question;Answer;Wrong\nWhich city?;Paris;Rome\n")
+    assert [question for question, *_ in questions] == ["Which city?"]
+    assert not has_errors
+
+
+def test_parse_table_first_question_mentioning_question_is_kept():
+    questions, _ = _parse_csv("Which question is first?;yes;no\n")
+    assert [question for question, *_ in questions] == ["Which question is first?"]
+
+
+def test_parse_upload_by_file_type():
+    import io
+    from quiz_utils import parse_upload
+    questions, _ = parse_upload(io.BytesIO(QUESTION_MARK_TEXT.encode("cp1251")), file_type="txt")
+    assert [question for question, _ in questions] == ["Capital of France?", "2+2"]
+    questions, _ = parse_upload(io.BytesIO(b"Capital of France?,Paris,Rome\n"), file_type="csv")
+    assert questions[0][1][0] == "Paris"
+
+
+def test_only_the_best_format_parses(monkeypatch):
+    parsed = []
+    monkeypatch.setattr(format_registry, "rank", lambda lines: [(0.9, format_registry.get("question_mark")),
+                                                                (0.5, format_registry.get("numbered"))])
+    monkeypatch.setattr(format_registry, "parse", lambda lines, question_format: parsed.append(question_format.name) or [])
+    assert parse_questions("Just some prose\nwithout any questions\n", file_type="txt") == ([], False)
+    assert parsed == ["question_mark"]
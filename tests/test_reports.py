@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from reports import ReportCache
+
+
+@pytest.fixture
+def cache(db, tmp_path):
+    db.add_user(10, "alice", "Alice")
+    db.add_user(11, "bob", "Bob")
+    cache = ReportCache(directory=str(tmp_path / "reports"))
+    cache.refresh(force=True)
+    return cache
+
+
+def test_no_changes_means_nothing_pending(cache):
+    assert cache.pending_rows(cache.manifest()) == 0
+
+
+def test_no_build_yet(db, tmp_path):
+    assert ReportCache(directory=str(tmp_path / "reports")).pending_rows(None) is None
+
+
+@pytest.mark.parametrize("change", [
+    lambda db: asyncio.run(db.update_user_language(10, "ru")),
+    lambda db: db.mark_users_inactive([11]),
+    lambda db: db.add_user(10, "alice_new", "Alice"),
+])
+def test_user_changes_are_pending(db, cache, change):
+    change(db)
+    assert cache.pending_rows(cache.manifest()) >= 1
+
+
+def test_add_and_remove_do_not_cancel_out(db, cache):
+    db.add_user(12, "carol", "Carol")
+    db.remove_user(11)
+    assert cache.pending_rows(cache.manifest()) == 2
+
+
+def test_unchanged_user_update_is_not_pending(db, cache):
+    db.add_user(10, "alice", "Alice")
+    assert cache.pending_rows(cache.manifest()) == 0
+
+
+def test_new_results_are_appended(db, cache):
+    asyncio.run(db.save_test_result(10, "Test", "2024-01-01 10:00", 3, 4, 75.0, 75))
+    assert cache.pending_rows(cache.manifest()) == 1
+    manifest = cache.refresh()
+    assert (manifest["appended"], manifest["tests_count"]) == (1, 1)
+    assert cache.pending_rows(manifest) == 0
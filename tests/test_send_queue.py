@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, SendPoll
+
+from send_queue import BULK, GLOBAL_FLOOD_CHATS, OutboundScheduler, TokenBucket, bulk_sends, send_priority
+
+
+def test_token_bucket_reservations_queue_up():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == pytest.approx(0.1)
+    assert bucket.reserve(now) == pytest.approx(0.2)
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.pause(2)
+    assert bucket.delay() == pytest.approx(2.1, abs=0.01)
+
+
+def test_bulk_sends_sets_priority():
+    with bulk_sends():
+        assert send_priority.get() == BULK
+    assert send_priority.get() != BULK
+
+
+def run_requests(scheduler, methods, make_request):
+    async def run():
+        return await asyncio.gather(*(scheduler(make_request, None, method) for method in methods))
+    return asyncio.run(run())
+
+
+async def ok(bot, method):
+    return True
+
+
+def test_per_chat_limit_delays_messages():
+    scheduler = OutboundScheduler(global_rate=1000, chat_rate=20, chat_burst=1)
+    started = time.monotonic()
+    run_requests(scheduler, [SendMessage(chat_id=1, text="x") for _ in range(3)], ok)
+    assert time.monotonic() - started >= 0.09
+
+
+def test_polls_skip_the_per_chat_limit():
+    scheduler = OutboundScheduler(global_rate=1000, chat_rate=1, chat_burst=1)
+    started = time.monotonic()
+    run_requests(scheduler, [SendPoll(chat_id=1, question="q", options=["a", "b"]) for _ in range(5)], ok)
+    assert time.monotonic() - started < 0.5
+
+
+def flood_once(chat_ids):
+    flooded = set()
+
+    async def make_request(bot, method):
+        if method.chat_id in chat_ids and method.chat_id not in flooded:
+            flooded.add(method.chat_id)
+            raise TelegramRetryAfter(method=method, message="Flood", retry_after=0)
+        return True
+    return make_request
+
+
+def test_flood_in_one_chat_does_not_pause_everyone():
+    scheduler = OutboundScheduler(global_rate=1000)
+    assert run_requests(scheduler, [SendMessage(chat_id=1, text="x")], flood_once({1})) == [True]
+    assert scheduler.flood_waits == 1
+    assert scheduler.global_pauses == 0
+
+
+def test_floods_in_several_chats_pause_everyone():
+    scheduler = OutboundScheduler(global_rate=1000)
+    chats = set(range(1, GLOBAL_FLOOD_CHATS + 1))
+    run_requests(scheduler, [SendMessage(chat_id=chat, text="x") for chat in chats], flood_once(chats))
+    assert scheduler.global_pauses == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = OutboundScheduler(global_rate=1000, max_retries=1)
+
+    async def always_flood(bot, method):
+        raise TelegramRetryAfter(method=method, message="Flood", retry_after=0)
+
+    with pytest.raises(TelegramRetryAfter):
+        run_requests(scheduler, [SendMessage(chat_id=1, text="x")], always_flood)
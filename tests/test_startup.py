@@ -0,0 +1,11 @@
+from startup_profile import measure_imports
+
+# Heavy libraries imported on first use, never at startup
+LAZY_PACKAGES = ("nltk", "docx", "openpyxl")
+
+
+def test_bot_startup_does_not_import_heavy_libraries():
+    imported = {name.split(".")[0] for name, _, _, _ in measure_imports("main")}
+    assert not imported & set(LAZY_PACKAGES)
+    # The check sees real imports: main's own modules are listed
+    assert {"main", "quiz_utils", "aiogram"} <= imported
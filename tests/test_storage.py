@@ -0,0 +1,18 @@
+import storage as storage_module
+
+QUESTIONS = [("Capital of France?", ["Paris", "Rome"]), ("2+2", ["4", "5"])]
+
+
+def test_get_test_info_by_id_or_position(tmp_path):
+    storage = storage_module.TestStorage(str(tmp_path / "user_tests.json"))
+    try:
+        test_id = storage.add_test(1, "Geography", QUESTIONS)
+        by_id = storage.get_test_info(1, test_id)
+        assert by_id == storage.get_test_info(1, 0)
+        assert (by_id["id"], by_id["name"], by_id["question_count"]) == (test_id, "Geography", 2)
+        assert "questions" not in by_id
+        assert storage.get_test_info(1, 1) is None
+        assert storage.get_test_info(1, -1) is None
+        assert storage.get_test_info(2, 0) is None
+    finally:
+        storage.cleanup()
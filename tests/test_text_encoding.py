@@ -0,0 +1,43 @@
+import codecs
+import io
+
+import pytest
+
+from text_encoding import decode_stream, detect_encoding
+
+RUSSIAN = "Вопрос: Столица России?\n+Москва\n-Париж\n"
+
+
+@pytest.mark.parametrize("encoding, data", [
+    ("utf-8", RUSSIAN.encode("utf-8")),
+    ("utf-8-sig", codecs.BOM_UTF8 + RUSSIAN.encode("utf-8")),
+    ("utf-16", RUSSIAN.encode("utf-16")),
+    ("cp1251", RUSSIAN.encode("cp1251")),
+    ("latin-1", "Question: Où est la gare?\n+Ici\n".encode("latin-1")),
+])
+def test_detect_encoding(encoding, data):
+    assert detect_encoding(data) == encoding
+
+
+def test_decode_stream_small_file():
+    assert decode_stream(io.BytesIO(RUSSIAN.encode("cp1251"))) == RUSSIAN
+
+
+def test_decode_stream_chunked_matches_one_call(monkeypatch):
+    import text_encoding
+
+    data = RUSSIAN.encode("utf-8") * 1000
+    monkeypatch.setattr(text_encoding, "WHOLE_DECODE_SIZE", 1024)
+    assert decode_stream(io.BytesIO(data), chunk_size=1000) == RUSSIAN * 1000
+
+
+@pytest.mark.parametrize("whole_decode_size", [None, 1024])
+def test_decode_stream_falls_back_when_utf8_breaks_after_sample(monkeypatch, whole_decode_size):
+    import text_encoding
+
+    if whole_decode_size:
+        monkeypatch.setattr(text_encoding, "WHOLE_DECODE_SIZE", whole_decode_size)
+    ascii_start = b"Question 1\n" * (text_encoding.SAMPLE_SIZE // 10)
+    text = decode_stream(io.BytesIO(ascii_start + RUSSIAN.encode("cp1251")))
+    assert text.endswith(RUSSIAN)
+    assert "�" not in text
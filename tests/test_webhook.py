@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from sharding import build_front_app
+from webhook import WebhookServer
+
+
+class FakeRunner:
+    def __init__(self):
+        self.updates = []
+
+    async def route_async(self, update):
+        self.updates.append(update)
+
+
+def test_webhook_server_refuses_to_start_without_secret():
+    server = WebhookServer(dispatcher=None, bot=None, secret="")
+    with pytest.raises(RuntimeError):
+        asyncio.run(server.start("127.0.0.1", 0))
+
+
+def test_front_app_requires_secret():
+    with pytest.raises(RuntimeError):
+        build_front_app(FakeRunner(), "/webhook", "")
+
+
+def test_front_app_checks_secret_token():
+    runner = FakeRunner()
+
+    async def run():
+        async with TestClient(TestServer(build_front_app(runner, "/webhook", "s3cret"))) as client:
+            rejected = await client.post("/webhook", json={"update_id": 1})
+            wrong = await client.post("/webhook", json={"update_id": 2},
+                                      headers={"X-Telegram-Bot-Api-Secret-Token": "guess"})
+            accepted = await client.post("/webhook", json={"update_id": 3},
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+            return rejected.status, wrong.status, accepted.status
+
+    assert asyncio.run(run()) == (401, 401, 200)
+    assert runner.updates == [{"update_id": 3}]
@@ -0,0 +1,121 @@
+"""
+Encoding detection for uploaded .txt quiz files.
+
+Users upload text files saved by Notepad, Word and phone editors, so the same
+quiz can arrive as UTF-8 (with or without BOM), UTF-16 or a legacy 8-bit code
+page. Cyrillic files saved in Windows-1251 are common among Russian-speaking
+users and are mangled if decoded as latin-1, so the detector looks at byte
+statistics of a single sample instead of decoding the whole file several times.
+"""
+import codecs
+import logging
+import os
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+# Bytes inspected to choose an encoding
+SAMPLE_SIZE = 64 * 1024
+# Files up to this size are decoded in one call, larger ones incrementally
+WHOLE_DECODE_SIZE = 4 * 1024 * 1024
+# Chunk size used for incremental decoding
+CHUNK_SIZE = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# cp1251 letters: А-я (0xC0-0xFF), Ё (0xA8) and ё (0xB8)
+_HIGH_LETTERS = bytes(range(0xC0, 0x100)) + b"\xa8\xb8"
+_ASCII_LETTERS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# Maps cp1251 letters to "H" and every other byte to ".", to count letter runs
+_HIGH_MAP = bytes(ord("H") if byte in _HIGH_LETTERS else ord(".") for byte in range(256))
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Choose the encoding of a byte sample
+    Returns one of: "utf-8-sig", "utf-16", "utf-8", "cp1251", "latin-1"
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    # Strict UTF-8 check; final=False tolerates a multibyte sequence cut at the sample end
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    return detect_code_page(sample)
+
+
+def detect_code_page(sample: bytes) -> str:
+    """Choose between cp1251 and latin-1 for text that is not UTF-8"""
+    # Cyrillic text in cp1251 consists almost entirely of bytes >= 0xC0 that
+    # form whole words, while latin-1 text is mostly ASCII letters with an
+    # occasional accented letter in between.
+    high_letters = len(sample) - len(sample.translate(None, _HIGH_LETTERS))
+    ascii_letters = len(sample) - len(sample.translate(None, _ASCII_LETTERS))
+    # Letters that follow another letter: every letter except the first of each run
+    mapped = sample.translate(_HIGH_MAP)
+    high_runs = high_letters - mapped.count(b".H") - mapped.startswith(b"H")
+
+    letters = ascii_letters + high_letters
+    if high_letters and letters:
+        high_ratio = high_letters / letters
+        run_ratio = high_runs / high_letters
+        if high_ratio > 0.3 or run_ratio > 0.5:
+            return "cp1251"
+    return "latin-1"
+
+
+def _decode_chunks(stream: BinaryIO, encoding: str, errors: str, chunk_size: int) -> str:
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    parts = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parts.append(decoder.decode(chunk))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+def decode_stream(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    Decode a binary file-like object (seekable) to text
+    The encoding is detected from the first SAMPLE_SIZE bytes. Files up to
+    WHOLE_DECODE_SIZE are decoded in one call, larger ones chunk by chunk.
+    If the file turns out not to be UTF-8 further in (e.g. an ASCII start
+    followed by cp1251 text), it is decoded again with the code page detected
+    from the whole file instead of being filled with U+FFFD.
+    """
+    start = stream.tell()
+    sample = stream.read(SAMPLE_SIZE)
+    encoding = detect_encoding(sample)
+    size = stream.seek(0, os.SEEK_END) - start
+    stream.seek(start)
+
+    # Only a UTF-8 guess can be wrong later in the file; 8-bit code pages and
+    # UTF-16 (chosen by its BOM) replace the odd invalid byte as before
+    utf8 = encoding in ("utf-8", "utf-8-sig")
+    errors = "strict" if utf8 else "replace"
+    try:
+        if size <= WHOLE_DECODE_SIZE:
+            text = stream.read().decode(encoding, errors)
+        else:
+            text = _decode_chunks(stream, encoding, errors, chunk_size)
+        logger.info(f"Detected text encoding: {encoding}")
+        return text
+    except UnicodeDecodeError:
+        pass
+
+    # Not UTF-8 after all: choose the code page from the whole file (rare)
+    stream.seek(start)
+    data = stream.read()
+    encoding = detect_code_page(data)
+    logger.info(f"Text is not valid UTF-8 after the first {SAMPLE_SIZE} bytes, detected {encoding}")
+    return data.decode(encoding, errors="replace")
@@ -0,0 +1,125 @@
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Optional, BinaryIO
+
+from config import MAX_UPLOAD_SIZE, UPLOAD_SPOOL_SIZE, UPLOAD_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded file exceeds MAX_UPLOAD_SIZE"""
+
+
+class _PendingUpload:
+    __slots__ = ("file", "user_id", "created_at")
+
+    def __init__(self, file: BinaryIO, user_id: int):
+        self.file = file
+        self.user_id = user_id
+        self.created_at = time.monotonic()
+
+
+class UploadStore:
+    """
+    Temporary storage for uploaded files that are waiting for a test name.
+    Files are streamed into size-capped spooled temp files: small uploads stay
+    in memory, larger ones spill to disk. Only the upload id is kept in FSM state,
+    so a pending upload costs constant memory. Expired uploads are removed by a
+    background thread.
+    """
+    def __init__(self, spool_size: int = UPLOAD_SPOOL_SIZE, max_size: int = MAX_UPLOAD_SIZE, ttl: int = UPLOAD_TTL):
+        self.spool_size = spool_size
+        self.max_size = max_size
+        self.ttl = ttl
+        self.uploads: Dict[str, _PendingUpload] = {}
+        self.lock = threading.RLock()
+
+        # Start a background thread to periodically drop expired uploads
+        self.cleanup_thread = threading.Thread(target=self._auto_cleanup, daemon=True)
+        self.cleanup_thread.start()
+
+    def _auto_cleanup(self):
+        """Background thread to periodically remove expired uploads"""
+        while True:
+            time.sleep(60)
+            self.purge_expired()
+
+    def create(self, user_id: int):
+        """
+        Create a new pending upload for a user
+        Returns (upload_id, file) where file is a writable spooled temp file
+        Any previous pending upload of the same user is discarded
+        """
+        upload_file = tempfile.SpooledTemporaryFile(max_size=self.spool_size, mode="w+b")
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            stale = [key for key, upload in self.uploads.items() if upload.user_id == user_id]
+            for key in stale:
+                self._close(self.uploads.pop(key))
+            self.uploads[upload_id] = _PendingUpload(upload_file, user_id)
+        return upload_id, upload_file
+
+    def check_size(self, upload_id: str) -> None:
+        """Raise UploadTooLarge (and discard the upload) if the file exceeds max_size"""
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return
+            upload.file.seek(0, 2)
+            size = upload.file.tell()
+            upload.file.seek(0)
+        if size > self.max_size:
+            self.discard(upload_id)
+            raise UploadTooLarge(f"Upload {upload_id} is {size} bytes (limit {self.max_size})")
+
+    def get(self, upload_id: Optional[str]) -> Optional[BinaryIO]:
+        """Get a pending upload positioned at the start, or None if missing or expired"""
+        if not upload_id:
+            return None
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return None
+            if time.monotonic() - upload.created_at > self.ttl:
+                self._close(self.uploads.pop(upload_id))
+                return None
+            upload.file.seek(0)
+            return upload.file
+
+    def discard(self, upload_id: Optional[str]) -> None:
+        """Remove a pending upload and release its memory / disk space"""
+        if not upload_id:
+            return
+        with self.lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            self._close(upload)
+
+    def purge_expired(self) -> int:
+        """Remove all uploads older than the TTL. Returns the number removed"""
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, upload in self.uploads.items() if now - upload.created_at > self.ttl]
+            for key in expired:
+                self._close(self.uploads.pop(key))
+        if expired:
+            logger.info(f"Removed {len(expired)} expired pending uploads")
+        return len(expired)
+
+    def cleanup(self):
+        """Close all pending uploads"""
+        with self.lock:
+            for upload in self.uploads.values():
+                self._close(upload)
+            self.uploads.clear()
+
+    @staticmethod
+    def _close(upload: _PendingUpload) -> None:
+        try:
+            upload.file.close()
+        except Exception as e:
+            logger.error(f"Error closing pending upload: {e}")
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from telegram import Update
 from telegram.error import TelegramError
@@ -31,19 +32,17 @@ async def send_message_to_user(context, user_id, content, content_type='text'):
         logger.error(f"Failed to send message to user {user_id}: {e}")
         return False
 
-async def broadcast_to_users(context, users, content, content_type='text', exclude_user=None):
-    """Broadcast a message to all users."""
-    success_count = 0
-    fail_count = 0
+async def broadcast_to_users(context, users, content, content_type='text', exclude_user=None, concurrency=25):
+    """Broadcast a message to all users, with at most `concurrency` sends in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
     
-    for user_id in users:
-        if exclude_user and user_id == exclude_user:
-            continue
-            
-        success = await send_message_to_user(context, user_id, content, content_type)
-        if success:
-            success_count += 1
-        else:
-            fail_count += 1
+    async def send(user_id):
+        async with semaphore:
+            return await send_message_to_user(context, user_id, content, content_type)
+    
+    results = await asyncio.gather(*(send(user_id) for user_id in users
+                                     if not (exclude_user and user_id == exclude_user)))
+    success_count = sum(1 for success in results if success)
+    fail_count = len(results) - success_count
     
     return success_count, fail_count
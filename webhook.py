@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """
+    Webhook ingress served by an embedded aiohttp server
+    Telegram posts updates to WEBHOOK_PATH. Requests without the configured
+    secret token are rejected with 401; the server does not start without a
+    secret, since anyone who finds the URL could post updates (admin
+    commands included). With fast_ack the update is
+    acknowledged immediately and processed in a background task; otherwise
+    Telegram waits until the handlers are done.
+    """
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, path: str = "/webhook",
+                 secret: str = "", fast_ack: bool = True):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret or None
+        self.fast_ack = fast_ack
+        self.runner: Optional[web.AppRunner] = None
+        self.stopped = asyncio.Event()
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        SimpleRequestHandler(
+            dispatcher=self.dispatcher,
+            bot=self.bot,
+            handle_in_background=self.fast_ack,
+            secret_token=self.secret,
+        ).register(app, path=self.path)
+        app.router.add_get("/health", self._health)
+        # Emits the dispatcher startup/shutdown events with the application
+        setup_application(app, self.dispatcher, bot=self.bot)
+        return app
+
+    @staticmethod
+    async def _health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def start(self, host: str, port: int, base_url: Optional[str] = None) -> None:
+        """
+        Start serving and, if base_url is given, point the bot's webhook at it
+        Without base_url the webhook is not registered (local testing)
+        """
+        if not self.secret:
+            raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode")
+        self.runner = web.AppRunner(self.build_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+        if base_url:
+            # Updates queued while polling are delivered to the webhook, nothing is dropped
+            await self.bot.set_webhook(
+                url=base_url.rstrip("/") + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dispatcher.resolve_used_update_types(),
+                drop_pending_updates=False,
+            )
+            logger.info(f"Webhook set to {base_url.rstrip('/')}{self.path}")
+
+    async def wait_closed(self) -> None:
+        await self.stopped.wait()
+
+    async def stop(self) -> None:
+        """
+        Stop serving; the webhook stays registered so Telegram keeps queueing
+        updates until the next start (in either mode)
+        """
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+            logger.info("Webhook server stopped")
+        self.stopped.set()
@@ -0,0 +1,112 @@
+"""
+Local test harness for webhook mode.
+
+Replays recorded updates (one JSON update per line) by POSTing them to the
+webhook endpoint like Telegram does, and reports status codes and
+acknowledgement latency. With --serve the bot's webhook server is started
+in-process without registering a webhook at Telegram, so the whole ingress
+path can be exercised locally:
+
+    python webhook_replay.py --serve --repeat 100
+    python webhook_replay.py --url http://127.0.0.1:8081/webhook --secret s3cret
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import List
+
+import aiohttp
+
+DEFAULT_UPDATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples", "updates", "recorded.jsonl")
+
+
+def load_updates(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay(url: str, secret: str, updates: List[dict], repeat: int, concurrency: int) -> int:
+    """POST the updates and print a summary. Returns the number of non-200 responses"""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(session: aiohttp.ClientSession, update: dict, update_id: int) -> None:
+        # Unique update ids, as Telegram would send them
+        body = {**update, "update_id": update_id}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json=body, headers=headers) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        tasks = []
+        update_id = 0
+        for _ in range(repeat):
+            for update in updates:
+                update_id += 1
+                tasks.append(post(session, update, update["update_id"] * 1000 + update_id))
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"Sent {total} updates in {elapsed:.2f}s ({total / elapsed:.0f} updates/s)")
+    print("Status codes: " + ", ".join(f"{status}: {count}" for status, count in statuses.items()))
+    if latencies:
+        print(f"Ack latency: p50 {latencies[total // 2] * 1000:.1f} ms, "
+              f"p95 {latencies[int(total * 0.95) - 1 if total > 1 else 0] * 1000:.1f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+    return sum(count for status, count in statuses.items() if status != 200)
+
+
+async def serve_and_replay(args) -> int:
+    from main import webhook_server
+
+    await webhook_server.start(args.host, args.port)
+    try:
+        url = f"http://{args.host}:{args.port}{webhook_server.path}"
+        failures = await replay(url, webhook_server.secret or "", load_updates(args.file), args.repeat, args.concurrency)
+        # A request with a wrong secret must be rejected
+        if webhook_server.secret:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json={"update_id": 1},
+                                        headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+                    print(f"Wrong secret token: HTTP {response.status}")
+                    failures += response.status != 401
+        return failures
+    finally:
+        await webhook_server.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to the webhook endpoint")
+    parser.add_argument("--file", default=DEFAULT_UPDATES, help="JSON lines file with recorded updates")
+    parser.add_argument("--url", default=None, help="Webhook URL of a running bot")
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET", ""), help="Secret token header value")
+    parser.add_argument("--serve", action="store_true", help="Start the bot's webhook server in-process")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("WEBHOOK_PORT", "8081")))
+    parser.add_argument("--repeat", type=int, default=1, help="Times to replay the file")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight")
+    args = parser.parse_args()
+
+    if args.serve:
+        return 1 if asyncio.run(serve_and_replay(args)) else 0
+    url = args.url or f"http://{args.host}:{args.port}/webhook"
+    return 1 if asyncio.run(replay(url, args.secret, load_updates(args.file), args.repeat, args.concurrency)) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())